@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Import the scraper's modules from the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from newsmax_parser import (
+    parse_archive_page_bs4,
+    parse_archive_page_lxml,
+    parse_article_page_bs4,
+    parse_article_page_lxml,
+)
+
+SAMPLE_PAGES_DIR = Path(__file__).parent / "sample_pages"
+
+
+def time_parser(parse_page, page_html, repeat):
+    # Returns the output of the parser and the mean seconds per parse
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        output = parse_page(page_html)
+    elapsed_time = time.perf_counter() - start_time
+
+    return output, elapsed_time / repeat
+
+
+def main():
+    """
+    Micro-benchmark of the BeautifulSoup/html.parser path against the lxml
+    path of newsmax_parser over saved archive and article pages. Also checks
+    that both paths return the same output for every page
+
+    Pages saved from www.newsmax.com can be used instead of the synthetic
+    samples with --pages-dir
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Newsmax page parsers")
+    parser.add_argument(
+        "--pages-dir",
+        type=Path,
+        default=SAMPLE_PAGES_DIR,
+        help="directory of saved .html archive and article pages",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="number of times each page is parsed"
+    )
+    args = parser.parse_args()
+
+    mismatches = 0
+    totals = {"bs4": 0.0, "lxml": 0.0}
+
+    print(f"{'page':<32} {'html.parser ms':>15} {'lxml ms':>10} {'speedup':>8}  same")
+    for page_path in sorted(args.pages_dir.glob("*.html")):
+        page_html = page_path.read_text(encoding="utf-8")
+
+        # Archive pages have the list of articles, everything else is an article
+        if "archiveRepeaterUL" in page_html:
+            parsers = (parse_archive_page_bs4, parse_archive_page_lxml)
+        else:
+            parsers = (parse_article_page_bs4, parse_article_page_lxml)
+
+        bs4_output, bs4_time = time_parser(parsers[0], page_html, args.repeat)
+        lxml_output, lxml_time = time_parser(parsers[1], page_html, args.repeat)
+        totals["bs4"] += bs4_time
+        totals["lxml"] += lxml_time
+
+        same_output = bs4_output == lxml_output
+        if not same_output:
+            mismatches += 1
+
+        print(
+            f"{page_path.name:<32} {bs4_time * 1000:>15.2f} {lxml_time * 1000:>10.2f} "
+            f"{bs4_time / lxml_time:>7.1f}x  {'yes' if same_output else 'NO'}"
+        )
+
+    if totals["lxml"]:
+        print(
+            f"{'total':<32} {totals['bs4'] * 1000:>15.2f} "
+            f"{totals['lxml'] * 1000:>10.2f} {totals['bs4'] / totals['lxml']:>7.1f}x"
+        )
+
+    if mismatches:
+        print(f"{mismatches} page(s) parsed differently by the two paths.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from newsmax_standin_server import add_site_arguments, create_site, start_server
+
+SCRAPER = Path(__file__).resolve().parent.parent / "dl_newsmax_newsfront.py"
+
+
+def parse_list(value):
+    return value.split(",")
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    index = min(int(len(values) * percentile / 100), len(values) - 1)
+    return values[index]
+
+
+def count_csv_rows(filename):
+    if not filename.exists():
+        return 0
+
+    with open(filename, newline="") as file:
+        # Minus the header
+        return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+
+def run_scraper(args, server, engine, max_concurrency):
+    """
+    Run the scraper in a temporary directory against the stand-in server and
+    return its results. The scraper runs as a child process so its peak RSS
+    can be read from os.wait4()
+    """
+    server.stats.reset()
+    proxy_url = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+    year, month = args.first_month
+
+    with tempfile.TemporaryDirectory(prefix="bench_scraper_") as run_dir:
+        command = [
+            sys.executable,
+            str(SCRAPER),
+            str(year),
+            str(month),
+            "--proxy-url",
+            proxy_url,
+            "--engine",
+            engine,
+            "--max-concurrency",
+            str(max_concurrency),
+            "--max-rate",
+            str(args.max_rate),
+            "--archive-workers",
+            str(args.archive_workers),
+            "--no-cache",
+            "--no-resume",
+        ]
+        environment = dict(os.environ, SCRAPEOPS_API_KEY="standin")
+
+        with open(Path(run_dir) / "scraper.log", "w") as log_file:
+            start_time = time.monotonic()
+            process = subprocess.Popen(
+                command,
+                cwd=run_dir,
+                env=environment,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+            )
+            _, exit_status, resource_usage = os.wait4(process.pid, 0)
+            elapsed_time = time.monotonic() - start_time
+            # The process was reaped by wait4(), don't let Popen wait for it
+            process.returncode = os.waitstatus_to_exitcode(exit_status)
+
+        articles = count_csv_rows(Path(run_dir) / "newsmax_articles.csv")
+        if process.returncode != 0:
+            print((Path(run_dir) / "scraper.log").read_text()[-2000:])
+
+    stats = server.stats.to_dict()
+    return {
+        "engine": engine,
+        "max_concurrency": max_concurrency,
+        "exit_code": process.returncode,
+        "articles": articles,
+        "seconds": round(elapsed_time, 3),
+        "articles_per_sec": round(articles / elapsed_time, 2),
+        "requests": stats["requests"],
+        "statuses": stats["statuses"],
+        "latency_p50_ms": round(get_percentile(stats["latencies"], 50) * 1000, 1),
+        "latency_p99_ms": round(get_percentile(stats["latencies"], 99) * 1000, 1),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource_usage.ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    """
+    Throughput benchmark of the scraper against the local stand-in server.
+    Runs the scraper once for every engine and max concurrency and reports
+    articles/sec, the p50/p99 latency of the requests served by the stand-in
+    and the scraper's peak RSS. Exits with 1 if a run failed or didn't save
+    every article of the archive
+
+    Example, 3 months of 200 articles with 100 ms responses and 2% of 503s:
+
+        python benchmarks/bench_scraper.py --articles-per-month 200 \\
+            --latency 0.1 --error-rate 0.02 --concurrency 1,5,10
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Newsmax scraper")
+    parser.add_argument(
+        "--engines",
+        type=parse_list,
+        default=["threads", "async"],
+        help="comma-separated engines to run (default: threads,async)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(size) for size in parse_list(value)],
+        default=[1, 5, 10],
+        help="comma-separated --max-concurrency values to run (default: 1,5,10)",
+    )
+    parser.add_argument(
+        "--archive-workers",
+        type=int,
+        default=2,
+        help="--archive-workers of every run (default: 2)",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=1000.0,
+        help="--max-rate of every run, high so only the concurrency limits the "
+        "runs (default: 1000)",
+    )
+    parser.add_argument(
+        "--json", type=Path, help="also write the results to this JSON file"
+    )
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(
+        create_site(args),
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        credits=args.credits,
+    )
+    expected_articles = sum(
+        args.articles_per_month[month_index % len(args.articles_per_month)]
+        for month_index in range(args.months)
+    )
+
+    results = []
+    failed_runs = 0
+    print(
+        f"{'engine':<8} {'concurrency':>11} {'articles':>9} {'seconds':>8} "
+        f"{'articles/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>11}"
+    )
+    for engine in args.engines:
+        for max_concurrency in args.concurrency:
+            result = run_scraper(args, server, engine, max_concurrency)
+            results.append(result)
+            if result["exit_code"] != 0 or result["articles"] != expected_articles:
+                failed_runs += 1
+
+            print(
+                f"{engine:<8} {max_concurrency:>11} {result['articles']:>9} "
+                f"{result['seconds']:>8.2f} {result['articles_per_sec']:>10.2f} "
+                f"{result['latency_p50_ms']:>8.1f} {result['latency_p99_ms']:>8.1f} "
+                f"{result['peak_rss_mb']:>11.1f}"
+            )
+
+    server.shutdown()
+
+    if args.json:
+        args.json.write_text(
+            json.dumps(
+                {"expected_articles": expected_articles, "runs": results}, indent=2
+            )
+        )
+
+    if failed_runs:
+        print(
+            f"{failed_runs} run(s) failed or saved fewer than the "
+            f"{expected_articles} articles of the archive."
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Words the synthetic titles and paragraphs are made of
+WORDS = (
+    "the senate house president vote bill campaign economy report said officials "
+    "washington state court federal new policy week plan tax security border news "
+    "national leaders statement during according former public"
+).split()
+MONTH_ABBREVIATIONS = tuple("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split())
+
+ARCHIVE_URL = re.compile(r"/archives/newsfront/16/(\d{4})/(\d{1,2})$")
+ARTICLE_URL = re.compile(r"/newsfront/[^/]+/(\d{4})/(\d{2})/(\d{2})/id/(\d+)/$")
+
+# Archive page the site redirects to once a month has no archive
+END_OF_ARCHIVE_PAGE = (
+    "<!DOCTYPE html><html><head><title>Page Not Found</title>"
+    '<link rel="canonical" href="https://www.newsmax.com/404/" /></head>'
+    "<body><p>The page you requested could not be found.</p></body></html>"
+)
+
+
+def get_words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_page_parts(seed):
+    """
+    Returns the <head> and the header and footer of the pages. They are the
+    same on every page so they are only built once. With them the pages are
+    about the size of the real ones: ~100 KB archive pages and 25-35 KB
+    articles
+    """
+    rng = random.Random(seed)
+    links = "".join(
+        f'<link rel="stylesheet" href="/Content/css/{i}.css" />\n' for i in range(15)
+    )
+    styles = (
+        "<style>"
+        + "".join(f".c{i}{{margin:{i}px;padding:0}}" for i in range(120))
+        + "</style>\n"
+    )
+    scripts = "".join(
+        f'<script type="text/javascript">var ad{i} = {{slot: "{get_words(rng, 2)}", '
+        "sizes: [[300, 250], [728, 90]]};</script>\n"
+        for i in range(25)
+    )
+    head = links + styles + scripts + "</head>\n"
+
+    nav_items = "".join(
+        f'<li class="navItem"><a href="/{word}/">{word.title()}</a><ul class="subNav">'
+        + "".join(
+            f'<li><a href="/{word}/{i}/">{get_words(rng, 2)}</a></li>' for i in range(8)
+        )
+        + "</ul></li>\n"
+        for word in WORDS[:20]
+    )
+    header = f'<body>\n<div id="header"><ul class="nav">{nav_items}</ul></div>\n'
+
+    footer = (
+        '<div id="footer">'
+        + "".join(
+            f"<p>{get_words(rng, 12)} &copy; Newsmax Media, Inc.</p>" for _ in range(30)
+        )
+        + "</div>\n<!-- analytics -->\n<script>window.dataLayer = [];</script>\n"
+        "</body>\n</html>\n"
+    )
+
+    return head, header, footer
+
+
+class StandinSite:
+    """
+    Synthetic Newsmax "Newsfront" archive. months months starting at
+    first_month have archive pages; the archive pages after them are the 404
+    page, like the real archive after the current month. The number of
+    articles of each month is taken in turn from articles_per_month
+
+    Pages are generated from a seed made of their URL so the same URL always
+    returns the same page
+    """
+
+    def __init__(self, first_month, months, articles_per_month, paragraphs, seed=7):
+        self.first_month = first_month
+        self.months = months
+        self.articles_per_month = articles_per_month
+        self.paragraphs = paragraphs
+        self.seed = seed
+        self.head, self.header, self.footer = make_page_parts(seed)
+
+    def get_month_index(self, year, month):
+        return (year - self.first_month[0]) * 12 + month - self.first_month[1]
+
+    def get_page(self, url):
+        # Returns the HTML of the page at url, or None if there isn't one
+        path = urlparse(url).path
+
+        match = ARCHIVE_URL.search(path)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+            month_index = self.get_month_index(year, month)
+            if month_index >= self.months:
+                return END_OF_ARCHIVE_PAGE
+            if month_index < 0:
+                return self.get_archive_page(year, month, 0)
+            article_count = self.articles_per_month[
+                month_index % len(self.articles_per_month)
+            ]
+            return self.get_archive_page(year, month, article_count)
+
+        match = ARTICLE_URL.search(path)
+        if match:
+            return self.get_article_page(
+                path, *(int(group) for group in match.groups())
+            )
+
+        return None
+
+    def get_archive_page(self, year, month, article_count):
+        rng = random.Random(f"{self.seed}-{year}-{month}")
+
+        items = []
+        for i in range(article_count):
+            day = rng.randint(1, 28)
+            title = get_words(rng, rng.randint(5, 11)).title() + rng.choice(
+                ["", " &amp; More", "'s Plan", " &#8212; Report"]
+            )
+            slug = re.sub(r"[^a-z]+", "-", title.lower()).strip("-")
+            # The month's number makes the ids of different months unique
+            article_id = (year * 100 + month) * 100000 + i
+            href = f"/newsfront/{slug}/{year}/{month:02d}/{day:02d}/id/{article_id}/"
+            items.append(
+                f'<li>\n<div class="archiveImg"><a class="imgLink" href="{href}">'
+                f'<img src="/images/{i}.jpg" alt="" /></a></div>\n'
+                f'<h5 class="archiveH5"><a class="" href="{href}">{title}</a>\n'
+                f'<span class="copy"> {MONTH_ABBREVIATIONS[month - 1]} {day:02d}, '
+                f"{year} </span></h5>\n"
+                f'<div class="archiveTeaser">{get_words(rng, 25)}</div>\n</li>\n'
+            )
+
+        return (
+            '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8" />\n'
+            f"<title>Newsfront Archive {month}/{year} | Newsmax.com</title>\n"
+            + self.head
+            + self.header
+            + '<div id="archive"><ul class="archiveRepeaterUL">\n'
+            + "".join(items)
+            + "</ul></div>\n"
+            + self.footer
+        )
+
+    def get_article_page(self, path, year, month, day, article_id):
+        rng = random.Random(f"{self.seed}-{path}")
+
+        paragraphs = []
+        for i in range(self.paragraphs):
+            paragraph = f"<p>{get_words(rng, rng.randint(20, 60))}"
+            if i % 3 == 0:
+                paragraph += f' <a href="/politics/{i}/">{get_words(rng, 3)}</a>'
+            if i % 4 == 0:
+                paragraph += f" <em>{get_words(rng, 2)}</em> &amp; {get_words(rng, 3)}"
+            paragraph += f" {get_words(rng, 10)}.</p>\n"
+            paragraphs.append(paragraph)
+            if i % 6 == 5:
+                paragraphs.append(
+                    '<div class="inlineAd">'
+                    '<script>googletag.display("ad");</script></div>\n'
+                )
+
+        published_time = (
+            f"{year}-{month:02d}-{day:02d}T{article_id % 24:02d}:"
+            f"{article_id % 60:02d}:00-04:00"
+        )
+        return (
+            '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="utf-8" />\n'
+            f"<title>{get_words(rng, 8).title()} | Newsmax.com</title>\n"
+            f'<meta property="article:published_time" content="{published_time}" />\n'
+            + self.head
+            + self.header
+            + '<div id="mainArticleDiv">\n'
+            + "".join(paragraphs)
+            + "</div>\n"
+            + self.footer
+        )
+
+
+class StandinStats:
+    # Counts of the requests served, shared by the handler threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.statuses = {}
+            self.bytes_sent = 0
+            self.latencies = []
+
+    def add(self, status_code, size, latency):
+        with self.lock:
+            self.requests += 1
+            self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+            self.bytes_sent += size
+            self.latencies.append(latency)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "statuses": {str(code): count for code, count in self.statuses.items()},
+                "bytes_sent": self.bytes_sent,
+                "latencies": list(self.latencies),
+            }
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the ScrapeOps proxy: GET /v1/?api_key=...&url=... returns the
+    page at url. Every response is delayed by the configured latency and a
+    share of them fail with 503 or 429. Once the credits are used up every
+    request fails with 401. GET /stats returns the counts of the
+    requests served as JSON, GET /stats?reset=1 also resets them
+    """
+
+    # Keep-alive connections, like the real proxy. The headers and the body
+    # are sent in two writes so without TCP_NODELAY every response would wait
+    # for the client's delayed ACK
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start_time = time.monotonic()
+        request_url = urlparse(self.path)
+        query = parse_qs(request_url.query)
+
+        if request_url.path == "/stats":
+            stats = self.server.stats.to_dict()
+            if query.get("reset"):
+                self.server.stats.reset()
+            self.send_page(200, json.dumps(stats), "application/json")
+            return
+
+        if request_url.path.rstrip("/") != "/v1":
+            self.send_page(404, "Not Found")
+            return
+
+        config = self.server.config
+        latency = config["latency"]
+        if config["latency_jitter"]:
+            latency = max(
+                random.gauss(latency, latency * config["latency_jitter"]), 0.0
+            )
+        time.sleep(latency)
+
+        error_draw = random.random()
+        credits = config["credits"]
+        if not query.get("api_key") or (
+            credits is not None and self.server.stats.requests >= credits
+        ):
+            status_code, page_html = 401, "Unauthorized"
+        elif error_draw < config["error_rate"]:
+            status_code, page_html = 503, "Service Unavailable"
+        elif error_draw < config["error_rate"] + config["throttle_rate"]:
+            status_code, page_html = 429, "Too Many Requests"
+        else:
+            page_html = self.server.site.get_page(query.get("url", [""])[0])
+            if page_html is None:
+                status_code, page_html = 404, "Not Found"
+            else:
+                status_code = 200
+
+        size = self.send_page(status_code, page_html)
+        self.server.stats.add(status_code, size, time.monotonic() - start_time)
+
+    def send_page(self, status_code, body, content_type="text/html; charset=utf-8"):
+        body = body.encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The scraper cancelled the request, e.g. when it stopped
+            self.close_connection = True
+            return 0
+
+        return len(body)
+
+
+def start_server(
+    site,
+    port=0,
+    latency=0.0,
+    latency_jitter=0.0,
+    error_rate=0.0,
+    throttle_rate=0.0,
+    credits=None,
+):
+    # Start the server on a background thread and return it. Port 0 picks a
+    # free port, the port used is server.server_address[1]
+    server = ThreadingHTTPServer(("127.0.0.1", port), StandinHandler)
+    server.daemon_threads = True
+    server.site = site
+    server.stats = StandinStats()
+    server.config = {
+        "latency": latency,
+        "latency_jitter": latency_jitter,
+        "error_rate": error_rate,
+        "throttle_rate": throttle_rate,
+        "credits": credits,
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def parse_year_month(value):
+    year, month = value.split("-")
+    return int(year), int(month)
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def add_site_arguments(parser):
+    # Options shared with bench_scraper.py
+    parser.add_argument(
+        "--first-month",
+        type=parse_year_month,
+        default=(2007, 7),
+        help="YYYY-MM first month of the archive (default: 2007-07)",
+    )
+    parser.add_argument(
+        "--months",
+        type=int,
+        default=3,
+        help="number of months in the archive before the 404 page (default: 3)",
+    )
+    parser.add_argument(
+        "--articles-per-month",
+        type=parse_sizes,
+        default=[100],
+        help="comma-separated number of articles of each month, used in turn "
+        "(default: 100)",
+    )
+    parser.add_argument(
+        "--paragraphs",
+        type=int,
+        default=12,
+        help="paragraphs in each article (default: 12)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="seconds each response is delayed (default: 0.05)",
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.2,
+        help="standard deviation of the latency as a fraction of it (default: 0.2)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of the requests that fail with 503 (default: 0)",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="share of the requests that fail with 429 (default: 0)",
+    )
+    parser.add_argument(
+        "--credits",
+        type=int,
+        help="number of requests served before every request fails with 401, "
+        "like a ScrapeOps plan running out of credits (default: unlimited)",
+    )
+
+
+def create_site(args):
+    return StandinSite(
+        args.first_month, args.months, args.articles_per_month, args.paragraphs
+    )
+
+
+def main():
+    """
+    Local stand-in for the ScrapeOps proxy and the Newsmax archive so the
+    scraper can be run without using ScrapeOps credits:
+
+        python benchmarks/newsmax_standin_server.py --port 8765
+        python dl_newsmax_newsfront.py 2007 7 --proxy-url http://127.0.0.1:8765/v1/
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve a synthetic Newsmax archive through a fake ScrapeOps proxy"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="port to listen on (default: 8765)"
+    )
+    add_site_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(
+        create_site(args),
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        credits=args.credits,
+    )
+    print(
+        f"Serving on http://127.0.0.1:{server.server_address[1]}/v1/ (Ctrl+C to stop)"
+    )
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
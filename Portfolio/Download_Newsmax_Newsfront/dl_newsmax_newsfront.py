@@ -1,77 +1,314 @@
 import argparse
-import concurrent.futures
-import csv
+import asyncio
 import logging
 import os
 import signal
 import sys
 import threading
+import time
 from datetime import datetime
-from pathlib import Path
 from urllib.parse import urlencode
 
 import requests
-from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
 
-# at_end_of_archive = "false"
+from newsmax_crawl_state import CrawlState
+from newsmax_metrics import Metrics, StatsLogger, start_metrics_server
+from newsmax_parser import parse_archive_page, parse_article_page
+from newsmax_rate_limiter import AsyncRateLimiter, ThreadRateLimiter
+from newsmax_response_cache import ResponseCache
+from newsmax_search_index import SearchIndex
+from newsmax_scheduler import (
+    POLL_INTERVAL as SCHEDULER_POLL_INTERVAL,
+    AsyncCrawlScheduler,
+    ThreadCrawlScheduler,
+    iter_archive_months,
+)
+from newsmax_writer import (
+    ArticleWriter,
+    CsvArticleSink,
+    ParquetArticleSink,
+    WriterError,
+    pa,
+)
 
-articles_saved = 0
+try:
+    import aiohttp
+except ImportError:
+    # Only needed by the async engine
+    aiohttp = None
+
+# ScrapeOps proxy endpoint. Can be changed with the SCRAPEOPS_PROXY_URL
+# environment variable or --proxy-url, e.g. to point the scraper at the local
+# stand-in server in benchmarks/
+SCRAPEOPS_PROXY_URL = "https://proxy.scrapeops.io/v1/"
+
+# Max number of concurrent requests of the current ScrapeOps subscription.
+# Every request sent to the proxy (archive pages and articles) counts
+# against it
+MAX_CONCURRENT_REQUESTS = 5
+# Max number of archive pages fetched at the same time
+ARCHIVE_WORKERS = 2
+# Another archive page is only fetched while fewer than ARTICLE_QUEUE_SIZE
+# article URLs are waiting to be fetched so memory stays bounded no matter
+# how many months are left
+ARTICLE_QUEUE_SIZE = 100
+
+# Months and article URLs already downloaded so a stopped run can pick up
+# where it left off
+CRAWL_STATE_FILE = "newsmax_crawl_state.db"
+
+# Pages downloaded through the proxy are cached so reprocessing a month
+# doesn't use ScrapeOps credits. The least recently used pages are evicted
+# once the cache is over RESPONSE_CACHE_SIZE bytes
+RESPONSE_CACHE_FILE = "newsmax_response_cache.db"
+RESPONSE_CACHE_SIZE = 1024 * 1024 * 1024
+# Seconds before the cached archive page of the current month expires as it
+# still gets new articles
+ARCHIVE_CACHE_TTL = 6 * 60 * 60
+
+# Output files. Articles are written to one .CSV or to Parquet files
+# partitioned by year/month under PARQUET_DIR
+CSV_FILE = "newsmax_articles.csv"
+PARQUET_DIR = "newsmax_articles"
+PARQUET_ROW_GROUP_SIZE = 1000
+PARQUET_COMPRESSION = "zstd"
+
+# Full-text index the saved articles can also be added to as they are
+# written, searched with search_newsmax_articles.py
+SEARCH_INDEX_FILE = "newsmax_search_index.db"
+
+# Rows are written to the .CSV in batches of WRITER_BATCH_SIZE or every
+# WRITER_FLUSH_INTERVAL seconds, whichever comes first
+WRITER_BATCH_SIZE = 100
+WRITER_FLUSH_INTERVAL = 5.0
+
+# A JSON snapshot of the metrics of every stage is appended to STATS_FILE
+# every STATS_INTERVAL seconds
+STATS_FILE = "newsmax_stats.jsonl"
+STATS_INTERVAL = 60
+
+# Max requests/sec sent to the proxy. The rate limiter backs off from it
+# (and from max concurrency) when the proxy is overloaded
+MAX_REQUEST_RATE = 10.0
+
+# Retry requests that fail with these statuses 5 times, waiting longer
+# between each retry
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 1
+RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504]
+
+# Seconds the async engine keeps DNS lookups of the proxy and idle
+# connections to it
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+# Set when the ScrapeOps credits are used up or Ctrl+C is pressed so that
+# every worker stops taking new work
+stop_event = threading.Event()
+# Set when the end of the archive is reached. No more archive pages are
+# requested but the articles already queued are still downloaded
+archive_end_event = threading.Event()
+
+# Set up by main() from the command line options
+scrapeops_proxy_url = SCRAPEOPS_PROXY_URL
+response_cache = None
+archive_cache_ttl = ARCHIVE_CACHE_TTL
+# Only serve pages from response_cache, nothing is requested from the proxy
+offline_mode = False
+
+# Each thread keeps one requests.Session so its connections to the proxy are
+# reused for every page it fetches
+thread_local = threading.local()
+
+# Counters and timings of every stage. The page label is "archive" or
+# "article"
+metrics = Metrics("newsmax_scraper")
+metrics.counter("requests_total", "Requests sent to the proxy by page and HTTP status")
+metrics.counter("retries_total", "Requests to the proxy that were retried")
+metrics.counter("response_bytes_total", "Bytes of the pages received from the proxy")
+metrics.counter("errors_total", "Failed requests and pages by page and error type")
+metrics.histogram("fetch_seconds", "Seconds of each request to the proxy")
+metrics.histogram("parse_seconds", "Seconds parsing each page")
+metrics.histogram(
+    "writer_wait_seconds", "Seconds waiting for room in the writer's queue"
+)
 
 
 def sigint_handler(signal_num, frame):
-    # Handle when Ctrl+C is pressed
+    # Handle when Ctrl+C is pressed. The workers finish their requests in
+    # flight and return, then main() saves the rows still waiting and closes
+    # the files
     print(" Ctrl+C pressed. Gracefully exiting program")
-    sys.exit(0)
+    stop_event.set()
 
 
-def get_archive_start_date():
+def async_sigint_handler():
+    # Handle when Ctrl+C is pressed while the async engine is running. The
+    # requests in flight are finished before the program exits
+    print(" Ctrl+C pressed. Gracefully exiting program")
+    stop_event.set()
+
+
+def parse_arguments():
     # Get year and date of the Newsmax archive to start downloading
     parser = argparse.ArgumentParser(
         prog="dl_newsmax_articles",
         description='Downloads all news articles from Newsmax\'s "Newfront" section',
-        usage="%(prog)s [year] (YYYY) [month] (M or MM)",
+        usage="%(prog)s [year] (YYYY) [month] (M or MM) [options]",
     )
     parser.add_argument("year", type=int, help="YYYY year of archive")
     parser.add_argument("month", type=int, help="MM month of archive")
-    args = parser.parse_args()
-
-    archive_year = args.year
-    archive_month = args.month
-
-    return archive_year, archive_month
-
-
-def create_archive_year_month_queue(archive_year, archive_month):
-    year_month_queue = []
-
-    # Create 2D list that has a starting year/month on the based
-    # archive_year/ archive_month that was input
-    months = list(range(archive_month, 13))
-    for month in months:
-        year_month_queue.append((archive_year, month))
-
-    # Then append the additional years/months to the list. The
-    # program will exit if "www.newsmax.com/404/" received in the
-    # HTTP response so the "end_year"/month may not be reached
-    today_date = datetime.today()
-    end_year = int(today_date.strftime("%Y"))
-
-    years = range(archive_year + 1, end_year + 1)
-    months = list(range(1, 13))
-    for year in years:
-        for month in months:
-            year_month_queue.append((year, month))
-
-    logging.debug("-- Year/Month Queue: ")
-    logging.debug(f"{year_month_queue}")
+    parser.add_argument(
+        "--proxy-url",
+        default=os.getenv("SCRAPEOPS_PROXY_URL", SCRAPEOPS_PROXY_URL),
+        help="ScrapeOps proxy endpoint the pages are requested through (default: "
+        f"$SCRAPEOPS_PROXY_URL or {SCRAPEOPS_PROXY_URL})",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="run the fetches in a thread pool or as asyncio coroutines over one "
+        "shared aiohttp connection pool (default: threads)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=MAX_CONCURRENT_REQUESTS,
+        help="max number of requests in flight to the ScrapeOps proxy "
+        f"(default: {MAX_CONCURRENT_REQUESTS})",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=MAX_REQUEST_RATE,
+        help="max requests/sec sent to the ScrapeOps proxy. Concurrency and rate "
+        "back off from their max when the proxy returns 429/5xx or slows down "
+        f"(default: {MAX_REQUEST_RATE})",
+    )
+    parser.add_argument(
+        "--archive-workers",
+        type=int,
+        default=ARCHIVE_WORKERS,
+        help="max number of archive pages fetched at the same time "
+        f"(default: {ARCHIVE_WORKERS})",
+    )
+    parser.add_argument(
+        "--state-file",
+        default=CRAWL_STATE_FILE,
+        help="SQLite file keeping track of the months and articles already "
+        f"downloaded (default: {CRAWL_STATE_FILE})",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="download every month again instead of skipping the months and "
+        "articles already downloaded",
+    )
+    parser.add_argument(
+        "--cache-file",
+        default=RESPONSE_CACHE_FILE,
+        help="SQLite file the downloaded pages are cached in "
+        f"(default: {RESPONSE_CACHE_FILE})",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=RESPONSE_CACHE_SIZE // (1024 * 1024),
+        help="max MB of compressed pages kept in the cache "
+        f"(default: {RESPONSE_CACHE_SIZE // (1024 * 1024)})",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=ARCHIVE_CACHE_TTL,
+        help="seconds before the cached archive page of the current month expires "
+        f"(default: {ARCHIVE_CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="don't cache the downloaded pages"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="only read the pages from the cache, nothing is requested from the "
+        "proxy. Use with --no-resume to reprocess months already downloaded",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["csv", "parquet"],
+        default="csv",
+        help=f"write the articles to {CSV_FILE} or to Parquet files partitioned by "
+        f"year/month under {PARQUET_DIR}/ (default: csv)",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=PARQUET_ROW_GROUP_SIZE,
+        help=f"rows per Parquet row group (default: {PARQUET_ROW_GROUP_SIZE})",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["zstd", "snappy", "gzip", "none"],
+        default=PARQUET_COMPRESSION,
+        help=f"compression of the Parquet files (default: {PARQUET_COMPRESSION})",
+    )
+    parser.add_argument(
+        "--search-index",
+        nargs="?",
+        const=SEARCH_INDEX_FILE,
+        help="also add the saved articles to the full-text index in this SQLite "
+        f"file (default file: {SEARCH_INDEX_FILE})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=WRITER_BATCH_SIZE,
+        help="number of rows written to the .CSV at a time "
+        f"(default: {WRITER_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=WRITER_FLUSH_INTERVAL,
+        help="max seconds a row waits before it is written to the .CSV "
+        f"(default: {WRITER_FLUSH_INTERVAL})",
+    )
+    parser.add_argument(
+        "--stats-file",
+        default=STATS_FILE,
+        help="file a JSON snapshot of the metrics of every stage is appended to "
+        f"(default: {STATS_FILE})",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=STATS_INTERVAL,
+        help="seconds between two snapshots in the stats file, 0 to only write "
+        f"one at the end (default: {STATS_INTERVAL})",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve the metrics in the Prometheus text format at "
+        "http://127.0.0.1:<port>/metrics while the program runs",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print debug logging messages"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=ARTICLE_QUEUE_SIZE,
+        help="max number of article URLs waiting to be fetched before another "
+        f"archive page is fetched (default: {ARTICLE_QUEUE_SIZE})",
+    )
 
-    return year_month_queue
+    return parser.parse_args()
 
 
 def save_to_storage(
-    filename,
+    article_writer,
     news_article_title,
     news_article_url,
     news_article_month,
@@ -80,54 +317,24 @@ def save_to_storage(
     news_article_datetime,
     news_article_string,
 ):
-    global articles_saved
-    csv_writer_lock = threading.Lock()
-    data_file = Path(filename)
-
-    # sleep(5)
-
-    if data_file.exists():
-        with open(filename, "a+") as file:
-            with csv_writer_lock:
-                writer = csv.writer(file)
-                writer.writerow(
-                    [
-                        news_article_title,
-                        news_article_url,
-                        news_article_month,
-                        news_article_day,
-                        news_article_year,
-                        news_article_datetime,
-                        news_article_string,
-                    ]
-                )
-            articles_saved += 1
-            print(f"Articles saved: {articles_saved}", end="\r")
-    else:
-        # Column headers
-        headers = "news_article_url,news_article_month,news_article_day,news_article_year,news_article_datetime,news_article_contents"
-
-        with open(filename, "a+") as file:
-            with csv_writer_lock:
-                writer = csv.writer(file)
-                file.write(headers + "\n")
-                writer.writerow(
-                    [
-                        news_article_title,
-                        news_article_url,
-                        news_article_month,
-                        news_article_day,
-                        news_article_year,
-                        news_article_datetime,
-                        news_article_string,
-                    ]
-                )
-            articles_saved += 1
-            print(f"Articles saved: {articles_saved}", end="\r")
+    # Hand the row over to the writer stage which writes it to the .CSV. put()
+    # blocks while the writer's queue is full
+    start_time = time.monotonic()
+    article_writer.put(
+        [
+            news_article_title,
+            news_article_url,
+            news_article_month,
+            news_article_day,
+            news_article_year,
+            news_article_datetime,
+            news_article_string,
+        ]
+    )
+    metrics.observe("writer_wait_seconds", time.monotonic() - start_time)
 
 
 def get_scrapeops_url(url):
-    scrapeops_proxy_url = "https://proxy.scrapeops.io/v1/"
     scrapeops_api_key = os.getenv("SCRAPEOPS_API_KEY")
 
     payload = {
@@ -138,159 +345,812 @@ def get_scrapeops_url(url):
     return scrapeops_proxy_url, payload
 
 
-def scrape_article_data(year_month_queue_sublist):
+def get_archive_url(year_month_queue_sublist):
     archive_year = year_month_queue_sublist[0]
     archive_month = year_month_queue_sublist[1]
-    logging.debug(
-        f"-- Current Archive Year/Month Working On: {archive_year},{archive_month}"
-    )
 
-    session = requests.Session()
-
-    news_archive_url = (
+    return (
         "https://www.newsmax.com/archives/newsfront/16/"
         + str(archive_year)
         + "/"
         + str(archive_month)
     )
 
-    scrapeops_proxy_url, payload = get_scrapeops_url(news_archive_url)
 
+def get_backoff_time(retry_number):
+    # Same backoff as urllib3's Retry: no wait before the first retry, then
+    # backoff_factor * 2^(retry_number - 1) seconds, capped at 120 seconds
+    if retry_number <= 1:
+        return 0
+    return min(RETRY_BACKOFF_FACTOR * (2 ** (retry_number - 1)), 120)
+
+
+def check_page(status_code, page_html, url, page_type):
     """
-    EXTRACT: Get URLs of news articles
+    Return the page's HTML if the request succeeded. Otherwise handle reaching
+    the end of the archive or running out of ScrapeOps credits and return None
     """
-    retries = Retry(total=5, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-
-    try:
-        response = session.get(scrapeops_proxy_url, params=urlencode(payload))
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as error:
-        print(f"HTTP Error: {error}")
-    except requests.exceptions.ConnectionError as error:
-        print(f"Connection Failed: {error}")
-    except requests.exceptions.Timeout as error:
-        print(f"Timeout Occurred: {error}")
-    except requests.exceptions.RequestException as error:
-        if "www.newsmax.com/404/" in response.text:
+    if "www.newsmax.com/404/" in page_html:
+        # Archive pages of the following months may be in flight too
+        if not archive_end_event.is_set():
             print("\nReached the end of the archive; no more articles to download.")
-            sys.exit(0)
-        elif response.status_code == 401:
-            print("HTTP 401. All ScrapeOps credits used.")
-            sys.exit(0)
-        print(f"An Error Occurred: {error}")
-
-    news_bsoup = BeautifulSoup(response.text, "html.parser")
-    news_articles = news_bsoup.find("ul", class_="archiveRepeaterUL")
-    news_article_titles_and_urls = news_articles.find_all("h5", class_="archiveH5")
-    logging.debug("-- News Article Titles And URLs:")
-    logging.debug(f"{news_article_titles_and_urls}")
+            archive_end_event.set()
+        return None
+    if status_code >= 400:
+        metrics.inc("errors_total", page=page_type, type=f"http_{status_code}")
+    if status_code == 401:
+        print("HTTP 401. All ScrapeOps credits used.")
+        stop_event.set()
+        return None
+    if status_code >= 400:
+        print(f"HTTP Error: {status_code} for url: {url}")
+        return None
+
+    return page_html
+
+
+def get_archive_cache_ttl(year_month_queue_sublist):
+    # The archive page of the current month (or a month after it, the end of
+    # the archive) expires. The pages of past months never change
+    today_date = datetime.today()
+    if tuple(year_month_queue_sublist) >= (today_date.year, today_date.month):
+        return archive_cache_ttl
+
+    return None
+
+
+def read_cache(url):
+    # Returns the cached page, or None if it has to be requested from the proxy
+    if response_cache is None:
+        return None
+
+    return response_cache.get(url)
+
+
+def write_cache(url, page_html, cache_ttl):
+    # page_html is what check_page() returned: None for the error pages and
+    # the redirects to the 404 page, which are not cached
+    if response_cache is not None and page_html is not None:
+        response_cache.put(url, page_html, cache_ttl)
+
+
+def record_request(page_type, status_code, latency, size):
+    # status_code is None when the request failed without a response
+    metrics.inc(
+        "requests_total",
+        page=page_type,
+        status=str(status_code) if status_code is not None else "none",
+    )
+    metrics.observe("fetch_seconds", latency, page=page_type)
+    if size:
+        metrics.inc("response_bytes_total", size, page=page_type)
+
+
+def record_error(page_type, error_type):
+    metrics.inc("errors_total", page=page_type, type=error_type)
+
+
+def timed_parse(parse_page, page_type, page_html):
+    start_time = time.monotonic()
+    result = parse_page(page_html)
+    metrics.observe("parse_seconds", time.monotonic() - start_time, page=page_type)
+
+    return result
+
+
+def get_session():
+    # Create the thread's session the first time it is needed. Retries are
+    # done by fetch_page so that the rate limiter sees every failed request
+    if not hasattr(thread_local, "session"):
+        thread_local.session = requests.Session()
+
+    return thread_local.session
+
+
+def fetch_page(url, rate_limiter, cache_ttl=None, page_type="article"):
+    """
+    Fetch a page through the ScrapeOps proxy and return its HTML, or None if
+    the request failed. Every request waits for the rate limiter so all
+    threads together never go over the concurrency budget, and its outcome is
+    reported back so the limiter can back off when the proxy is overloaded
+
+    Requests that fail with a connection error or one of
+    RETRY_STATUS_FORCELIST are retried RETRY_TOTAL times with an exponential
+    backoff. Cached pages are returned without making a request
+    """
+    page_html = read_cache(url)
+    if page_html is not None:
+        return check_page(200, page_html, url, page_type)
+    if offline_mode:
+        print(f"Not in the cache: {url}")
+        return None
+
+    session = get_session()
+    proxy_url, payload = get_scrapeops_url(url)
+    last_error = None
+
+    for retry_number in range(RETRY_TOTAL + 1):
+        if stop_event.is_set():
+            return None
+        if retry_number > 0:
+            metrics.inc("retries_total", page=page_type)
+            time.sleep(get_backoff_time(retry_number))
+
+        if not rate_limiter.acquire():
+            return None
+        start_time = time.monotonic()
+        response = request_error = None
+        try:
+            response = session.get(proxy_url, params=urlencode(payload))
+        except requests.exceptions.RequestException as error:
+            request_error = error
+        finally:
+            # Exactly one release per acquire, even if the request raised
+            # something else, so the slot isn't lost
+            latency = time.monotonic() - start_time
+            rate_limiter.release(
+                response.status_code if response is not None else None, latency
+            )
+
+        if isinstance(request_error, requests.exceptions.ConnectionError):
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "connection")
+            last_error = f"Connection Failed: {request_error}"
+            continue
+        if isinstance(request_error, requests.exceptions.Timeout):
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "timeout")
+            last_error = f"Timeout Occurred: {request_error}"
+            continue
+        if request_error is not None:
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "request")
+            print(f"An Error Occurred: {request_error}")
+            return None
+        record_request(page_type, response.status_code, latency, len(response.content))
+
+        if response.status_code in RETRY_STATUS_FORCELIST:
+            record_error(page_type, f"http_{response.status_code}")
+            last_error = f"HTTP Error: {response.status_code} for url: {url}"
+            continue
+
+        page_html = check_page(response.status_code, response.text, url, page_type)
+        write_cache(url, page_html, cache_ttl)
+        return page_html
+
+    record_error(page_type, "gave_up")
+    print(f"{last_error} (gave up after {RETRY_TOTAL} retries)")
+    return None
+
+
+def save_article(article_writer, article, news_article_datetime, news_article_string):
+    """
+    LOAD: Save article data to .CSV file
+    """
+    (
+        news_article_title,
+        news_article_url,
+        news_article_month,
+        news_article_day,
+        news_article_year,
+    ) = article
+
+    save_to_storage(
+        article_writer,
+        news_article_title,
+        news_article_url,
+        news_article_month,
+        str(news_article_day),
+        str(news_article_year),
+        news_article_datetime,
+        news_article_string,
+    )
+
+
+def filter_archive_articles(year_month_queue_sublist, articles, crawl_state):
+    # Skip the articles that were saved by a previous run before any request
+    # is made for them
+    if crawl_state is None:
+        return articles
+
+    new_articles = crawl_state.filter_new_articles(articles)
+    logging.debug(
+        f"-- {len(articles) - len(new_articles)} articles of "
+        f"{year_month_queue_sublist} already saved"
+    )
+    crawl_state.start_month(year_month_queue_sublist, new_articles)
+
+    return new_articles
+
+
+def scrape_archive_page(year_month_queue_sublist, rate_limiter, crawl_state):
+    """
+    EXTRACT: Get URLs of news articles
+    """
     logging.debug(
-        f"-- Number Of Article Titles: {str(len(news_article_titles_and_urls))}"
+        f"-- Current Archive Year/Month Working On: {year_month_queue_sublist}"
+    )
+
+    page_html = fetch_page(
+        get_archive_url(year_month_queue_sublist),
+        rate_limiter,
+        get_archive_cache_ttl(year_month_queue_sublist),
+        page_type="archive",
     )
+    if page_html is None:
+        return []
+
+    articles = timed_parse(parse_archive_page, "archive", page_html)
+    return filter_archive_articles(year_month_queue_sublist, articles, crawl_state)
+
+
+def scrape_article_page(article, rate_limiter, article_writer):
     """
     EXTRACT & TRANSFORM
 
-    Loop through article URLs and titles, extracting the month, day and year each article
-    was created, its title, the URL to the article's contents and its contents
+    Get the article's contents, extracting its published datetime and the
+    text of its <p> tags, then save it with the rest of its fields
 
     Transform fields so that they have the proper types for Clickhouse
     """
-    for item in news_article_titles_and_urls:
-        # Parse "<span class="copy">" to get article's published date
-        news_article_date = item.find("span", class_="copy").get_text(strip=True)
-        # Split article's published date into separate strings to store as columns
-        # in the .CSV
-        datetime_object = datetime.strptime(news_article_date, "%b %d, %Y")
-        news_article_month = datetime_object.strftime("%B")
-        news_article_day = datetime_object.day
-        news_article_year = datetime_object.year
-        # Get article's title
-        news_article_title = item.find("a", class_="").get_text()
-        news_article_url = item.find("a", href=True)
-        news_article_url = "https://www.newsmax.com" + news_article_url["href"]
-
-        # Access URL for article's content
-        scrapeops_proxy_url, payload = get_scrapeops_url(news_article_url)
-
-        logging.debug(f"-- News Article URL: {news_article_url}")
-        try:
-            response = session.get(scrapeops_proxy_url, params=urlencode(payload))
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as error:
-            print(f"HTTP Error: {error}")
-        except requests.exceptions.ConnectionError as error:
-            print(f"Connection Failed: {error}")
-        except requests.exceptions.Timeout as error:
-            print(f"Timeout Occurred: {error}")
-        except requests.exceptions.RequestException as error:
-            if "www.newsmax.com/404/" in response.text:
-                print("\nReached the end of the archive; no more articles to download.")
-                sys.exit(0)
-            elif response.status_code == 401:
-                print("HTTP 401. All ScrapeOps credits used.")
-                sys.exit(0)
-            print(f"An Error Occurred: {error}")
-
-        # Strip all <p> tags from article's contents
-        news_bsoup = BeautifulSoup(response.text, "html.parser")
-        news_article_datetime = news_bsoup.find(
-            "meta", property="article:published_time"
-        )
-        news_article_section = news_bsoup.find("div", id="mainArticleDiv")
-        news_article_content = news_article_section.find_all("p")
-
-        news_article_string = ""
-        for p in news_article_content:
-            news_article_string = news_article_string + str(p.get_text(strip=True))
-
-        """
-        LOAD: Save article data to .CSV file
-        """
-        save_to_storage(
-            "newsmax_articles.csv",
-            news_article_title,
-            news_article_url,
-            news_article_month,
-            str(news_article_day),
-            str(news_article_year),
-            news_article_datetime["content"],
-            news_article_string,
+    logging.debug(f"-- News Article URL: {article[1]}")
+    page_html = fetch_page(article[1], rate_limiter)
+    if page_html is None:
+        return
+
+    news_article_datetime, news_article_string = timed_parse(
+        parse_article_page, "article", page_html
+    )
+    save_article(article_writer, article, news_article_datetime, news_article_string)
+
+
+def crawl_worker(worker_id, scheduler, rate_limiter, article_writer, crawl_state):
+    # Run the tasks the scheduler hands out until the crawl is over: fetch the
+    # archive page of a month and give its articles back to the scheduler, or
+    # download a chunk of articles
+    while True:
+        task = scheduler.get_task(worker_id)
+        if task is None:
+            return
+
+        task_type, task_work = task
+        if task_type == "month":
+            articles = []
+            try:
+                articles = scrape_archive_page(task_work, rate_limiter, crawl_state)
+            except Exception as error:
+                record_error("archive", type(error).__name__)
+                print(f"Failed to scrape archive {task_work}: {error}")
+            scheduler.month_done(worker_id, articles)
+            continue
+
+        for article in task_work:
+            if stop_event.is_set():
+                return
+            try:
+                scrape_article_page(article, rate_limiter, article_writer)
+            except WriterError:
+                # The rows can't be saved any more so the crawl is stopped.
+                # main() raises the error when it closes the writer
+                stop_event.set()
+                return
+            except Exception as error:
+                record_error("article", type(error).__name__)
+                print(f"Failed to scrape {article[1]}: {error}")
+
+
+def add_pipeline_gauges(scheduler, rate_limiter):
+    # Read when the metrics are logged or served
+    metrics.callback(
+        "archive_pages_in_flight",
+        "gauge",
+        "Archive pages being fetched",
+        lambda: scheduler.month_fetches,
+    )
+    metrics.callback(
+        "articles_waiting",
+        "gauge",
+        "Articles found on archive pages and waiting to be fetched",
+        lambda: scheduler.articles_waiting,
+    )
+    metrics.callback(
+        "chunks_stolen_total",
+        "counter",
+        "Chunks of articles taken from another worker by an idle worker",
+        lambda: scheduler.chunks_stolen,
+    )
+    metrics.callback(
+        "requests_in_flight",
+        "gauge",
+        "Requests in flight to the proxy",
+        lambda: rate_limiter.in_flight,
+    )
+    metrics.callback(
+        "concurrency_limit",
+        "gauge",
+        "Current max requests in flight of the rate limiter",
+        lambda: int(rate_limiter.concurrency_limit),
+    )
+    metrics.callback(
+        "rate_limit",
+        "gauge",
+        "Current max requests/sec of the rate limiter",
+        lambda: round(rate_limiter.rate, 3),
+    )
+
+
+def scraper_threads(
+    months,
+    article_writer,
+    crawl_state=None,
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+    max_rate=MAX_REQUEST_RATE,
+    archive_workers=ARCHIVE_WORKERS,
+    queue_size=ARTICLE_QUEUE_SIZE,
+):
+    """
+    Runs max_concurrency worker threads that take their tasks from a
+    ThreadCrawlScheduler: the archive pages of the months, fetched lazily and
+    at most archive_workers at a time, and chunks of the articles found on
+    them. Idle workers steal chunks from busy ones so a month with hundreds
+    of articles is spread over every worker instead of leaving one with a
+    long tail
+
+    The number of requests in flight is capped at max_concurrency by the
+    shared rate limiter, which also backs off when the proxy is overloaded.
+    Once stop_event is set the scheduler hands out nothing more and threads
+    waiting for the rate limiter give up, so only the requests already in
+    flight are finished
+    """
+    rate_limiter = ThreadRateLimiter(max_concurrency, max_rate, cancel_event=stop_event)
+    scheduler = ThreadCrawlScheduler(
+        months,
+        workers=max_concurrency,
+        max_month_fetches=archive_workers,
+        lookahead=queue_size,
+        stop_event=stop_event,
+        archive_end_event=archive_end_event,
+    )
+    add_pipeline_gauges(scheduler, rate_limiter)
+
+    worker_threads = [
+        threading.Thread(
+            target=crawl_worker,
+            args=(worker_id, scheduler, rate_limiter, article_writer, crawl_state),
         )
+        for worker_id in range(max_concurrency)
+    ]
+
+    started_threads = []
+    try:
+        for thread in worker_threads:
+            thread.start()
+            started_threads.append(thread)
+    except BaseException:
+        # Stop the workers already started
+        stop_event.set()
+        raise
+    finally:
+        # main() closes the writer, the crawl state and the cache only once
+        # every worker using them has returned
+        for thread in started_threads:
+            thread.join()
+
+    print(f"\nScheduler: {scheduler.describe()}")
+    print(f"Rate limiter: {rate_limiter.describe()}")
+
+
+async def async_fetch_page(
+    http_session, url, rate_limiter, cache_ttl=None, page_type="article"
+):
+    """
+    Async version of fetch_page
+    """
+    page_html = read_cache(url)
+    if page_html is not None:
+        return check_page(200, page_html, url, page_type)
+    if offline_mode:
+        print(f"Not in the cache: {url}")
+        return None
+
+    proxy_url, payload = get_scrapeops_url(url)
+    last_error = None
+
+    for retry_number in range(RETRY_TOTAL + 1):
+        if stop_event.is_set():
+            return None
+        if retry_number > 0:
+            metrics.inc("retries_total", page=page_type)
+            await asyncio.sleep(get_backoff_time(retry_number))
+
+        await rate_limiter.acquire()
+        start_time = time.monotonic()
+        status = request_error = None
+        try:
+            async with http_session.get(proxy_url, params=payload) as response:
+                # The bytes of the body as received, decompressed, like
+                # len(response.content) of the threads engine. Chunked and
+                # compressed responses have no Content-Length
+                page_size = len(await response.read())
+                page_html = await response.text()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            request_error = error
+        finally:
+            # Exactly one release per acquire, even if the task is cancelled
+            # or the page can't be decoded, so the slot isn't lost
+            latency = time.monotonic() - start_time
+            await rate_limiter.release(status, latency)
 
+        if isinstance(request_error, aiohttp.ClientConnectionError):
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "connection")
+            last_error = f"Connection Failed: {request_error}"
+            continue
+        if isinstance(request_error, asyncio.TimeoutError):
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "timeout")
+            last_error = f"Timeout Occurred: {url}"
+            continue
+        if request_error is not None:
+            record_request(page_type, None, latency, 0)
+            record_error(page_type, "request")
+            print(f"An Error Occurred: {request_error}")
+            return None
+        record_request(page_type, status, latency, page_size)
 
-def scraper_threads(year_month_queue):
-    # Launch 5 threads as that is the max of the current ScrapeOps
-    # subscription
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {
-            executor.submit(
-                scrape_article_data, year_month_queue_sublist
-            ): year_month_queue_sublist
-            for year_month_queue_sublist in year_month_queue
-        }
+        if response.status in RETRY_STATUS_FORCELIST:
+            record_error(page_type, f"http_{response.status}")
+            last_error = f"HTTP Error: {response.status} for url: {url}"
+            continue
+
+        page_html = check_page(response.status, page_html, url, page_type)
+        write_cache(url, page_html, cache_ttl)
+        return page_html
+
+    record_error(page_type, "gave_up")
+    print(f"{last_error} (gave up after {RETRY_TOTAL} retries)")
+    return None
+
+
+async def async_scrape_archive_page(
+    http_session, year_month_queue_sublist, rate_limiter, crawl_state
+):
+    """
+    Async version of scrape_archive_page
+    """
+    logging.debug(
+        f"-- Current Archive Year/Month Working On: {year_month_queue_sublist}"
+    )
+    page_html = await async_fetch_page(
+        http_session,
+        get_archive_url(year_month_queue_sublist),
+        rate_limiter,
+        get_archive_cache_ttl(year_month_queue_sublist),
+        page_type="archive",
+    )
+    if page_html is None:
+        return []
+
+    articles = timed_parse(parse_archive_page, "archive", page_html)
+    return filter_archive_articles(year_month_queue_sublist, articles, crawl_state)
+
+
+async def async_scrape_article_page(
+    http_session, article, rate_limiter, article_writer
+):
+    """
+    Async version of scrape_article_page
+    """
+    logging.debug(f"-- News Article URL: {article[1]}")
+    page_html = await async_fetch_page(http_session, article[1], rate_limiter)
+    if page_html is None:
+        return
+
+    news_article_datetime, news_article_string = timed_parse(
+        parse_article_page, "article", page_html
+    )
+    # put() blocks while the writer's queue is full, in a thread so only this
+    # coroutine waits instead of the whole event loop
+    await asyncio.to_thread(
+        save_article,
+        article_writer,
+        article,
+        news_article_datetime,
+        news_article_string,
+    )
+
+
+async def async_crawl_worker(
+    worker_id, http_session, scheduler, rate_limiter, article_writer, crawl_state
+):
+    # Async version of crawl_worker
+    while True:
+        task = await scheduler.get_task(worker_id)
+        if task is None:
+            return
+
+        task_type, task_work = task
+        if task_type == "month":
+            articles = []
+            try:
+                articles = await async_scrape_archive_page(
+                    http_session, task_work, rate_limiter, crawl_state
+                )
+            except Exception as error:
+                record_error("archive", type(error).__name__)
+                print(f"Failed to scrape archive {task_work}: {error}")
+            await scheduler.month_done(worker_id, articles)
+            continue
+
+        for article in task_work:
+            if stop_event.is_set():
+                return
+            try:
+                await async_scrape_article_page(
+                    http_session, article, rate_limiter, article_writer
+                )
+            except WriterError:
+                stop_event.set()
+                return
+            except Exception as error:
+                record_error("article", type(error).__name__)
+                print(f"Failed to scrape {article[1]}: {error}")
+
+
+async def scraper_async(
+    months,
+    article_writer,
+    crawl_state=None,
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+    max_rate=MAX_REQUEST_RATE,
+    archive_workers=ARCHIVE_WORKERS,
+    queue_size=ARTICLE_QUEUE_SIZE,
+):
+    """
+    Same scheduler and workers as scraper_threads but the workers are
+    coroutines on a single thread. All of them share one aiohttp session whose
+    connector keeps the connections to the proxy alive and caches its DNS
+    lookups, and the rate limiter caps the number of requests in flight
+
+    Once stop_event is set the workers are cancelled, which also cancels
+    their requests in flight
+    """
+    # Ctrl+C stops the workers instead of interrupting the event loop
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, async_sigint_handler)
+
+    rate_limiter = AsyncRateLimiter(max_concurrency, max_rate)
+    scheduler = AsyncCrawlScheduler(
+        months,
+        workers=max_concurrency,
+        max_month_fetches=archive_workers,
+        lookahead=queue_size,
+        stop_event=stop_event,
+        archive_end_event=archive_end_event,
+    )
+    add_pipeline_gauges(scheduler, rate_limiter)
+
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    async with aiohttp.ClientSession(connector=connector) as http_session:
+        worker_tasks = [
+            asyncio.create_task(
+                async_crawl_worker(
+                    worker_id,
+                    http_session,
+                    scheduler,
+                    rate_limiter,
+                    article_writer,
+                    crawl_state,
+                )
+            )
+            for worker_id in range(max_concurrency)
+        ]
+
+        pending_tasks = worker_tasks
+        while pending_tasks:
+            _, pending_tasks = await asyncio.wait(
+                pending_tasks, timeout=SCHEDULER_POLL_INTERVAL
+            )
+            if pending_tasks and stop_event.is_set():
+                for task in pending_tasks:
+                    task.cancel()
+                await asyncio.gather(*pending_tasks, return_exceptions=True)
+                break
+
+        # Raise the errors the workers didn't handle
+        for task in worker_tasks:
+            if not task.cancelled():
+                task.result()
+
+    print(f"\nScheduler: {scheduler.describe()}")
+    print(f"Rate limiter: {rate_limiter.describe()}")
+
+
+def add_output_metrics(article_writer):
+    # The writer and the response cache keep their own counts
+    metrics.callback(
+        "rows_written_total",
+        "counter",
+        "Articles written to the output",
+        lambda: article_writer.articles_saved,
+    )
+    metrics.callback(
+        "write_batches_total",
+        "counter",
+        "Batches of articles written to the output",
+        lambda: article_writer.batches_written,
+    )
+    metrics.callback(
+        "write_seconds_total",
+        "counter",
+        "Seconds spent writing to the output",
+        lambda: round(article_writer.write_time, 6),
+    )
+    metrics.callback(
+        "writer_queue_size",
+        "gauge",
+        "Articles waiting to be written",
+        article_writer.rows.qsize,
+    )
+    if response_cache is not None:
+        metrics.callback(
+            "cache_hits_total",
+            "counter",
+            "Pages read from the response cache",
+            lambda: response_cache.hits,
+        )
+        metrics.callback(
+            "cache_misses_total",
+            "counter",
+            "Pages not found in the response cache",
+            lambda: response_cache.misses,
+        )
 
 
 def main():
     """
     Main function
     """
-    # Uncomment for debugging purposes
-    # logging.basicConfig(level=logging.DEBUG)
+    global scrapeops_proxy_url, response_cache, archive_cache_ttl, offline_mode
 
-    # If env variable for ScrapeOps proxy is set then proceed.
-    env_var_value = os.getenv("SCRAPEOPS_API_KEY")
-    if env_var_value is not None:
-        # Set up signal handler for Ctrl+C
-        signal.signal(signal.SIGINT, sigint_handler)
+    args = parse_arguments()
 
-        archive_year, archive_month = get_archive_start_date()
-        year_month_queue = create_archive_year_month_queue(archive_year, archive_month)
-        scraper_threads(year_month_queue)
-    else:
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    # If env variable for ScrapeOps proxy is set then proceed. It isn't needed
+    # when the pages are only read from the cache
+    env_var_value = os.getenv("SCRAPEOPS_API_KEY")
+    if env_var_value is None and not args.offline:
         print(
             "SCRAPEOPS_API_KEY environment variable for ScrapeOps proxy is not set. Exiting."
         )
+        return
+
+    if args.engine == "async" and aiohttp is None:
+        print("The async engine needs aiohttp: pip install aiohttp. Exiting.")
+        sys.exit(1)
+    if args.output == "parquet" and pa is None:
+        print("The Parquet output needs pyarrow: pip install pyarrow. Exiting.")
+        sys.exit(1)
+    if args.offline and args.no_cache:
+        print(
+            "--offline reads the pages from the cache so it can't be used with "
+            "--no-cache. Exiting."
+        )
+        sys.exit(1)
+
+    scrapeops_proxy_url = args.proxy_url
+
+    # Set up signal handler for Ctrl+C
+    signal.signal(signal.SIGINT, sigint_handler)
+
+    # Months are generated as the scheduler asks for them. The program stops
+    # once "www.newsmax.com/404/" is received so the current month may not
+    # be reached
+    months = iter_archive_months(args.year, args.month)
+
+    # Skip the months that were completely downloaded by a previous run
+    crawl_state = None
+    if not args.no_resume:
+        crawl_state = CrawlState(args.state_file)
+        completed_months = crawl_state.completed_months()
+        months = (
+            year_month_queue_sublist
+            for year_month_queue_sublist in months
+            if year_month_queue_sublist not in completed_months
+        )
+
+    if not args.no_cache:
+        response_cache = ResponseCache(
+            args.cache_file, max_size=args.cache_size * 1024 * 1024
+        )
+        archive_cache_ttl = args.cache_ttl
+    offline_mode = args.offline
+
+    if args.output == "parquet":
+        article_sink = ParquetArticleSink(
+            PARQUET_DIR,
+            row_group_size=args.row_group_size,
+            compression=args.compression,
+        )
+    else:
+        article_sink = CsvArticleSink(CSV_FILE)
+
+    # The crawl state and the search index are told about every saved row
+    listeners = [crawl_state] if crawl_state is not None else []
+    search_index = None
+    if args.search_index is not None:
+        search_index = SearchIndex(args.search_index)
+        listeners.append(search_index)
+
+    article_writer = ArticleWriter(
+        article_sink,
+        batch_size=args.batch_size,
+        flush_interval=args.flush_interval,
+        listeners=listeners,
+    )
+    article_writer.start()
+    add_output_metrics(article_writer)
+
+    stats_logger = StatsLogger(metrics, args.stats_file, args.stats_interval)
+    if args.stats_interval > 0:
+        stats_logger.start()
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = start_metrics_server(metrics, args.metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    try:
+        if args.engine == "async":
+            asyncio.run(
+                scraper_async(
+                    months,
+                    article_writer,
+                    crawl_state,
+                    max_concurrency=args.max_concurrency,
+                    max_rate=args.max_rate,
+                    archive_workers=args.archive_workers,
+                    queue_size=args.queue_size,
+                )
+            )
+        else:
+            scraper_threads(
+                months,
+                article_writer,
+                crawl_state,
+                max_concurrency=args.max_concurrency,
+                max_rate=args.max_rate,
+                archive_workers=args.archive_workers,
+                queue_size=args.queue_size,
+            )
+    finally:
+        try:
+            # Write the rows that are still waiting before exiting. Raises
+            # the error the writer failed with once the rest is closed
+            article_writer.close()
+        finally:
+            if args.stats_interval > 0:
+                stats_logger.close()
+            else:
+                stats_logger.write_snapshot()
+            if metrics_server is not None:
+                metrics_server.shutdown()
+            if crawl_state is not None:
+                crawl_state.close()
+            if search_index is not None:
+                search_index.close()
+            if response_cache is not None:
+                print(
+                    f"\nPages read from the cache: {response_cache.hits}, "
+                    f"not cached: {response_cache.misses}"
+                )
+                response_cache.close()
+            print(f"\nArticles saved: {article_writer.articles_saved}")
 
 
 if __name__ == "__main__":
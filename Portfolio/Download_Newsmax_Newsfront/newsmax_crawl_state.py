@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+# Max number of URLs looked up in one query. SQLite limits the number of
+# parameters of a statement
+LOOKUP_BATCH_SIZE = 500
+
+
+class CrawlState:
+    """
+    Index of the months that have been completely downloaded and of the URLs
+    of every article saved so far, kept in a SQLite file so that a run that was
+    stopped (Ctrl+C, out of ScrapeOps credits, crash) can pick up where it left
+    off without paying for the same pages again
+
+    Both tables are keyed on their primary key with no rowid so a lookup is a
+    single B-tree search, which stays fast with millions of URLs
+    """
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        # URLs of the articles of each month that were queued but haven't been
+        # written yet. A month is completed once all of them are written
+        self.pending_urls = {}
+        self.url_months = {}
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS completed_months ("
+                "year INTEGER NOT NULL, month INTEGER NOT NULL, "
+                "PRIMARY KEY (year, month)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS saved_articles ("
+                "url TEXT NOT NULL PRIMARY KEY, year INTEGER, month INTEGER) "
+                "WITHOUT ROWID"
+            )
+
+    def completed_months(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT year, month FROM completed_months")
+            return {(year, month) for year, month in rows}
+
+    def filter_new_articles(self, articles):
+        # Drop the articles whose URL has already been saved. The articles of
+        # the archive page are looked up in batches instead of one at a time
+        urls = [article[1] for article in articles]
+        saved_urls = set()
+
+        with self.lock:
+            for start in range(0, len(urls), LOOKUP_BATCH_SIZE):
+                batch = urls[start : start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT url FROM saved_articles WHERE url IN ({placeholders})",
+                    batch,
+                )
+                saved_urls.update(url for (url,) in rows)
+
+        return [article for article in articles if article[1] not in saved_urls]
+
+    def start_month(self, year_month, articles):
+        # Keep track of the articles queued for the month so it can be marked
+        # as completed once the last one is written
+        with self.lock, self.connection:
+            if not articles:
+                self.complete_month(year_month)
+                return
+
+            self.pending_urls[year_month] = {article[1] for article in articles}
+            for article in articles:
+                self.url_months[article[1]] = year_month
+
+    def rows_written(self, rows):
+        # Called by the writer stage after a batch of rows is in the .CSV
+        with self.lock, self.connection:
+            for row in rows:
+                url = row[1]
+                year_month = self.url_months.pop(url, (None, None))
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO saved_articles (url, year, month) "
+                    "VALUES (?, ?, ?)",
+                    (url, year_month[0], year_month[1]),
+                )
+
+                pending_urls = self.pending_urls.get(year_month)
+                if pending_urls is None:
+                    continue
+                pending_urls.discard(url)
+                if not pending_urls:
+                    del self.pending_urls[year_month]
+                    self.complete_month(year_month)
+
+    def complete_month(self, year_month):
+        # The archive page of the current month still gets new articles so it
+        # is never marked as completed
+        today_date = datetime.today()
+        if year_month >= (today_date.year, today_date.month):
+            return
+
+        self.connection.execute(
+            "INSERT OR IGNORE INTO completed_months (year, month) VALUES (?, ?)",
+            year_month,
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,249 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the buckets of the timing histograms
+TIME_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Metrics:
+    """
+    Counters, histograms and gauges of the stages of the scraper. They are
+    written to the stats log as JSON and served in the Prometheus text
+    exposition format by the /metrics endpoint
+
+    Updating a counter or a histogram is a dict lookup and an addition under
+    one lock so it can be done for every request and every row. Gauges and
+    callback metrics are only read when a snapshot is taken, from a function
+    that returns the current value
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+
+        # name -> (type, help text, histogram buckets)
+        self.definitions = {}
+        # (name, labels) -> value of a counter or [bucket counts, sum, count]
+        # of a histogram. labels is a tuple of (label, value) pairs
+        self.values = {}
+        # name -> function returning the current value
+        self.callbacks = {}
+
+    def counter(self, name, help_text):
+        self.definitions[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets=TIME_BUCKETS):
+        self.definitions[name] = ("histogram", help_text, buckets)
+
+    def callback(self, name, metric_type, help_text, function):
+        # A gauge, or a counter kept by another object, read from function()
+        self.definitions[name] = (metric_type, help_text, None)
+        self.callbacks[name] = function
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        buckets = self.definitions[name][2]
+        bucket_index = bisect_left(buckets, value)
+
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                # The last bucket is +Inf
+                histogram = [[0] * (len(buckets) + 1), 0.0, 0]
+                self.values[key] = histogram
+            histogram[0][bucket_index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get_values(self):
+        # Copy of the values so they can be formatted outside of the lock
+        with self.lock:
+            values = {
+                key: [list(value[0]), value[1], value[2]]
+                if isinstance(value, list)
+                else value
+                for key, value in self.values.items()
+            }
+
+        for name, function in self.callbacks.items():
+            try:
+                values[(name, ())] = function()
+            except Exception:
+                # The object the callback reads may already be closed
+                continue
+
+        return values
+
+    def get_snapshot(self):
+        """
+        Returns the values as a dict that can be dumped as JSON. Histograms
+        are summed up by their count, sum, mean and estimated p50/p99
+        """
+        snapshot = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "elapsed_seconds": round(time.monotonic() - self.start_time, 3),
+        }
+
+        for (name, labels), value in sorted(self.get_values().items()):
+            metric_type, _, buckets = self.definitions[name]
+            section = snapshot.setdefault(metric_type + "s", {})
+            key = name + format_labels(labels)
+
+            if metric_type == "histogram":
+                bucket_counts, total, count = value
+                section[key] = {
+                    "count": count,
+                    "sum": round(total, 6),
+                    "mean": round(total / count, 6) if count else 0.0,
+                    "p50": round(get_percentile(buckets, bucket_counts, 50), 6),
+                    "p99": round(get_percentile(buckets, bucket_counts, 99), 6),
+                }
+            else:
+                section[key] = value
+
+        return snapshot
+
+    def to_text(self):
+        # Prometheus text exposition format
+        values_by_name = {}
+        for (name, labels), value in sorted(self.get_values().items()):
+            values_by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, values in values_by_name.items():
+            metric_type, help_text, buckets = self.definitions[name]
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+
+            for labels, value in values:
+                if metric_type != "histogram":
+                    lines.append(f"{full_name}{format_labels(labels)} {value}")
+                    continue
+
+                bucket_counts, total, count = value
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(
+                    list(buckets) + ["+Inf"], bucket_counts
+                ):
+                    cumulative_count += bucket_count
+                    bucket_labels = labels + (("le", str(upper_bound)),)
+                    lines.append(
+                        f"{full_name}_bucket{format_labels(bucket_labels)} "
+                        f"{cumulative_count}"
+                    )
+                lines.append(f"{full_name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{full_name}_count{format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def get_percentile(buckets, bucket_counts, percentile):
+    # Estimated by interpolating inside the bucket the percentile falls in.
+    # Values in the +Inf bucket are reported as the last bucket's upper bound
+    count = sum(bucket_counts)
+    if not count:
+        return 0.0
+
+    rank = count * percentile / 100
+    cumulative_count = 0
+    for bucket_index, bucket_count in enumerate(bucket_counts):
+        if bucket_count and cumulative_count + bucket_count >= rank:
+            if bucket_index >= len(buckets):
+                return float(buckets[-1])
+            lower_bound = buckets[bucket_index - 1] if bucket_index else 0.0
+            upper_bound = buckets[bucket_index]
+            fraction = (rank - cumulative_count) / bucket_count
+            return lower_bound + (upper_bound - lower_bound) * fraction
+        cumulative_count += bucket_count
+
+    return float(buckets[-1])
+
+
+class StatsLogger(threading.Thread):
+    # Appends a JSON snapshot of the metrics to filename every interval
+    # seconds, and a last one when it is closed
+
+    def __init__(self, metrics, filename, interval):
+        super().__init__(name="stats-logger", daemon=True)
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        with open(self.filename, "a") as file:
+            file.write(json.dumps(self.metrics.get_snapshot()) + "\n")
+
+    def close(self):
+        self.stop_event.set()
+        self.join()
+        self.write_snapshot()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.to_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(metrics, port):
+    # Serve GET /metrics on localhost from a background thread. Call
+    # shutdown() on the returned server to stop it
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,253 @@
+import logging
+import re
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:
+    # The slower BeautifulSoup/html.parser path is used instead
+    etree = None
+
+# Start tags of the only parts of the pages that are used. Parsing starts at
+# them and stops once the element is closed
+ARCHIVE_LIST_START_TAG = re.compile(
+    r"<ul\b[^>]*\bclass\s*=\s*[\"'][^\"']*\barchiveRepeaterUL\b", re.IGNORECASE
+)
+ARTICLE_DIV_START_TAG = re.compile(
+    r"<div\b[^>]*\bid\s*=\s*[\"']mainArticleDiv[\"']", re.IGNORECASE
+)
+PUBLISHED_TIME_META_TAG = re.compile(
+    r"<meta\b[^>]*\bproperty\s*=\s*[\"']article:published_time[\"'][^>]*>",
+    re.IGNORECASE,
+)
+
+# Size of the pieces of the page fed to the pull parser at a time
+PARSER_CHUNK_SIZE = 16384
+
+# Text in these tags isn't returned by BeautifulSoup's get_text()
+SKIPPED_TEXT_TAGS = ("script", "style", "template")
+
+
+def to_archive_article(news_article_date, news_article_title, news_article_href):
+    # Split article's published date into separate strings to store as columns
+    # in the .CSV
+    datetime_object = datetime.strptime(news_article_date, "%b %d, %Y")
+    news_article_month = datetime_object.strftime("%B")
+    news_article_day = datetime_object.day
+    news_article_year = datetime_object.year
+    news_article_url = "https://www.newsmax.com" + news_article_href
+
+    return (
+        news_article_title,
+        news_article_url,
+        news_article_month,
+        news_article_day,
+        news_article_year,
+    )
+
+
+def parse_archive_page_bs4(page_html):
+    """
+    Returns a list with the title, URL and published month, day and year of
+    every article on an archive page. Parses the whole page with
+    BeautifulSoup and html.parser
+    """
+    news_bsoup = BeautifulSoup(page_html, "html.parser")
+    news_articles = news_bsoup.find("ul", class_="archiveRepeaterUL")
+    news_article_titles_and_urls = news_articles.find_all("h5", class_="archiveH5")
+    logging.debug(
+        f"-- Number Of Article Titles: {str(len(news_article_titles_and_urls))}"
+    )
+
+    articles = []
+    for item in news_article_titles_and_urls:
+        # Parse "<span class="copy">" to get article's published date
+        news_article_date = item.find("span", class_="copy").get_text(strip=True)
+        # Get article's title
+        news_article_title = item.find("a", class_="").get_text()
+        news_article_url = item.find("a", href=True)
+
+        articles.append(
+            to_archive_article(
+                news_article_date, news_article_title, news_article_url["href"]
+            )
+        )
+
+    return articles
+
+
+def parse_article_page_bs4(page_html):
+    # Returns the article's published datetime and the text of all of the
+    # <p> tags of its contents. Parses the whole page with BeautifulSoup and
+    # html.parser
+    news_bsoup = BeautifulSoup(page_html, "html.parser")
+    news_article_datetime = news_bsoup.find("meta", property="article:published_time")
+    news_article_section = news_bsoup.find("div", id="mainArticleDiv")
+    news_article_content = news_article_section.find_all("p")
+
+    news_article_string = "".join(p.get_text(strip=True) for p in news_article_content)
+
+    return news_article_datetime["content"], news_article_string
+
+
+def parse_element(page_html, start_tag, tag):
+    """
+    Parse only the element that starts at the first match of start_tag. The
+    page is fed to a pull parser from the start tag on and parsing stops as
+    soon as the element is closed so nothing else of the page is turned into
+    a tree. Falls back to parsing the whole page if start_tag isn't found
+    """
+    match = start_tag.search(page_html)
+    if match is None:
+        logging.debug(f"-- <{tag}> not found, parsing the whole page")
+        return None
+
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    element = None
+
+    for chunk_start in range(match.start(), len(page_html), PARSER_CHUNK_SIZE):
+        parser.feed(page_html[chunk_start : chunk_start + PARSER_CHUNK_SIZE])
+        for event, node in parser.read_events():
+            if event == "start" and element is None and node.tag == tag:
+                element = node
+            elif event == "end" and node is element:
+                return element
+
+    parser.close()
+    return element
+
+
+def find_descendant(element, tag, predicate):
+    for node in element.iter(tag):
+        if predicate(node):
+            return node
+
+    return None
+
+
+def has_class(node, class_name):
+    return class_name in node.get("class", "").split()
+
+
+def get_text(element, strip=False):
+    # Same text as BeautifulSoup's get_text(): comments and the contents of
+    # <script>/<style> are left out. With strip=True every piece of text is
+    # stripped and empty pieces are dropped
+    parts = []
+    append_text(element, parts, strip)
+
+    return "".join(parts)
+
+
+def append_text(element, parts, strip):
+    # Comments and processing instructions don't have a string tag
+    if not isinstance(element.tag, str) or element.tag in SKIPPED_TEXT_TAGS:
+        return
+
+    append_string(element.text, parts, strip)
+    for child in element:
+        append_text(child, parts, strip)
+        append_string(child.tail, parts, strip)
+
+
+def append_string(string, parts, strip):
+    if not string:
+        return
+    if strip:
+        string = string.strip()
+        if not string:
+            return
+
+    parts.append(string)
+
+
+def parse_archive_page_lxml(page_html):
+    """
+    Same output as parse_archive_page_bs4 but only <ul class="archiveRepeaterUL">
+    is parsed, by lxml
+    """
+    news_articles = parse_element(page_html, ARCHIVE_LIST_START_TAG, "ul")
+    if news_articles is None:
+        news_articles = find_descendant(
+            lxml_html.document_fromstring(page_html),
+            "ul",
+            lambda node: has_class(node, "archiveRepeaterUL"),
+        )
+
+    news_article_titles_and_urls = [
+        node for node in news_articles.iter("h5") if has_class(node, "archiveH5")
+    ]
+    logging.debug(
+        f"-- Number Of Article Titles: {str(len(news_article_titles_and_urls))}"
+    )
+
+    articles = []
+    for item in news_article_titles_and_urls:
+        news_article_date = get_text(
+            find_descendant(item, "span", lambda node: has_class(node, "copy")),
+            strip=True,
+        )
+        # <a class=""> is the link with the title, the other links of the item
+        # have a class
+        news_article_title = get_text(
+            find_descendant(
+                item,
+                "a",
+                lambda node: (
+                    node.get("class") is not None and not node.get("class").split()
+                ),
+            )
+        )
+        news_article_url = find_descendant(
+            item, "a", lambda node: node.get("href") is not None
+        )
+
+        articles.append(
+            to_archive_article(
+                news_article_date, news_article_title, news_article_url.get("href")
+            )
+        )
+
+    return articles
+
+
+def parse_article_page_lxml(page_html):
+    """
+    Same output as parse_article_page_bs4 but only the published time <meta>
+    and <div id="mainArticleDiv"> are parsed, by lxml
+    """
+    meta_tag = PUBLISHED_TIME_META_TAG.search(page_html)
+    news_article_section = parse_element(page_html, ARTICLE_DIV_START_TAG, "div")
+
+    if meta_tag is not None:
+        news_article_datetime = lxml_html.fragment_fromstring(meta_tag.group())
+    if meta_tag is None or news_article_section is None:
+        document = lxml_html.document_fromstring(page_html)
+        if meta_tag is None:
+            news_article_datetime = find_descendant(
+                document,
+                "meta",
+                lambda node: node.get("property") == "article:published_time",
+            )
+        if news_article_section is None:
+            news_article_section = find_descendant(
+                document, "div", lambda node: node.get("id") == "mainArticleDiv"
+            )
+
+    news_article_string = "".join(
+        get_text(p, strip=True) for p in news_article_section.iter("p")
+    )
+
+    return news_article_datetime.get("content"), news_article_string
+
+
+# lxml is used when it is installed
+if etree is not None:
+    parse_archive_page = parse_archive_page_lxml
+    parse_article_page = parse_article_page_lxml
+else:
+    parse_archive_page = parse_archive_page_bs4
+    parse_article_page = parse_article_page_bs4
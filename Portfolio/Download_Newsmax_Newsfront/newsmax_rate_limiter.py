@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# The concurrency limit and the rate are multiplied by DECREASE_FACTOR when
+# the proxy returns 429/5xx, a request fails or a response is slower than
+# LATENCY_SPIKE_FACTOR times the average latency (and at least
+# LATENCY_SPIKE_MIN seconds slower, so jitter on fast responses isn't a spike)
+DECREASE_FACTOR = 0.5
+LATENCY_SPIKE_FACTOR = 3.0
+LATENCY_SPIKE_MIN = 1.0
+# Weight of each response in the average latency
+LATENCY_SMOOTHING = 0.1
+# Share of max_rate added to the rate after each healthy response, so the
+# rate gets from half back to max_rate in 50 healthy responses whatever
+# max_rate is. The concurrency limit grows by about one request per round of
+# healthy responses
+RATE_INCREASE = 0.01
+# Lowest rate the limiter backs off to
+MIN_RATE = 0.1
+# Min seconds between two back offs, for when the average latency is shorter
+MIN_DECREASE_INTERVAL = 1.0
+# Seconds of responses the measured rate is computed over
+RATE_WINDOW = 60
+# Max seconds a thread waits before checking the cancel event again
+CANCEL_POLL_INTERVAL = 0.2
+
+
+def is_healthy_status(status_code):
+    # 429 (too many requests) and 5xx mean the proxy or the site is overloaded.
+    # A status of None is a request that failed without a response
+    return status_code is not None and status_code != 429 and status_code < 500
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket plus AIMD (additive increase, multiplicative decrease)
+    controller of the requests sent to the proxy
+
+    A request can start when fewer than concurrency_limit requests are in
+    flight and the bucket has a token. The bucket is refilled at rate tokens
+    per second and holds at most max_concurrency tokens. Healthy responses
+    raise the concurrency limit and the rate a little, up to max_concurrency
+    (the slots of the ScrapeOps plan) and max_rate. Overloaded responses halve
+    both, at most once per average latency so that a burst of failures from
+    the same round of requests only backs off once
+
+    This class isn't thread-safe, ThreadRateLimiter and AsyncRateLimiter
+    add the locking for each engine
+    """
+
+    def __init__(self, max_concurrency, max_rate):
+        self.max_concurrency = max_concurrency
+        self.max_rate = max_rate
+        self.concurrency_limit = float(max_concurrency)
+        self.rate = float(max_rate)
+        self.tokens = float(max_concurrency)
+        self.last_refill_time = time.monotonic()
+
+        self.in_flight = 0
+        self.latency_average = None
+        self.last_decrease_time = 0.0
+        self.decreases = 0
+        self.response_times = deque()
+
+    def get_wait_time(self):
+        """
+        Returns 0 if a request can start now, the seconds until the bucket has
+        a token or None if the limit of requests in flight is reached
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.tokens + (now - self.last_refill_time) * self.rate,
+            float(self.max_concurrency),
+        )
+        self.last_refill_time = now
+
+        if self.in_flight >= int(self.concurrency_limit):
+            return None
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+        return 0
+
+    def start_request(self):
+        self.tokens -= 1
+        self.in_flight += 1
+
+    def finish_request(self, status_code, latency):
+        now = time.monotonic()
+        self.in_flight -= 1
+        self.response_times.append(now)
+        while self.response_times[0] < now - RATE_WINDOW:
+            self.response_times.popleft()
+
+        latency_spike = (
+            self.latency_average is not None
+            and latency > self.latency_average * LATENCY_SPIKE_FACTOR
+            and latency > self.latency_average + LATENCY_SPIKE_MIN
+        )
+        if status_code is not None:
+            if self.latency_average is None:
+                self.latency_average = latency
+            else:
+                self.latency_average += LATENCY_SMOOTHING * (
+                    latency - self.latency_average
+                )
+
+        if is_healthy_status(status_code) and not latency_spike:
+            self.increase()
+        else:
+            self.decrease(now)
+
+    def increase(self):
+        was_backed_off = self.concurrency_limit < self.max_concurrency
+
+        self.concurrency_limit = min(
+            self.concurrency_limit + 1 / self.concurrency_limit,
+            float(self.max_concurrency),
+        )
+        self.rate = min(self.rate + self.max_rate * RATE_INCREASE, float(self.max_rate))
+
+        if was_backed_off and self.concurrency_limit == self.max_concurrency:
+            print(f"\nBack to full speed: {self.describe()}")
+
+    def decrease(self, now):
+        decrease_interval = max(self.latency_average or 0.0, MIN_DECREASE_INTERVAL)
+        if now - self.last_decrease_time < decrease_interval:
+            return
+
+        self.last_decrease_time = now
+        self.decreases += 1
+        self.concurrency_limit = max(self.concurrency_limit * DECREASE_FACTOR, 1.0)
+        # Back off from what is actually being sent, not from a rate limit that
+        # was never reached
+        self.rate = max(
+            min(self.rate, self.get_measured_rate() or self.rate) * DECREASE_FACTOR,
+            MIN_RATE,
+        )
+
+        print(f"\nBacking off: {self.describe()}")
+
+    def get_measured_rate(self):
+        # Responses/sec over the last RATE_WINDOW seconds
+        if len(self.response_times) < 2:
+            return None
+
+        elapsed_time = self.response_times[-1] - self.response_times[0]
+        if elapsed_time <= 0:
+            return None
+
+        return (len(self.response_times) - 1) / elapsed_time
+
+    def get_stats(self):
+        return {
+            "concurrency_limit": int(self.concurrency_limit),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "rate_limit": round(self.rate, 3),
+            "measured_rate": round(self.get_measured_rate() or 0.0, 3),
+            "latency_average": round(self.latency_average or 0.0, 3),
+            "decreases": self.decreases,
+        }
+
+    def describe(self):
+        stats = self.get_stats()
+        return (
+            f"{stats['concurrency_limit']}/{stats['max_concurrency']} requests in "
+            f"flight, {stats['measured_rate']:.2f} requests/sec "
+            f"(limit {stats['rate_limit']:.2f}), "
+            f"average latency {stats['latency_average']:.2f}s"
+        )
+
+
+class ThreadRateLimiter(AdaptiveRateLimiter):
+    """
+    Used by the threads engine. acquire() blocks until a request can start and
+    returns True, or returns False without starting one if cancel_event is set
+    while waiting. Threads can't be cancelled like the async engine's tasks
+    """
+
+    def __init__(self, max_concurrency, max_rate, cancel_event=None):
+        super().__init__(max_concurrency, max_rate)
+        self.condition = threading.Condition()
+        self.cancel_event = cancel_event or threading.Event()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.cancel_event.is_set():
+                    return False
+                wait_time = self.get_wait_time()
+                if wait_time == 0:
+                    self.start_request()
+                    return True
+                self.condition.wait(
+                    timeout=min(wait_time or CANCEL_POLL_INTERVAL, CANCEL_POLL_INTERVAL)
+                )
+
+    def release(self, status_code, latency):
+        with self.condition:
+            self.finish_request(status_code, latency)
+            self.condition.notify_all()
+
+
+class AsyncRateLimiter(AdaptiveRateLimiter):
+    # Used by the async engine. acquire() waits until a request can start
+
+    def __init__(self, max_concurrency, max_rate):
+        super().__init__(max_concurrency, max_rate)
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                wait_time = self.get_wait_time()
+                if wait_time == 0:
+                    self.start_request()
+                    return
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=wait_time)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, status_code, latency):
+        async with self.condition:
+            self.finish_request(status_code, latency)
+            self.condition.notify_all()
@@ -0,0 +1,126 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+
+# zlib compression level of the cached pages. HTML compresses to around a
+# fifth of its size
+COMPRESSION_LEVEL = 6
+
+
+class ResponseCache:
+    """
+    Cache of the pages downloaded through the proxy, kept in a SQLite file so
+    that pages don't have to be paid for again when a month is reprocessed
+
+    Pages are stored zlib compressed under the SHA-256 of their URL. Once the
+    compressed size of all pages goes over max_size the least recently used
+    pages are evicted. Pages stored with a ttl expire after ttl seconds, which
+    is used for the archive page of the current month as it still gets new
+    articles
+    """
+
+    def __init__(self, filename, max_size):
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT NOT NULL PRIMARY KEY, url TEXT NOT NULL, "
+                "body BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access "
+                "ON responses (last_access)"
+            )
+            (self.size,) = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+
+    def get(self, url):
+        # Returns the cached page or None if it isn't cached or has expired
+        key = get_cache_key(url)
+        now = time.time()
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT body, size, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            body, size, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+
+        self.hits += 1
+        return zlib.decompress(body).decode("utf-8")
+
+    def put(self, url, page_html, ttl=None):
+        key = get_cache_key(url)
+        body = zlib.compress(page_html.encode("utf-8"), COMPRESSION_LEVEL)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.size -= row[0]
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, url, body, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, url, body, len(body), expires_at, now),
+            )
+            self.size += len(body)
+
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # Delete the least recently used pages until the cache is back under
+        # 90% of max_size so it isn't evicting on every put
+        target_size = self.max_size * 0.9
+        rows = self.connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        )
+
+        evicted_keys = []
+        for key, size in rows:
+            if self.size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self.size -= size
+
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def get_cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import threading
+from collections import deque
+from datetime import datetime
+
+# A month's articles are split into about CHUNKS_PER_WORKER chunks per
+# worker, of at most MAX_CHUNK_SIZE articles, so a big month is spread over
+# every worker and the last chunks of a run are small
+CHUNKS_PER_WORKER = 4
+MAX_CHUNK_SIZE = 10
+
+# Seconds between two checks of the stop event by the workers waiting for work
+POLL_INTERVAL = 0.2
+
+# Returned by get_next_task() when there is no work yet but there will be
+WAIT = "wait"
+
+
+def iter_archive_months(archive_year, archive_month, today_date=None):
+    # Yields every (year, month) from the one that was input up to the current
+    # month. They are generated as the scheduler asks for them so nothing is
+    # built for the months after the end of the archive
+    today_date = today_date or datetime.today()
+    year, month = archive_year, archive_month
+
+    while (year, month) <= (today_date.year, today_date.month):
+        yield (year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class CrawlScheduler:
+    """
+    Hands out the work of a crawl to a fixed number of workers. A task is
+    either ("month", (year, month)), fetching the archive page of the next
+    month, or ("articles", [article, ...]), a chunk of articles to download
+
+    Months are taken lazily from months. Another archive page is only fetched
+    while fewer than lookahead articles are waiting and fewer than
+    max_month_fetches archive pages are being fetched, so the number of
+    articles known ahead of the workers stays bounded
+
+    The articles of a month are split into chunks sized by the month's article
+    count and queued on the deque of the worker that fetched the archive page.
+    Workers take chunks from the front of their own deque and, once it is
+    empty, steal from the back of the longest deque of another worker so no
+    worker is left with the tail of a big month while the others are idle
+
+    Nothing is handed out once stop_event is set, and no more months once
+    archive_end_event is set. This class isn't thread-safe,
+    ThreadCrawlScheduler and AsyncCrawlScheduler add the locking for each
+    engine
+    """
+
+    def __init__(
+        self,
+        months,
+        workers,
+        max_month_fetches,
+        lookahead,
+        stop_event,
+        archive_end_event,
+    ):
+        self.months = iter(months)
+        self.workers = workers
+        self.max_month_fetches = max_month_fetches
+        self.lookahead = lookahead
+        self.stop_event = stop_event
+        self.archive_end_event = archive_end_event
+
+        self.worker_chunks = [deque() for _ in range(workers)]
+        self.months_exhausted = False
+        self.month_fetches = 0
+        self.articles_waiting = 0
+
+        self.months_fetched = 0
+        self.chunks_queued = 0
+        self.chunks_stolen = 0
+
+    def get_next_task(self, worker_id):
+        """
+        Returns the worker's next task, WAIT if there is no work yet but an
+        archive page being fetched may add some, or None once the crawl is over
+        """
+        if self.stop_event.is_set():
+            return None
+
+        if self.can_fetch_month():
+            month = next(self.months, None)
+            if month is not None:
+                self.month_fetches += 1
+                return ("month", month)
+            self.months_exhausted = True
+
+        chunks = self.worker_chunks[worker_id]
+        if not chunks:
+            chunks = max(self.worker_chunks, key=len)
+            if not chunks:
+                return WAIT if self.month_fetches else None
+            self.chunks_stolen += 1
+            chunk = chunks.pop()
+        else:
+            chunk = chunks.popleft()
+
+        self.articles_waiting -= len(chunk)
+        return ("articles", chunk)
+
+    def can_fetch_month(self):
+        return (
+            not self.months_exhausted
+            and not self.archive_end_event.is_set()
+            and self.month_fetches < self.max_month_fetches
+            and self.articles_waiting < self.lookahead
+        )
+
+    def add_month_articles(self, worker_id, articles):
+        # Called once the archive page of a month handed out by
+        # get_next_task() has been fetched, with [] if it failed
+        self.month_fetches -= 1
+        self.months_fetched += 1
+        if not articles:
+            return
+
+        chunk_size = min(
+            max(math.ceil(len(articles) / (self.workers * CHUNKS_PER_WORKER)), 1),
+            MAX_CHUNK_SIZE,
+        )
+        for chunk_start in range(0, len(articles), chunk_size):
+            self.worker_chunks[worker_id].append(
+                articles[chunk_start : chunk_start + chunk_size]
+            )
+            self.chunks_queued += 1
+        self.articles_waiting += len(articles)
+
+    def describe(self):
+        return (
+            f"{self.months_fetched} archive pages fetched, {self.chunks_queued} "
+            f"chunks of articles, {self.chunks_stolen} stolen by idle workers"
+        )
+
+
+class ThreadCrawlScheduler(CrawlScheduler):
+    # Used by the threads engine. get_task() blocks until there is work
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = threading.Condition()
+
+    def get_task(self, worker_id):
+        with self.condition:
+            while True:
+                task = self.get_next_task(worker_id)
+                if task is not WAIT:
+                    return task
+                # Woken up by month_done(), or checks the stop event again
+                self.condition.wait(timeout=POLL_INTERVAL)
+
+    def month_done(self, worker_id, articles):
+        with self.condition:
+            self.add_month_articles(worker_id, articles)
+            self.condition.notify_all()
+
+
+class AsyncCrawlScheduler(CrawlScheduler):
+    # Used by the async engine. get_task() waits until there is work
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = asyncio.Condition()
+
+    async def get_task(self, worker_id):
+        async with self.condition:
+            while True:
+                task = self.get_next_task(worker_id)
+                if task is not WAIT:
+                    return task
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def month_done(self, worker_id, articles):
+        async with self.condition:
+            self.add_month_articles(worker_id, articles)
+            self.condition.notify_all()
@@ -0,0 +1,309 @@
+import csv
+import io
+import sqlite3
+import threading
+from pathlib import Path
+
+from newsmax_writer import MONTH_NUMBERS
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed to index the Parquet output
+    pq = None
+
+# Rows inserted in one transaction when indexing an output file
+INDEX_BATCH_SIZE = 1000
+
+
+class SearchIndex:
+    """
+    Full-text index of the downloaded articles in a SQLite file, using FTS5
+
+    The articles are kept in a regular table keyed on their URL. articles_fts
+    is an external content FTS5 table over their title and contents, so the
+    text isn't stored twice, with the porter stemmer so "votes" matches
+    "voting". It also indexes a period column of two tokens, y<year> and
+    m<year><month>, so a date range is part of the MATCH: only the articles
+    of the range are ranked instead of every article matching the words
+
+    Rows are only added to the full-text index when their URL isn't indexed
+    yet, so feeding the same rows again (a re-run of the scraper, indexing the
+    .CSV after the scraper indexed it live) only costs a primary key lookup
+    per row. The output files remember how far they were indexed, see
+    index_csv() and index_parquet()
+    """
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS articles ("
+                "id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, title TEXT, "
+                "year INTEGER, month INTEGER, day INTEGER, published TEXT, "
+                "contents TEXT, period TEXT)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS articles_year_month "
+                "ON articles (year, month)"
+            )
+            self.connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5("
+                "title, contents, period, content='articles', content_rowid='id', "
+                "tokenize='porter unicode61 remove_diacritics 2')"
+            )
+            # Position (.CSV) or name (Parquet) of the output files indexed
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS indexed_sources ("
+                "source TEXT NOT NULL PRIMARY KEY, position INTEGER) WITHOUT ROWID"
+            )
+
+    def rows_written(self, rows):
+        # Called by the writer stage with the rows it saved
+        self.add_rows(rows)
+
+    def add_rows(self, rows):
+        """
+        Index rows of the writer's format (title, URL, month name, day, year,
+        published datetime, contents). Returns the number of new articles
+        """
+        added_count = 0
+
+        with self.lock, self.connection:
+            for row in rows:
+                (
+                    news_article_title,
+                    news_article_url,
+                    news_article_month,
+                    news_article_day,
+                    news_article_year,
+                    news_article_datetime,
+                    news_article_contents,
+                ) = row
+                year = int(news_article_year)
+                month = MONTH_NUMBERS[news_article_month]
+                period = f"y{year} m{year}{month:02d}"
+
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO articles "
+                    "(url, title, year, month, day, published, contents, period) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        news_article_url,
+                        news_article_title,
+                        year,
+                        month,
+                        int(news_article_day),
+                        news_article_datetime,
+                        news_article_contents,
+                        period,
+                    ),
+                )
+                if cursor.rowcount != 1:
+                    continue
+
+                self.connection.execute(
+                    "INSERT INTO articles_fts (rowid, title, contents, period) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        cursor.lastrowid,
+                        news_article_title,
+                        news_article_contents,
+                        period,
+                    ),
+                )
+                added_count += 1
+
+        return added_count
+
+    def index_csv(self, filename):
+        """
+        Index the rows appended to the .CSV since it was last indexed. The
+        position the file was read up to is kept so only the new rows are
+        read. A file that got shorter was replaced and is read from the start
+        """
+        source = f"csv:{Path(filename).resolve()}"
+        position = self.get_source_position(source) or 0
+
+        with open(filename, "rb") as file:
+            file.seek(0, 2)
+            if file.tell() < position:
+                position = 0
+            file.seek(position)
+            data = file.read()
+
+        # Only read up to the end of the last complete row, the writer may be
+        # in the middle of a batch
+        end = get_complete_rows_end(data)
+        reader = csv.reader(io.StringIO(data[:end].decode("utf-8"), newline=""))
+        if position == 0:
+            next(reader, None)
+
+        added_count = 0
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                added_count += self.add_rows(batch)
+                batch = []
+        added_count += self.add_rows(batch)
+
+        self.set_source_position(source, position + end)
+        return added_count
+
+    def index_parquet(self, root_dir):
+        # Index the Parquet files that haven't been indexed yet. The files are
+        # never changed once written so each one is only read once
+        added_count = 0
+
+        for path in sorted(Path(root_dir).rglob("*.parquet")):
+            source = f"parquet:{path.resolve()}"
+            if self.get_source_position(source) is not None:
+                continue
+
+            table = pq.read_table(path)
+            for batch in table.to_batches(max_chunksize=INDEX_BATCH_SIZE):
+                columns = batch.to_pydict()
+                added_count += self.add_rows(
+                    zip(
+                        columns["news_article_title"],
+                        columns["news_article_url"],
+                        columns["news_article_month"],
+                        columns["news_article_day"],
+                        columns["news_article_year"],
+                        [
+                            value.isoformat() if value is not None else None
+                            for value in columns["news_article_datetime"]
+                        ],
+                        columns["news_article_contents"],
+                    )
+                )
+            self.set_source_position(source, 0)
+
+        return added_count
+
+    def get_source_position(self, source):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT position FROM indexed_sources WHERE source = ?", (source,)
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def set_source_position(self, source, position):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO indexed_sources (source, position) "
+                "VALUES (?, ?)",
+                (source, position),
+            )
+
+    def search(self, query, start_month=None, end_month=None, limit=20):
+        """
+        Returns the articles matching the FTS5 query (words, "phrases", AND,
+        OR, NOT, prefix*), best match first, as (year, month, day, title, URL,
+        snippet of the contents). start_month and end_month are optional
+        (year, month) bounds, both included
+        """
+        if start_month is not None or end_month is not None:
+            first_month, last_month = self.get_month_range()
+            if first_month is None:
+                return []
+            period_filter = get_period_filter(
+                start_month or first_month, end_month or last_month
+            )
+            if period_filter is None:
+                return []
+            query = f"({query}) AND {period_filter}"
+
+        with self.lock:
+            return self.connection.execute(
+                "SELECT articles.year, articles.month, articles.day, "
+                "articles.title, articles.url, "
+                "snippet(articles_fts, 1, '[', ']', '...', 16) "
+                "FROM articles_fts JOIN articles ON articles.id = articles_fts.rowid "
+                "WHERE articles_fts MATCH ? ORDER BY articles_fts.rank LIMIT ?",
+                (query, limit),
+            ).fetchall()
+
+    def get_month_range(self):
+        # First and last (year, month) in the index, (None, None) if empty
+        with self.lock:
+            first_month = self.connection.execute(
+                "SELECT year, month FROM articles ORDER BY year, month LIMIT 1"
+            ).fetchone()
+            last_month = self.connection.execute(
+                "SELECT year, month FROM articles "
+                "ORDER BY year DESC, month DESC LIMIT 1"
+            ).fetchone()
+
+        return first_month, last_month
+
+    def count(self):
+        with self.lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM articles"
+            ).fetchone()
+
+        return count
+
+    def optimize(self):
+        # Merge the FTS5 index segments into one, worth it after a big import
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO articles_fts (articles_fts) VALUES ('optimize')"
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def get_period_filter(start_month, end_month):
+    """
+    FTS5 filter on the period column for the months from start_month to
+    end_month. Whole years are matched by their y<year> token and the other
+    months by their m<year><month> token, e.g. 2007-11 to 2009-02 is
+    period:(m200711 OR m200712 OR y2008 OR m200901 OR m200902). Returns None
+    if the range is empty
+    """
+    tokens = []
+    year, month = start_month
+    while (year, month) <= tuple(end_month):
+        if month == 1 and (year, 12) <= tuple(end_month):
+            tokens.append(f"y{year}")
+            year += 1
+            continue
+        tokens.append(f"m{year}{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    if not tokens:
+        return None
+    return "period:(" + " OR ".join(tokens) + ")"
+
+
+def get_complete_rows_end(data):
+    """
+    Position in the bytes of the .CSV after its last complete row. A newline
+    ends a row unless it is in a quoted field, as the contents of the
+    articles can be: after an odd number of quotes since the start of the
+    row (quotes in a field are doubled)
+    """
+    end = 0
+    in_quotes = False
+    line_start = 0
+    while True:
+        newline = data.find(b"\n", line_start)
+        if newline == -1:
+            return end
+
+        if data.count(b'"', line_start, newline) % 2 == 1:
+            in_quotes = not in_quotes
+        if not in_quotes:
+            end = newline + 1
+        line_start = newline + 1
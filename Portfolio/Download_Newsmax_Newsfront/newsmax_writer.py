@@ -0,0 +1,310 @@
+import csv
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed for the Parquet output
+    pa = None
+
+# Column headers
+CSV_HEADERS = "news_article_title,news_article_url,news_article_month,news_article_day,news_article_year,news_article_datetime,news_article_contents"
+
+# Max number of rows waiting to be written. Workers putting rows block when
+# it is full so a slow disk can't make memory grow without bound
+WRITER_QUEUE_SIZE = 1000
+
+# Seconds a worker waits for room in the full queue before checking again
+# that the writer hasn't failed
+WRITER_POLL_INTERVAL = 1.0
+
+# Max number of year/month partitions with an open Parquet file. When another
+# partition is written to, the least recently written one is closed
+MAX_OPEN_PARTITIONS = 12
+
+# Month names as written by strftime("%B") to their number
+MONTH_NUMBERS = {
+    datetime(2000, month, 1).strftime("%B"): month for month in range(1, 13)
+}
+
+if pa is not None:
+    PARQUET_SCHEMA = pa.schema(
+        [
+            ("news_article_title", pa.string()),
+            ("news_article_url", pa.string()),
+            ("news_article_month", pa.string()),
+            ("news_article_day", pa.int8()),
+            ("news_article_year", pa.int16()),
+            ("news_article_datetime", pa.timestamp("us", tz="UTC")),
+            ("news_article_contents", pa.string()),
+        ]
+    )
+
+
+class CsvArticleSink:
+    # Appends the rows to one .CSV that is kept open until close()
+
+    def __init__(self, filename):
+        new_file = not Path(filename).exists()
+        self.file = open(filename, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.file.write(CSV_HEADERS + "\n")
+
+    def write_rows(self, rows):
+        # Returns the rows that are now saved in the file
+        self.writer.writerows(rows)
+        self.file.flush()
+        return rows
+
+    def close(self):
+        self.file.close()
+        return []
+
+
+class ParquetArticleSink:
+    """
+    Writes the rows to Parquet files partitioned by the year and month the
+    articles were published in:
+
+        <root_dir>/year=2007/month=7/part-<run id>-<n>.parquet
+
+    Rows are buffered per partition and written as a row group once
+    row_group_size rows are buffered. The day and year are stored as ints and
+    the published datetime as a UTC timestamp
+
+    A Parquet file can only be read once it has been closed so rows are only
+    returned as saved by write_rows()/close() when their file is closed
+    """
+
+    def __init__(self, root_dir, row_group_size=1000, compression="zstd"):
+        self.root_dir = Path(root_dir)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.run_id = uuid.uuid4().hex[:8]
+        self.file_count = 0
+
+        # (year, month) -> [ParquetWriter or None, buffered rows, rows in file]
+        self.partitions = OrderedDict()
+
+    def write_rows(self, rows):
+        saved_rows = []
+
+        for row in rows:
+            partition_key = (int(row[4]), MONTH_NUMBERS[row[2]])
+            partition = self.partitions.get(partition_key)
+            if partition is None:
+                partition = [None, [], []]
+                self.partitions[partition_key] = partition
+                if len(self.partitions) > MAX_OPEN_PARTITIONS:
+                    oldest_partition_key = next(iter(self.partitions))
+                    saved_rows.extend(self.close_partition(oldest_partition_key))
+            self.partitions.move_to_end(partition_key)
+
+            partition[1].append(row)
+            if len(partition[1]) >= self.row_group_size:
+                self.write_row_group(partition_key, partition)
+
+        return saved_rows
+
+    def write_row_group(self, partition_key, partition):
+        writer, buffered_rows, file_rows = partition
+        if not buffered_rows:
+            return
+
+        if writer is None:
+            year, month = partition_key
+            partition_dir = self.root_dir / f"year={year}" / f"month={month}"
+            os.makedirs(partition_dir, exist_ok=True)
+            self.file_count += 1
+            writer = pq.ParquetWriter(
+                partition_dir / f"part-{self.run_id}-{self.file_count}.parquet",
+                PARQUET_SCHEMA,
+                compression=self.compression,
+            )
+            partition[0] = writer
+
+        writer.write_table(to_table(buffered_rows), row_group_size=self.row_group_size)
+        file_rows.extend(buffered_rows)
+        partition[1] = []
+
+    def close_partition(self, partition_key):
+        # Returns the rows that were in the partition's file
+        partition = self.partitions.pop(partition_key)
+        self.write_row_group(partition_key, partition)
+        if partition[0] is not None:
+            partition[0].close()
+
+        return partition[2]
+
+    def close(self):
+        saved_rows = []
+        for partition_key in list(self.partitions):
+            saved_rows.extend(self.close_partition(partition_key))
+
+        return saved_rows
+
+
+def to_table(rows):
+    columns = list(zip(*rows))
+
+    return pa.table(
+        [
+            pa.array(columns[0], pa.string()),
+            pa.array(columns[1], pa.string()),
+            pa.array(columns[2], pa.string()),
+            pa.array([int(day) for day in columns[3]], pa.int8()),
+            pa.array([int(year) for year in columns[4]], pa.int16()),
+            pa.array(
+                [parse_datetime(value) for value in columns[5]],
+                pa.timestamp("us", tz="UTC"),
+            ),
+            pa.array(columns[6], pa.string()),
+        ],
+        schema=PARQUET_SCHEMA,
+    )
+
+
+def parse_datetime(value):
+    # article:published_time is ISO 8601, e.g. 2007-07-31T10:15:00-04:00.
+    # Datetimes without a timezone are taken as UTC
+    try:
+        datetime_object = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+    if datetime_object.tzinfo is None:
+        return datetime_object.replace(tzinfo=timezone.utc)
+    return datetime_object.astimezone(timezone.utc)
+
+
+class WriterError(Exception):
+    # Raised by ArticleWriter.put() and close() once the writer thread failed
+    # or was closed: the rows can't be saved any more
+    pass
+
+
+class ArticleWriter(threading.Thread):
+    """
+    Writer stage of the scraper. It is the only thread that touches the output:
+    the fetch workers hand it rows with put() and go straight back to
+    downloading, and the rows are written to the sink (CsvArticleSink or
+    ParquetArticleSink) in batches of batch_size or every flush_interval
+    seconds, whichever comes first
+
+    listeners are objects with a rows_written(rows) method that is called
+    with the rows the sink reports as saved
+
+    If the sink raises, the writer thread stops and put() and close() raise
+    WriterError instead of blocking on a queue nobody reads any more
+    """
+
+    def __init__(self, sink, batch_size=100, flush_interval=5.0, listeners=()):
+        super().__init__(name="article-writer")
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.listeners = list(listeners)
+        self.rows = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        # Held while putting a row so no row is put after close()'s sentinel
+        self.put_lock = threading.Lock()
+        self.closed = False
+        # The exception the writer thread failed with
+        self.error = None
+
+        # Only updated by the writer thread
+        self.articles_saved = 0
+        self.batches_written = 0
+        self.write_time = 0.0
+
+    def put(self, row):
+        with self.put_lock:
+            if self.closed:
+                raise WriterError("Can't save rows after the writer is closed")
+            self.put_row(row)
+
+    def close(self):
+        # Write the rows still in the queue and close the sink. Raises
+        # WriterError if the writer thread failed
+        with self.put_lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.put_row(None)
+            finally:
+                self.join()
+        self.check_error()
+
+    def put_row(self, row):
+        # Blocks while the queue is full, as long as the writer is running
+        while True:
+            self.check_error()
+            try:
+                self.rows.put(row, timeout=WRITER_POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def check_error(self):
+        if self.error is not None:
+            raise WriterError(f"Failed to save the rows: {self.error}") from (
+                self.error
+            )
+
+    def run(self):
+        try:
+            self.write_queue()
+        except Exception as error:
+            # Raised in the workers by put() and in main() by close()
+            self.error = error
+
+    def write_queue(self):
+        batch = []
+        flush_time = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                row = self.rows.get(timeout=max(flush_time - time.monotonic(), 0))
+            except queue.Empty:
+                row = ()
+
+            if row is None:
+                break
+            if row:
+                batch.append(row)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= flush_time:
+                self.write_batch(batch)
+                batch = []
+                flush_time = time.monotonic() + self.flush_interval
+
+        self.write_batch(batch)
+        self.notify_listeners(self.sink.close())
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+
+        start_time = time.monotonic()
+        saved_rows = self.sink.write_rows(batch)
+        self.write_time += time.monotonic() - start_time
+
+        self.notify_listeners(saved_rows)
+        self.articles_saved += len(batch)
+        self.batches_written += 1
+        print(f"Articles saved: {self.articles_saved}", end="\r")
+
+    def notify_listeners(self, rows):
+        if not rows:
+            return
+
+        for listener in self.listeners:
+            listener.rows_written(rows)
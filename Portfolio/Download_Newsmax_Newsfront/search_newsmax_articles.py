@@ -0,0 +1,156 @@
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from newsmax_search_index import SearchIndex, pq
+
+# Same files as dl_newsmax_newsfront.py
+SEARCH_INDEX_FILE = "newsmax_search_index.db"
+CSV_FILE = "newsmax_articles.csv"
+PARQUET_DIR = "newsmax_articles"
+
+
+def parse_year_month(value):
+    # YYYY-MM or YYYY-M
+    try:
+        year, month = value.split("-")
+        year_month = (int(year), int(month))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+    if not 1 <= year_month[1] <= 12:
+        raise argparse.ArgumentTypeError(f"month of {value!r} isn't 1-12")
+    return year_month
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        prog="search_newsmax_articles",
+        description="Full-text search over the downloaded Newsmax articles",
+    )
+    parser.add_argument(
+        "--index-file",
+        default=SEARCH_INDEX_FILE,
+        help=f"SQLite file of the search index (default: {SEARCH_INDEX_FILE})",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = subparsers.add_parser(
+        "index",
+        help="add the articles saved since the last time to the index",
+    )
+    index_parser.add_argument(
+        "--csv-file",
+        default=CSV_FILE,
+        help=f".CSV written by the scraper (default: {CSV_FILE})",
+    )
+    index_parser.add_argument(
+        "--parquet-dir",
+        default=PARQUET_DIR,
+        help=f"directory of the Parquet output (default: {PARQUET_DIR})",
+    )
+    index_parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="merge the index into one segment afterwards, for faster queries",
+    )
+
+    query_parser = subparsers.add_parser("query", help="search the index")
+    query_parser.add_argument(
+        "query",
+        help='FTS5 query: words, "a phrase", AND/OR/NOT, prefix* or '
+        "title:word to only search the titles",
+    )
+    query_parser.add_argument("--year", type=int, help="only articles of this year")
+    query_parser.add_argument(
+        "--month", type=int, help="only articles of this month (needs --year)"
+    )
+    query_parser.add_argument(
+        "--from",
+        dest="start_month",
+        type=parse_year_month,
+        help="YYYY-MM first month of the articles searched",
+    )
+    query_parser.add_argument(
+        "--to",
+        dest="end_month",
+        type=parse_year_month,
+        help="YYYY-MM last month of the articles searched",
+    )
+    query_parser.add_argument(
+        "--limit", type=int, default=20, help="max number of results (default: 20)"
+    )
+
+    args = parser.parse_args()
+    if args.command == "query" and args.month is not None and args.year is None:
+        parser.error("--month needs --year")
+
+    return args
+
+
+def index_articles(search_index, args):
+    start_time = time.perf_counter()
+    added_count = 0
+
+    if Path(args.csv_file).exists():
+        added_count += search_index.index_csv(args.csv_file)
+    if Path(args.parquet_dir).is_dir():
+        if pq is None:
+            print("Indexing the Parquet output needs pyarrow: pip install pyarrow.")
+        else:
+            added_count += search_index.index_parquet(args.parquet_dir)
+
+    if args.optimize:
+        search_index.optimize()
+
+    elapsed_time = time.perf_counter() - start_time
+    print(
+        f"Indexed {added_count} new articles in {elapsed_time:.2f}s, "
+        f"{search_index.count()} in the index."
+    )
+
+
+def query_articles(search_index, args):
+    start_month, end_month = args.start_month, args.end_month
+    if args.year is not None:
+        start_month = start_month or (args.year, args.month or 1)
+        end_month = end_month or (args.year, args.month or 12)
+
+    start_time = time.perf_counter()
+    try:
+        results = search_index.search(args.query, start_month, end_month, args.limit)
+    except sqlite3.OperationalError as error:
+        print(f"Invalid query: {error}")
+        sys.exit(1)
+    elapsed_time = time.perf_counter() - start_time
+
+    for year, month, day, title, url, snippet in results:
+        print(f"{year}-{month:02d}-{day:02d}  {title}")
+        print(f"            {url}")
+        print(f"            {snippet}")
+    print(f"{len(results)} results in {elapsed_time * 1000:.1f} ms")
+
+
+def main():
+    """
+    Builds and queries the full-text index of the downloaded articles:
+
+        python search_newsmax_articles.py index
+        python search_newsmax_articles.py query "border security" --year 2007
+    """
+    args = parse_arguments()
+    search_index = SearchIndex(args.index_file)
+
+    try:
+        if args.command == "index":
+            index_articles(search_index, args)
+        else:
+            query_articles(search_index, args)
+    finally:
+        search_index.close()
+
+
+if __name__ == "__main__":
+    main()
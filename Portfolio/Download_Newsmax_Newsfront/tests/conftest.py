@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scraper's modules are imported from the project directory, like when
+# dl_newsmax_newsfront.py is run
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
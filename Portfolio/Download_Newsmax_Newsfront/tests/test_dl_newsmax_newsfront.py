@@ -0,0 +1,280 @@
+import asyncio
+import threading
+from datetime import datetime
+
+import pytest
+import requests
+
+import dl_newsmax_newsfront
+from dl_newsmax_newsfront import (
+    async_fetch_page,
+    async_scrape_article_page,
+    fetch_page,
+    get_archive_cache_ttl,
+)
+from newsmax_rate_limiter import AsyncRateLimiter, ThreadRateLimiter
+from newsmax_response_cache import ResponseCache
+
+
+class FakeDatetime(datetime):
+    @classmethod
+    def today(cls):
+        return cls(2024, 5, 17)
+
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode("utf-8")
+
+
+class FakeSession:
+    # Answers every request with the same response, or raises it if it is an
+    # exception
+    def __init__(self, response):
+        self.response = response
+        self.request_count = 0
+
+    def get(self, url, params=None):
+        self.request_count += 1
+        if isinstance(self.response, BaseException):
+            raise self.response
+        return self.response
+
+
+class FakeAsyncResponse:
+    # aiohttp's response, text() raises error if it is given
+    def __init__(self, status, body, error=None):
+        self.status = status
+        self.body = body
+        self.error = error
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        if self.error is not None:
+            raise self.error
+        return self.body.decode("utf-8")
+
+
+class BlockingWriter:
+    # put() blocks until unblocked is set, like ArticleWriter's when its queue
+    # is full
+    def __init__(self):
+        self.unblocked = threading.Event()
+        self.rows = []
+
+    def put(self, row):
+        self.unblocked.wait(timeout=2)
+        self.rows.append(row)
+
+
+class FakeAsyncSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, params=None):
+        return self.response
+
+
+@pytest.fixture(autouse=True)
+def scraper_state(monkeypatch, tmp_path):
+    # Fresh events and response cache for every test instead of the module's
+    response_cache = ResponseCache(tmp_path / "cache.db", 1024 * 1024)
+    monkeypatch.setattr(dl_newsmax_newsfront, "stop_event", threading.Event())
+    monkeypatch.setattr(dl_newsmax_newsfront, "archive_end_event", threading.Event())
+    monkeypatch.setattr(dl_newsmax_newsfront, "response_cache", response_cache)
+    monkeypatch.setenv("SCRAPEOPS_API_KEY", "test")
+    yield
+    response_cache.close()
+
+
+@pytest.mark.parametrize(
+    "year_month, cache_ttl",
+    [
+        ((2007, 7), None),
+        ((2024, 4), None),
+        ((2024, 5), dl_newsmax_newsfront.ARCHIVE_CACHE_TTL),
+        ((2024, 6), dl_newsmax_newsfront.ARCHIVE_CACHE_TTL),
+        ((2025, 1), dl_newsmax_newsfront.ARCHIVE_CACHE_TTL),
+    ],
+)
+def test_get_archive_cache_ttl(monkeypatch, year_month, cache_ttl):
+    # Only the archive pages of the current month and after expire
+    monkeypatch.setattr(dl_newsmax_newsfront, "datetime", FakeDatetime)
+
+    assert get_archive_cache_ttl(list(year_month)) == cache_ttl
+
+
+def fetch(monkeypatch, response):
+    session = FakeSession(response)
+    monkeypatch.setattr(dl_newsmax_newsfront, "get_session", lambda: session)
+    rate_limiter = ThreadRateLimiter(1, 1000.0)
+
+    return fetch_page("https://www.newsmax.com/a", rate_limiter), session
+
+
+def test_fetched_page_is_cached(monkeypatch):
+    page_html, session = fetch(monkeypatch, FakeResponse(200, "<html>a</html>"))
+    assert page_html == "<html>a</html>"
+
+    page_html, session = fetch(monkeypatch, FakeResponse(200, "<html>b</html>"))
+    assert page_html == "<html>a</html>"
+    assert session.request_count == 0
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        FakeResponse(200, '<a href="https://www.newsmax.com/404/">'),
+        FakeResponse(404, "<html>Not found</html>"),
+        FakeResponse(401, "<html>Unauthorized</html>"),
+    ],
+)
+def test_rejected_page_isnt_cached(monkeypatch, response):
+    assert fetch(monkeypatch, response)[0] is None
+
+    # Requested again instead of being read from the cache
+    dl_newsmax_newsfront.stop_event.clear()
+    page_html, session = fetch(monkeypatch, FakeResponse(200, "<html>a</html>"))
+    assert page_html == "<html>a</html>"
+    assert session.request_count == 1
+
+
+def test_end_of_the_archive(monkeypatch):
+    fetch(monkeypatch, FakeResponse(200, '<a href="https://www.newsmax.com/404/">'))
+
+    assert dl_newsmax_newsfront.archive_end_event.is_set()
+    assert not dl_newsmax_newsfront.stop_event.is_set()
+
+
+def test_credits_used_up(monkeypatch):
+    fetch(monkeypatch, FakeResponse(401, "<html>Unauthorized</html>"))
+
+    assert dl_newsmax_newsfront.stop_event.is_set()
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        requests.exceptions.ConnectionError("refused"),
+        requests.exceptions.Timeout("timed out"),
+        requests.exceptions.InvalidURL("bad"),
+    ],
+)
+def test_failed_requests_release_the_rate_limiter(monkeypatch, error):
+    monkeypatch.setattr(dl_newsmax_newsfront, "get_backoff_time", lambda retry: 0)
+    session = FakeSession(error)
+    monkeypatch.setattr(dl_newsmax_newsfront, "get_session", lambda: session)
+    rate_limiter = ThreadRateLimiter(1, 1000.0)
+
+    assert fetch_page("https://www.newsmax.com/a", rate_limiter) is None
+    assert rate_limiter.in_flight == 0
+
+
+def test_unexpected_error_releases_the_rate_limiter(monkeypatch):
+    session = FakeSession(ValueError("not a request error"))
+    monkeypatch.setattr(dl_newsmax_newsfront, "get_session", lambda: session)
+    rate_limiter = ThreadRateLimiter(1, 1000.0)
+
+    with pytest.raises(ValueError):
+        fetch_page("https://www.newsmax.com/a", rate_limiter)
+    assert rate_limiter.in_flight == 0
+
+
+def test_async_fetch_page_releases_the_rate_limiter():
+    async def fetch_pages():
+        rate_limiter = AsyncRateLimiter(1, 1000.0)
+        page_html = await async_fetch_page(
+            FakeAsyncSession(FakeAsyncResponse(200, b"<html>a</html>")),
+            "https://www.newsmax.com/a",
+            rate_limiter,
+        )
+        assert page_html == "<html>a</html>"
+
+        error = UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+        with pytest.raises(UnicodeDecodeError):
+            await async_fetch_page(
+                FakeAsyncSession(FakeAsyncResponse(200, b"\xff", error)),
+                "https://www.newsmax.com/b",
+                rate_limiter,
+            )
+
+        return rate_limiter
+
+    assert asyncio.run(fetch_pages()).in_flight == 0
+
+
+def test_cancelled_async_fetch_page_releases_the_rate_limiter():
+    async def cancel_fetch_page():
+        rate_limiter = AsyncRateLimiter(1, 1000.0)
+        response = FakeAsyncResponse(200, b"<html>a</html>")
+        started = asyncio.Event()
+
+        async def read():
+            # Cancelled while the body is being received
+            started.set()
+            await asyncio.sleep(60)
+
+        response.read = read
+        task = asyncio.create_task(
+            async_fetch_page(
+                FakeAsyncSession(response), "https://www.newsmax.com/a", rate_limiter
+            )
+        )
+        await started.wait()
+        assert rate_limiter.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        return rate_limiter
+
+    assert asyncio.run(cancel_fetch_page()).in_flight == 0
+
+
+def test_async_save_doesnt_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(
+        dl_newsmax_newsfront,
+        "parse_article_page",
+        lambda page_html: ("2007-07-31T10:15:00-04:00", "Contents"),
+    )
+    article = ["Title", "https://www.newsmax.com/a", "July", 31, 2007]
+
+    async def scrape_article_page():
+        article_writer = BlockingWriter()
+        task = asyncio.create_task(
+            async_scrape_article_page(
+                FakeAsyncSession(FakeAsyncResponse(200, b"<html>a</html>")),
+                article,
+                AsyncRateLimiter(1, 1000.0),
+                article_writer,
+            )
+        )
+        # The other coroutines keep running while put() waits
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        article_writer.unblocked.set()
+        await task
+
+        return article_writer.rows
+
+    assert asyncio.run(scrape_article_page()) == [
+        [
+            "Title",
+            "https://www.newsmax.com/a",
+            "July",
+            "31",
+            "2007",
+            "2007-07-31T10:15:00-04:00",
+            "Contents",
+        ]
+    ]
@@ -0,0 +1,134 @@
+import pytest
+
+import newsmax_rate_limiter
+from newsmax_rate_limiter import MIN_DECREASE_INTERVAL, MIN_RATE, AdaptiveRateLimiter
+
+
+class FakeTime:
+    # Stands in for the time module, the clock only moves when told to
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(newsmax_rate_limiter, "time", fake_time)
+    return fake_time
+
+
+def send(rate_limiter, status_code, latency=0.1):
+    rate_limiter.start_request()
+    rate_limiter.finish_request(status_code, latency)
+
+
+def test_starts_at_full_speed(clock):
+    rate_limiter = AdaptiveRateLimiter(4, 20.0)
+
+    assert rate_limiter.get_wait_time() == 0
+    assert rate_limiter.concurrency_limit == 4
+    assert rate_limiter.rate == 20.0
+
+
+def test_concurrency_limit_reached(clock):
+    rate_limiter = AdaptiveRateLimiter(2, 20.0)
+    rate_limiter.start_request()
+    rate_limiter.start_request()
+
+    assert rate_limiter.get_wait_time() is None
+
+
+def test_waits_for_a_token(clock):
+    rate_limiter = AdaptiveRateLimiter(2, 10.0)
+    send(rate_limiter, 200)
+    send(rate_limiter, 200)
+
+    # The bucket is empty, it gets a token every 1 / rate seconds
+    assert rate_limiter.get_wait_time() == pytest.approx(0.1)
+    clock.now += 0.1
+    assert rate_limiter.get_wait_time() == 0
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503, None])
+def test_overload_halves_concurrency_and_rate(clock, status_code):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    send(rate_limiter, status_code)
+
+    assert rate_limiter.concurrency_limit == 4
+    assert rate_limiter.rate == 10.0
+    assert rate_limiter.decreases == 1
+
+
+def test_backs_off_once_per_interval(clock):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    send(rate_limiter, 429)
+    clock.now += MIN_DECREASE_INTERVAL / 2
+    send(rate_limiter, 429)
+
+    # The second failure is of the same round of requests
+    assert rate_limiter.concurrency_limit == 4
+    assert rate_limiter.decreases == 1
+
+    clock.now += MIN_DECREASE_INTERVAL
+    send(rate_limiter, 429)
+    assert rate_limiter.concurrency_limit == 2
+    assert rate_limiter.decreases == 2
+
+
+def test_latency_spike_backs_off(clock):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    send(rate_limiter, 200, latency=0.1)
+    send(rate_limiter, 200, latency=5.0)
+
+    assert rate_limiter.concurrency_limit == 4
+    assert rate_limiter.decreases == 1
+
+
+def test_slow_but_steady_latency_isnt_a_spike(clock):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    send(rate_limiter, 200, latency=0.1)
+    # More than LATENCY_SPIKE_FACTOR times the average but less than
+    # LATENCY_SPIKE_MIN seconds slower
+    send(rate_limiter, 200, latency=0.5)
+
+    assert rate_limiter.decreases == 0
+
+
+def test_backs_off_from_the_measured_rate(clock):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    # 2 requests/sec sent while the limit is 20
+    for _ in range(5):
+        send(rate_limiter, 200)
+        clock.now += 0.5
+    send(rate_limiter, 429)
+
+    assert rate_limiter.rate == pytest.approx(1.0)
+
+
+def test_floors(clock):
+    rate_limiter = AdaptiveRateLimiter(2, 0.3)
+    for _ in range(5):
+        send(rate_limiter, 429)
+        clock.now += MIN_DECREASE_INTERVAL
+
+    assert rate_limiter.concurrency_limit == 1
+    assert rate_limiter.rate == MIN_RATE
+
+
+def test_healthy_responses_increase_back_to_the_max(clock):
+    rate_limiter = AdaptiveRateLimiter(8, 20.0)
+    send(rate_limiter, 429)
+    clock.now += MIN_DECREASE_INTERVAL
+
+    send(rate_limiter, 200)
+    # Additive: 1 / limit for the concurrency, 1% of max_rate for the rate
+    assert rate_limiter.concurrency_limit == pytest.approx(4.25)
+    assert rate_limiter.rate == pytest.approx(10.2)
+
+    for _ in range(100):
+        send(rate_limiter, 200)
+    assert rate_limiter.concurrency_limit == 8
+    assert rate_limiter.rate == 20.0
@@ -0,0 +1,82 @@
+import zlib
+
+import pytest
+
+import newsmax_response_cache
+from newsmax_response_cache import COMPRESSION_LEVEL, ResponseCache
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(newsmax_response_cache, "time", fake_time)
+    return fake_time
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    response_cache = ResponseCache(tmp_path / "cache.db", max_size=1024 * 1024)
+    yield response_cache
+    response_cache.close()
+
+
+def test_get_put(clock, response_cache):
+    assert response_cache.get("https://www.newsmax.com/a") is None
+    response_cache.put("https://www.newsmax.com/a", "<html>a</html>")
+
+    assert response_cache.get("https://www.newsmax.com/a") == "<html>a</html>"
+    assert (response_cache.hits, response_cache.misses) == (1, 1)
+
+
+def test_page_expires_after_ttl(clock, response_cache):
+    response_cache.put("https://www.newsmax.com/archive/", "<html/>", ttl=60)
+
+    clock.now += 59
+    assert response_cache.get("https://www.newsmax.com/archive/") == "<html/>"
+    clock.now += 1
+    assert response_cache.get("https://www.newsmax.com/archive/") is None
+    # The expired page is deleted
+    assert response_cache.size == 0
+
+
+def test_page_without_ttl_never_expires(clock, response_cache):
+    response_cache.put("https://www.newsmax.com/a", "<html/>")
+    clock.now += 10 * 365 * 24 * 60 * 60
+
+    assert response_cache.get("https://www.newsmax.com/a") == "<html/>"
+
+
+def test_put_again_replaces_the_ttl(clock, response_cache):
+    response_cache.put("https://www.newsmax.com/archive/", "<html>1</html>", ttl=60)
+    response_cache.put("https://www.newsmax.com/archive/", "<html>2</html>")
+    clock.now += 120
+
+    assert response_cache.get("https://www.newsmax.com/archive/") == "<html>2</html>"
+
+
+def test_least_recently_used_pages_are_evicted(clock, tmp_path):
+    page_html = "<html>" + "article " * 100 + "</html>"
+    page_size = len(zlib.compress(page_html.encode("utf-8"), COMPRESSION_LEVEL))
+    # Room for 2 pages and a half
+    response_cache = ResponseCache(tmp_path / "cache.db", page_size * 5 // 2)
+
+    for url in ("https://www.newsmax.com/a", "https://www.newsmax.com/b"):
+        response_cache.put(url, page_html)
+        clock.now += 1
+    response_cache.get("https://www.newsmax.com/a")
+    clock.now += 1
+    response_cache.put("https://www.newsmax.com/c", page_html)
+
+    assert response_cache.evictions == 1
+    assert response_cache.get("https://www.newsmax.com/b") is None
+    assert response_cache.get("https://www.newsmax.com/a") == page_html
+    assert response_cache.get("https://www.newsmax.com/c") == page_html
+    response_cache.close()
@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime
+
+from newsmax_scheduler import (
+    MAX_CHUNK_SIZE,
+    WAIT,
+    CrawlScheduler,
+    iter_archive_months,
+)
+
+
+def make_scheduler(months, workers=2, max_month_fetches=1, lookahead=100):
+    return CrawlScheduler(
+        months,
+        workers=workers,
+        max_month_fetches=max_month_fetches,
+        lookahead=lookahead,
+        stop_event=threading.Event(),
+        archive_end_event=threading.Event(),
+    )
+
+
+def test_iter_archive_months():
+    months = iter_archive_months(2006, 11, today_date=datetime(2007, 2, 3))
+
+    assert list(months) == [(2006, 11), (2006, 12), (2007, 1), (2007, 2)]
+
+
+def test_months_are_fetched_lazily():
+    scheduler = make_scheduler([(2007, 7), (2007, 8), (2007, 9)], max_month_fetches=2)
+
+    assert scheduler.get_next_task(0) == ("month", (2007, 7))
+    assert scheduler.get_next_task(1) == ("month", (2007, 8))
+    # max_month_fetches archive pages are being fetched, there is no work yet
+    assert scheduler.get_next_task(0) is WAIT
+
+
+def test_articles_are_split_into_chunks():
+    scheduler = make_scheduler([(2007, 7)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(40)))
+
+    # About CHUNKS_PER_WORKER chunks per worker
+    assert [len(chunk) for chunk in scheduler.worker_chunks[0]] == [5] * 8
+    assert scheduler.articles_waiting == 40
+
+    scheduler = make_scheduler([(2007, 7)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(1000)))
+    assert max(len(chunk) for chunk in scheduler.worker_chunks[0]) == MAX_CHUNK_SIZE
+
+
+def test_idle_worker_steals_from_the_back():
+    scheduler = make_scheduler([(2007, 7)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(16)))
+    chunks = list(scheduler.worker_chunks[0])
+
+    # The worker that fetched the archive page takes from the front of its
+    # deque, the idle one from the back
+    assert scheduler.get_next_task(0) == ("articles", chunks[0])
+    assert scheduler.get_next_task(1) == ("articles", chunks[-1])
+    assert scheduler.chunks_stolen == 1
+    assert scheduler.articles_waiting == 16 - len(chunks[0]) - len(chunks[-1])
+
+
+def test_steals_from_the_longest_deque():
+    scheduler = make_scheduler([(2007, 7), (2007, 8)], workers=3, max_month_fetches=2)
+    scheduler.get_next_task(0)
+    scheduler.get_next_task(1)
+    scheduler.add_month_articles(0, list(range(4)))
+    scheduler.add_month_articles(1, list(range(100, 124)))
+
+    task_type, chunk = scheduler.get_next_task(2)
+    assert task_type == "articles"
+    assert chunk[0] >= 100
+
+
+def test_lookahead_holds_back_months():
+    scheduler = make_scheduler([(2007, 7), (2007, 8)], lookahead=10)
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(10)))
+
+    assert scheduler.get_next_task(0)[0] == "articles"
+    # Fewer than lookahead articles are waiting now
+    assert scheduler.get_next_task(1) == ("month", (2007, 8))
+
+
+def test_crawl_is_over_once_the_work_is_done():
+    scheduler = make_scheduler([(2007, 7)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, [])
+
+    assert scheduler.get_next_task(0) is None
+    assert scheduler.months_fetched == 1
+
+
+def test_archive_end_stops_the_months_only():
+    scheduler = make_scheduler([(2007, 7), (2007, 8)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(3)))
+    scheduler.archive_end_event.set()
+
+    # The articles already found are still handed out, in 3 chunks of 1
+    for _ in range(3):
+        assert scheduler.get_next_task(1)[0] == "articles"
+    assert scheduler.get_next_task(1) is None
+
+
+def test_stop_event_stops_everything():
+    scheduler = make_scheduler([(2007, 7), (2007, 8)])
+    scheduler.get_next_task(0)
+    scheduler.add_month_articles(0, list(range(3)))
+    scheduler.stop_event.set()
+
+    assert scheduler.get_next_task(0) is None
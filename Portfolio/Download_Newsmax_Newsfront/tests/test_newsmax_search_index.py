@@ -0,0 +1,54 @@
+import csv
+import io
+
+from newsmax_search_index import SearchIndex, get_complete_rows_end
+from newsmax_writer import CSV_HEADERS
+
+
+def to_csv(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode("utf-8")
+
+
+def make_row(number, contents):
+    return [
+        f"Title {number}",
+        f"https://www.newsmax.com/{number}",
+        "July",
+        "31",
+        "2007",
+        "2007-07-31T10:15:00-04:00",
+        contents,
+    ]
+
+
+def test_get_complete_rows_end():
+    data = to_csv([make_row(1, "one line"), make_row(2, 'a "quoted"\nsecond line')])
+
+    assert get_complete_rows_end(data) == len(data)
+    # Cut in the field with a newline: only the first row is complete
+    cut = data.index(b"second line")
+    assert get_complete_rows_end(data[:cut]) == data.index(b"Title 2")
+    # Cut in the middle of a line
+    assert get_complete_rows_end(data[:5]) == 0
+
+
+def test_index_csv_reads_the_rows_appended(tmp_path):
+    rows = [make_row(number, f"line one\nline {number}") for number in range(3)]
+    data = (CSV_HEADERS + "\n").encode("utf-8") + to_csv(rows)
+    filename = tmp_path / "articles.csv"
+    search_index = SearchIndex(tmp_path / "index.db")
+
+    # The writer is in the middle of the second row's contents
+    filename.write_bytes(data[: data.index(b"line 1")])
+    assert search_index.index_csv(filename) == 1
+    filename.write_bytes(data)
+    assert search_index.index_csv(filename) == 2
+    assert search_index.index_csv(filename) == 0
+
+    contents = search_index.connection.execute(
+        "SELECT contents FROM articles ORDER BY url"
+    ).fetchall()
+    assert contents == [(row[6],) for row in rows]
+    search_index.close()
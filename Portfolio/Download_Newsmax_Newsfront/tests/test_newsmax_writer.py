@@ -0,0 +1,85 @@
+import pytest
+
+import newsmax_writer
+from newsmax_writer import ArticleWriter, CsvArticleSink, WriterError
+
+ROW = [
+    "Title",
+    "https://www.newsmax.com/a",
+    "July",
+    "31",
+    "2007",
+    "2007-07-31T10:15:00-04:00",
+    "Contents",
+]
+
+
+class ListSink:
+    def __init__(self):
+        self.rows = []
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+        return rows
+
+    def close(self):
+        return []
+
+
+class FailingSink:
+    def write_rows(self, rows):
+        raise OSError("No space left on device")
+
+    def close(self):
+        return []
+
+
+def test_rows_are_written_in_batches():
+    sink = ListSink()
+    article_writer = ArticleWriter(sink, batch_size=2, flush_interval=60)
+    article_writer.start()
+    for _ in range(5):
+        article_writer.put(ROW)
+    article_writer.close()
+
+    assert sink.rows == [ROW] * 5
+    # 2 full batches and the rest when closed
+    assert article_writer.batches_written == 3
+
+
+def test_csv_sink(tmp_path):
+    filename = tmp_path / "articles.csv"
+    for _ in range(2):
+        sink = CsvArticleSink(filename)
+        sink.write_rows([ROW])
+        sink.close()
+
+    lines = filename.read_text().splitlines()
+    # The header is only written to a new file
+    assert lines[0] == newsmax_writer.CSV_HEADERS
+    assert len(lines) == 3
+
+
+def test_put_after_close_is_refused():
+    article_writer = ArticleWriter(ListSink())
+    article_writer.start()
+    article_writer.close()
+
+    with pytest.raises(WriterError):
+        article_writer.put(ROW)
+
+
+def test_sink_error_is_raised_by_put_and_close(monkeypatch):
+    monkeypatch.setattr(newsmax_writer, "WRITER_QUEUE_SIZE", 2)
+    monkeypatch.setattr(newsmax_writer, "WRITER_POLL_INTERVAL", 0.01)
+    article_writer = ArticleWriter(FailingSink(), batch_size=1)
+    article_writer.start()
+
+    # Once the writer has failed and its queue is full, put() raises instead
+    # of blocking
+    with pytest.raises(WriterError, match="No space left"):
+        for _ in range(10):
+            article_writer.put(ROW)
+    with pytest.raises(WriterError, match="No space left"):
+        article_writer.close()
+    assert not article_writer.is_alive()
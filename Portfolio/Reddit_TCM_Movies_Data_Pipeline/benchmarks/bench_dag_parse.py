@@ -0,0 +1,140 @@
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Same as the DAG, the pipelines and utils packages are in the parent
+# directory
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+DAG_FILE = os.path.join(PROJECT_DIR, "dags", "reddit_tcm_movies_dag.py")
+# The modules the DAG file imported before its task callables were lazy
+PIPELINE_MODULES = (
+    "pipelines.copy_to_redshift_pipeline",
+    "pipelines.fused_reddit_tcm_movies_pipeline",
+    "pipelines.reddit_tcm_movies_pipeline",
+    "pipelines.upload_to_s3_pipeline",
+)
+# Imported by the pipelines, none of them should be imported by a parse
+HEAVY_MODULES = (
+    "numpy",
+    "pandas",
+    "pyarrow",
+    "praw",
+    "s3fs",
+    "redshift_connector",
+    "zstandard",
+)
+# "lazy" parses the DAG file as it is, "eager" imports the pipelines first
+# like the DAG file did
+MODES = ("eager", "lazy")
+
+
+def parse_dag(mode):
+    """
+    Parses the DAG file once in this process, after importing Airflow like
+    the DAG processor has. Returns the seconds it took, the modules it
+    imported, the heavy ones among them and if config.conf was read
+    """
+    # Not timed, already imported by the DAG processor
+    from airflow import DAG  # noqa: F401
+    from airflow.providers.standard.operators.python import (  # noqa: F401
+        PythonOperator,
+    )
+
+    modules_before = set(sys.modules)
+    start_time = time.perf_counter()
+    if mode == "eager":
+        for module_name in PIPELINE_MODULES:
+            importlib.import_module(module_name)
+    spec = importlib.util.spec_from_file_location("reddit_tcm_movies_dag", DAG_FILE)
+    dag_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dag_module)
+    seconds = time.perf_counter() - start_time
+
+    new_modules = set(sys.modules) - modules_before
+    constants = sys.modules.get("utils.constants")
+    return {
+        "mode": mode,
+        "seconds": seconds,
+        "modules": len(new_modules),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in new_modules],
+        "config_read": constants is not None
+        and constants.load_config.cache_info().currsize > 0,
+    }
+
+
+def main():
+    """
+    Benchmark of the parse of dags/reddit_tcm_movies_dag.py, which the
+    Airflow scheduler repeats continuously. Every parse runs in a new process
+    that already imported Airflow, and reports its time and the modules it
+    imported, with the task callables imported lazily ("lazy", the DAG file
+    as it is) and with the pipelines imported by the parse like before
+    ("eager"). Needs Airflow and the pipelines' requirements, but not
+    config/config.conf:
+
+        python benchmarks/bench_dag_parse.py [--runs 10]
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the DAG file parse")
+    parser.add_argument("--runs", type=int, default=10, help="parses per mode (10)")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    # Used by main() to parse the DAG in a child process
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(parse_dag(args.mode)))
+        return
+
+    print(
+        f"{'mode':<6} {'median ms':>10} {'min ms':>8} {'modules':>8} "
+        f"{'config read':>11}  heavy modules"
+    )
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_dag_parse_") as work_dir:
+        # The config of the offline benchmark, read by the eager parse
+        from bench_pipeline import write_config
+
+        env = dict(os.environ, REDDIT_PIPELINE_CONFIG=write_config(work_dir))
+        for mode in MODES:
+            runs = [
+                json.loads(
+                    subprocess.run(
+                        [sys.executable, __file__, "--mode", mode],
+                        check=True,
+                        capture_output=True,
+                        text=True,
+                        env=env,
+                    ).stdout.splitlines()[-1]
+                )
+                for _ in range(args.runs)
+            ]
+            seconds = [run["seconds"] for run in runs]
+            result = {
+                **runs[0],
+                "seconds": round(statistics.median(seconds), 4),
+                "min_seconds": round(min(seconds), 4),
+            }
+            results.append(result)
+            print(
+                f"{mode:<6} {result['seconds'] * 1000:>10.1f} "
+                f"{result['min_seconds'] * 1000:>8.1f} {result['modules']:>8} "
+                f"{str(result['config_read']):>11}  "
+                f"{', '.join(result['heavy_modules']) or '-'}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import argparse
+import configparser
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Same as the DAG, the etls, pipelines and utils packages are in the parent
+# directory
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+SIZES = (1_000, 100_000, 1_000_000)
+# Each stage is run in its own process, like the tasks of the DAG
+STRATEGY_STAGES = {
+    "tasks": ("extract", "upload", "copy"),
+    "fused": ("fused",),
+}
+# Name of the output files and S3 prefix of the runs
+FILE_NAME = "reddit_bench"
+
+
+class TaskInstance:
+    # Stand-in for the Airflow task instance, the XComs (return value of the
+    # extraction, metrics of the last stage) are kept in a JSON file by key
+    def __init__(self, xcom_file):
+        self.xcom_file = xcom_file
+        self.run_id = "bench"
+        self.map_index = -1
+
+    def xcom_push(self, key, value):
+        xcoms = self.read_xcoms()
+        xcoms[key] = value
+        with open(self.xcom_file, "w") as file:
+            json.dump(xcoms, file)
+
+    def xcom_pull(self, task_ids=None, key="return_value"):
+        return self.read_xcoms().get(key)
+
+    def read_xcoms(self):
+        if not os.path.exists(self.xcom_file):
+            return {}
+        with open(self.xcom_file) as file:
+            return json.load(file)
+
+
+def write_config(work_dir):
+    # config.conf.example with the output path in work_dir, read by
+    # utils/constants.py through REDDIT_PIPELINE_CONFIG
+    parser = configparser.RawConfigParser()
+    parser.read(os.path.join(PROJECT_DIR, "config", "config.conf.example"))
+    parser.set("file_paths", "output_path", os.path.join(work_dir, "output"))
+    os.makedirs(os.path.join(work_dir, "output"), exist_ok=True)
+
+    config_file = os.path.join(work_dir, "config.conf")
+    with open(config_file, "w") as file:
+        parser.write(file)
+    return config_file
+
+
+def run_stage(stage, work_dir, post_count, options):
+    """
+    Runs one stage in this process against the local stand-ins and returns
+    its time, the posts it handled, the peak RSS of the process and the
+    metrics of its stages. The stand-ins replace the connect functions the
+    pipelines call
+    """
+    # Imported here so only the child processes running a stage load the
+    # pipelines, pandas and pyarrow, the parent only starts them. Their
+    # config is the one run_strategy() points REDDIT_PIPELINE_CONFIG to
+    import pyarrow.parquet as pq
+    from stand_ins import FakeReddit, LocalRedshiftConnection, connect_to_local_s3
+
+    import pipelines.copy_to_redshift_pipeline as copy_pipeline
+    import pipelines.fused_reddit_tcm_movies_pipeline as fused_pipeline
+    import pipelines.reddit_tcm_movies_pipeline as reddit_pipeline
+    import pipelines.upload_to_s3_pipeline as upload_pipeline
+    from utils.constants import DATA_OUTPUT_PATH
+
+    subreddits = [f"bench{index}" for index in range(options["subreddits"])]
+    fake_reddit = FakeReddit(post_count, len(subreddits))
+    s3 = connect_to_local_s3(os.path.join(work_dir, "s3"))
+
+    def connect_to_redshift():
+        return LocalRedshiftConnection(os.path.join(work_dir, "redshift.db"), s3)
+
+    reddit_pipeline.connect_to_reddit = lambda *args: fake_reddit
+    upload_pipeline.connect_to_s3 = lambda: s3
+    copy_pipeline.connect_to_redshift = connect_to_redshift
+    fused_pipeline.connect_to_reddit = lambda *args: fake_reddit
+    fused_pipeline.connect_to_s3 = lambda: s3
+    fused_pipeline.connect_to_redshift = connect_to_redshift
+    task_instance = TaskInstance(os.path.join(work_dir, "xcom.json"))
+    extraction_kwargs = {
+        "subreddits": subreddits,
+        "batch_size": options["batch_size"],
+        "load_format": options["load_format"],
+        "parquet_parts": options["parquet_parts"],
+        "comments": options["comments"],
+    }
+
+    start_time = time.perf_counter()
+    if stage == "extract":
+        result = reddit_pipeline.reddit_tcm_movies_pipeline(
+            FILE_NAME, FILE_NAME, task_instance=task_instance, **extraction_kwargs
+        )
+        task_instance.xcom_push("return_value", result)
+    elif stage == "upload":
+        upload_pipeline.upload_to_s3_pipeline(
+            task_instance, compression=options["compression"]
+        )
+    elif stage == "copy":
+        copy_pipeline.copy_to_redshift_pipeline(
+            task_instance, compression=options["compression"]
+        )
+    else:
+        fused_pipeline.fused_reddit_tcm_movies_pipeline(
+            FILE_NAME,
+            compression=options["compression"],
+            task_instance=task_instance,
+            **extraction_kwargs,
+        )
+    seconds = time.perf_counter() - start_time
+
+    if stage in ("extract", "upload"):
+        # Posts of the local Parquet dataset
+        parquet_dir = f"{DATA_OUTPUT_PATH}/{FILE_NAME}.parquet"
+        row_count = sum(
+            pq.read_metadata(os.path.join(dir_path, file_name)).num_rows
+            for dir_path, _, file_names in os.walk(parquet_dir)
+            for file_name in file_names
+        )
+    else:
+        # Posts in the table
+        cursor = connect_to_redshift().cursor()
+        cursor.execute("select count(*) from forum_posts_data")
+        row_count = cursor.fetchone()[0]
+
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "stage": stage,
+        "posts": post_count,
+        "rows": row_count,
+        "seconds": round(seconds, 4),
+        "peak_memory_mb": round(peak_rss / 1024, 1),
+        # Seconds, rows, bytes and API calls of the stages of the task
+        "stages": task_instance.xcom_pull(key="metrics")["stages"],
+    }
+
+
+def run_strategy(strategy, post_count, options):
+    # Runs the stages of the strategy one after the other in child processes,
+    # in a new working directory with its own output, S3 and database
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as work_dir:
+        env = dict(os.environ, REDDIT_PIPELINE_CONFIG=write_config(work_dir))
+        for stage in STRATEGY_STAGES[strategy]:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--stage",
+                    stage,
+                    "--work-dir",
+                    work_dir,
+                    "--sizes",
+                    str(post_count),
+                    "--options",
+                    json.dumps(options),
+                ],
+                check=True,
+                # The errors of the stage are shown
+                stdout=subprocess.PIPE,
+                text=True,
+                env=env,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            result["strategy"] = strategy
+            results.append(result)
+
+    return results
+
+
+def print_result(strategy, stage, posts, rows, seconds, peak_memory_mb=None):
+    rows_per_second = rows / seconds if seconds else 0
+    peak_memory = f"{peak_memory_mb:>9.1f}" if peak_memory_mb is not None else " " * 9
+    print(
+        f"{strategy:<8} {stage:<20} {posts:>9} {rows:>9} {seconds:>9.3f} "
+        f"{rows_per_second:>11.0f} {peak_memory}"
+    )
+
+
+def main():
+    """
+    End-to-end benchmark of the pipeline without Reddit, AWS or Redshift:
+    the posts come from a fake praw client, S3 is a local directory behind
+    fsspec and Redshift is a SQLite database running the COPY. Every stage
+    runs in its own process and reports its wall time, rows per second and
+    peak RSS, for the three tasks of the DAG and the fused pipeline:
+
+        python benchmarks/bench_pipeline.py [--sizes 1000,100000,1000000]
+            [--strategies tasks,fused] [--load-format csv|parquet]
+            [--compression gzip|zstd] [--subreddits 1] [--comments]
+            [--json results.json]
+
+    The extract stage of the three tasks also transforms and writes the
+    posts. The copy times are the ones of SQLite, only comparable between
+    runs of this benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the Reddit pipeline")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=list(SIZES),
+        help="comma-separated numbers of posts (default: 1000,100000,1000000)",
+    )
+    parser.add_argument(
+        "--strategies",
+        type=lambda value: value.split(","),
+        default=list(STRATEGY_STAGES),
+        help="comma-separated pipelines to run: tasks, fused (default: both)",
+    )
+    parser.add_argument(
+        "--load-format", choices=("csv", "parquet"), default="csv", help="(csv)"
+    )
+    parser.add_argument(
+        "--compression", choices=("gzip", "zstd"), help="of the .CSVs (none)"
+    )
+    parser.add_argument(
+        "--subreddits",
+        type=int,
+        default=1,
+        help="number of subreddits the posts are split between (1)",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000, help="(1000)")
+    parser.add_argument("--parquet-parts", type=int, default=4, help="(4)")
+    parser.add_argument(
+        "--comments",
+        action="store_true",
+        help="also extract and load up to 20 comments per post",
+    )
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    # Used by run_strategy() to run one stage in a child process
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--options", type=json.loads, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(
+            json.dumps(
+                run_stage(args.stage, args.work_dir, args.sizes[0], args.options)
+            )
+        )
+        return
+
+    for strategy in args.strategies:
+        if strategy not in STRATEGY_STAGES:
+            parser.error(f"unknown strategy {strategy!r}")
+    options = {
+        "load_format": args.load_format,
+        "compression": args.compression,
+        "subreddits": args.subreddits,
+        "batch_size": args.batch_size,
+        "parquet_parts": args.parquet_parts,
+        "comments": args.comments,
+    }
+
+    print(
+        f"load format {args.load_format}, compression {args.compression}, "
+        f"{args.subreddits} subreddits, batches of {args.batch_size} posts"
+    )
+    print(
+        f"{'strategy':<8} {'stage':<20} {'posts':>9} {'rows':>9} {'seconds':>9} "
+        f"{'rows/s':>11} {'peak MB':>9}"
+    )
+    results = []
+    for post_count in args.sizes:
+        for strategy in args.strategies:
+            for result in run_strategy(strategy, post_count, options):
+                results.append(result)
+                print_result(
+                    strategy,
+                    result["stage"],
+                    post_count,
+                    result["rows"],
+                    result["seconds"],
+                    result["peak_memory_mb"],
+                )
+                # Stages of the task, from the metrics it pushed
+                for stage, stage_metrics in result["stages"].items():
+                    print_result(
+                        strategy,
+                        f"  {stage}",
+                        post_count,
+                        stage_metrics.get("rows", 0),
+                        stage_metrics["seconds"],
+                    )
+
+            if results[-1]["rows"] != post_count:
+                print(f"  {results[-1]['rows']} posts loaded instead of {post_count}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
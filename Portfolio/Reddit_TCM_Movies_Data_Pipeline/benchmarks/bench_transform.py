@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Same as the DAG, the etls and utils packages are in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import write_config
+from stand_ins import iter_synthetic_posts
+
+SIZES = (1_000, 100_000, 1_000_000)
+# Posts per batch of the streaming runs, the DAG's default
+BATCH_SIZE = 1000
+
+
+def generate_posts(count, seed=7):
+    # Synthetic posts with the fields, value types and rough sizes of the
+    # posts returned by praw
+    return list(iter_synthetic_posts(count, seed=seed))
+
+
+def transform_data_baseline(posts):
+    # The transform_data() the pipeline used before, given the DataFrame the
+    # pipeline built from the posts, kept to compare against
+    post_dataframe = pd.DataFrame(posts)
+    post_dataframe["created_utc"] = pd.to_datetime(
+        post_dataframe["created_utc"], unit="s"
+    )
+    post_dataframe["over_18"] = np.where(post_dataframe["over_18"], False, True)
+    post_dataframe["author"] = post_dataframe["author"].astype(str)
+    edited_mode = post_dataframe["edited"].mode()
+    post_dataframe["edited"] = np.where(
+        post_dataframe["edited"].isin([True, False]),
+        post_dataframe["edited"],
+        edited_mode,
+    ).astype(bool)
+    post_dataframe["num_comments"] = post_dataframe["num_comments"].astype(int)
+    post_dataframe["score"] = post_dataframe["score"].astype(int)
+    post_dataframe["upvote_ratio"] = post_dataframe["upvote_ratio"].astype(int)
+    post_dataframe["selftext"] = post_dataframe["selftext"].astype(str)
+    post_dataframe["title"] = post_dataframe["title"].astype(str)
+
+    return post_dataframe
+
+
+FUNCTIONS = (
+    # transform_data_baseline()
+    "baseline",
+    # transform_data()
+    "arrow",
+    # transform_data() and PostFileWriter over batches, like the pipeline
+    "streaming",
+)
+
+
+def run_function(name, count):
+    """
+    Runs one function over count posts in this process, then writes its
+    output to .CSV and Parquet like the pipeline, and returns the time of both
+    and the peak RSS they added on top of the generated posts. Each run is
+    done in its own process by main() so the peaks don't overlap
+    """
+    # Imported here so only the child processes load the pipeline, with the
+    # config main() points REDDIT_PIPELINE_CONFIG to
+    from etls.reddit_tcm_movies_etl import (
+        load_data_to_csv,
+        load_data_to_parquet,
+        transform_data,
+    )
+
+    posts = generate_posts(count)
+    # ru_maxrss is in KB on Linux
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory(prefix="bench_transform_") as output_dir:
+        csv_path = os.path.join(output_dir, "posts.csv")
+        parquet_path = os.path.join(output_dir, "posts.parquet")
+
+        if name == "streaming":
+            transform_time, write_time, dataframe_size = run_streaming(
+                posts, csv_path, parquet_path
+            )
+        else:
+            start_time = time.perf_counter()
+            if name == "baseline":
+                post_dataframe = transform_data_baseline(posts)
+            else:
+                post_dataframe = transform_data(posts)
+            transform_time = time.perf_counter() - start_time
+            dataframe_size = post_dataframe.memory_usage(deep=True).sum()
+
+            start_time = time.perf_counter()
+            load_data_to_csv(post_dataframe, csv_path)
+            load_data_to_parquet(post_dataframe, parquet_path)
+            write_time = time.perf_counter() - start_time
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "function": name,
+        "posts": count,
+        "transform_seconds": round(transform_time, 4),
+        "write_seconds": round(write_time, 4),
+        "peak_memory_mb": round((peak_rss - start_rss) / 1024, 1),
+        "dataframe_mb": round(dataframe_size / 2**20, 1),
+    }
+
+
+def run_streaming(posts, csv_path, parquet_path):
+    # Returns the time spent transforming and writing the batches and the
+    # size of the largest DataFrame
+    from etls.reddit_tcm_movies_etl import PostFileWriter, iter_batches, transform_data
+
+    transform_time = write_time = 0.0
+    dataframe_size = 0
+    post_writer = PostFileWriter(csv_path, parquet_path)
+
+    for batch in iter_batches(iter(posts), BATCH_SIZE):
+        start_time = time.perf_counter()
+        post_dataframe = transform_data(batch)
+        transform_time += time.perf_counter() - start_time
+        dataframe_size = max(
+            dataframe_size, post_dataframe.memory_usage(deep=True).sum()
+        )
+
+        start_time = time.perf_counter()
+        post_writer.write(post_dataframe)
+        write_time += time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    post_writer.close()
+    write_time += time.perf_counter() - start_time
+
+    return transform_time, write_time, dataframe_size
+
+
+def main():
+    """
+    Benchmark of transform_data() against the function it replaced, over
+    synthetic posts, and of the streaming pipeline that transforms and writes
+    them in batches. Every run is done in a child process and reports the
+    time of the transform and of writing its output to .CSV and Parquet, the
+    peak memory they added and the size of the (largest) DataFrame. The
+    output path is read from a config written to a temporary directory:
+
+        python benchmarks/bench_transform.py [--sizes 1000,100000,1000000]
+    """
+    parser = argparse.ArgumentParser(description="Benchmark transform_data()")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=list(SIZES),
+        help="comma-separated numbers of posts (default: 1000,100000,1000000)",
+    )
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    # Used by main() to run one function in a child process
+    parser.add_argument("--run", choices=FUNCTIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_function(args.run, args.sizes[0])))
+        return
+
+    print(f"pandas {pd.__version__}, numpy {np.__version__}")
+    print(
+        f"{'function':<10} {'posts':>9} {'transform s':>11} {'write s':>9} "
+        f"{'peak MB':>9} {'DataFrame MB':>12}"
+    )
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_transform_") as work_dir:
+        env = dict(os.environ, REDDIT_PIPELINE_CONFIG=write_config(work_dir))
+
+        for count in args.sizes:
+            for name in FUNCTIONS:
+                output = subprocess.run(
+                    [sys.executable, __file__, "--run", name, "--sizes", str(count)],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                    env=env,
+                ).stdout
+                result = json.loads(output.splitlines()[-1])
+                results.append(result)
+                print(
+                    f"{name:<10} {count:>9} {result['transform_seconds']:>11.3f} "
+                    f"{result['write_seconds']:>9.3f} "
+                    f"{result['peak_memory_mb']:>9.1f} "
+                    f"{result['dataframe_mb']:>12.1f}"
+                )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Local stand-ins for Reddit, S3 and Redshift, so the pipelines can be run and
+benchmarked offline: a fake praw client yielding synthetic submissions, a
+local directory behind the fsspec interface of s3fs and a SQLite database
+behind the redshift_connector interface that runs the pipeline's COPY
+"""
+
+import json
+import random
+import re
+import sqlite3
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import redshift_connector
+from fsspec.implementations.dirfs import DirFileSystem
+from fsspec.implementations.local import LocalFileSystem
+
+# Codecs of the COPY options of compressed .CSVs
+COPY_COMPRESSIONS = ("gzip", "zstd")
+# Rows inserted at a time by COPY
+COPY_BATCH_SIZE = 10_000
+
+
+class Redditor:
+    # Stand-in for praw's Redditor, only its name is used
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+def iter_synthetic_posts(count, subreddit="TurnerClassicMovies", seed=7, prefix=""):
+    """
+    Synthetic posts with the fields, value types and rough sizes of the posts
+    returned by praw: a Redditor or None as author, False or the edit time as
+    edited and the upvote ratio as a float. Newest first like /new, ids start
+    with prefix
+    """
+    rng = random.Random(seed)
+    authors = [Redditor(f"user_{index}") for index in range(5000)]
+    words = ["classic", "movie", "noir", "tcm", "film", "star", "western", "1950s"]
+
+    for index in range(count):
+        created_utc = 1_700_000_000.0 - index * 60
+        yield {
+            "id": f"{prefix}{index:x}",
+            "title": " ".join(rng.choices(words, k=rng.randint(3, 15))),
+            "selftext": " ".join(rng.choices(words, k=rng.randint(0, 120))),
+            "score": rng.randint(0, 5000),
+            "num_comments": rng.randint(0, 500),
+            "author": rng.choice(authors) if rng.random() > 0.05 else None,
+            "created_utc": created_utc,
+            "url": f"https://www.reddit.com/r/{subreddit}/comments/{index:x}/",
+            "upvote_ratio": round(rng.uniform(0.5, 1.0), 2),
+            "over_18": rng.random() < 0.02,
+            "edited": created_utc + 600 if rng.random() < 0.1 else False,
+            "spoiler": rng.random() < 0.05,
+            "stickied": rng.random() < 0.01,
+            "subreddit": subreddit,
+        }
+
+
+class FakeSubmission:
+    # Stand-in for praw's Submission, the fields are its attributes
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+
+def iter_synthetic_comments(post_id, subreddit, count):
+    # Synthetic comments of the post, praw Comment fields. The first ones are
+    # top-level, the others reply to an earlier comment
+    rng = random.Random(post_id)
+    for index in range(count):
+        parent_index = rng.randrange(index) if index and rng.random() < 0.6 else None
+        yield {
+            "id": f"{post_id}c{index:x}",
+            "parent_id": (
+                f"t3_{post_id}"
+                if parent_index is None
+                else f"t1_{post_id}c{parent_index:x}"
+            ),
+            "author": Redditor(f"user_{rng.randrange(5000)}"),
+            "body": " ".join(
+                rng.choices(["great", "film", "noir"], k=rng.randint(1, 60))
+            ),
+            "score": rng.randint(-5, 500),
+            "created_utc": 1_700_000_000.0 + index * 30,
+            "edited": False,
+            "depth": 0 if parent_index is None else 1,
+            "subreddit": subreddit,
+        }
+
+
+class FakeCommentForest:
+    # Stand-in for praw's CommentForest, already without "load more comments"
+    def __init__(self, comments):
+        self.comments = comments
+
+    def replace_more(self, limit=32):
+        return []
+
+    def list(self):
+        return self.comments
+
+
+class FakeSubreddit:
+    # Every listing yields the same post_count synthetic submissions
+    def __init__(self, name, post_count, number):
+        self.name = name
+        self.post_count = post_count
+        self.number = number
+
+    def top(self, time_filter=None, limit=None):
+        return self.submissions(limit)
+
+    def new(self, limit=None):
+        return self.submissions(limit)
+
+    def hot(self, limit=None):
+        return self.submissions(limit)
+
+    def submissions(self, limit):
+        count = self.post_count if limit is None else min(limit, self.post_count)
+        # The ids of every subreddit start with its number, so they are unique
+        for post in iter_synthetic_posts(
+            count, self.name, seed=self.number, prefix=f"{self.number}x"
+        ):
+            yield FakeSubmission(post)
+
+
+class FakeReddit:
+    """
+    Stand-in for praw.Reddit: post_count synthetic posts split evenly between
+    subreddit_count subreddits, with up to 20 synthetic comments each.
+    Nothing is requested so the rate budget is never waited on, the extract
+    times are the ones of the pipeline and of generating the posts
+    """
+
+    def __init__(self, post_count, subreddit_count=1):
+        self.post_count = post_count
+        self.subreddit_count = subreddit_count
+        self.subreddit_numbers = {}
+
+    def subreddit(self, name):
+        number = self.subreddit_numbers.setdefault(name, len(self.subreddit_numbers))
+        post_count = self.post_count // self.subreddit_count + (
+            number < self.post_count % self.subreddit_count
+        )
+        return FakeSubreddit(name, post_count, number)
+
+    def submission(self, id):
+        # The comments of a post, their number only depends on its id. The ids
+        # of the posts start with the number of their subreddit
+        count = random.Random(id).randrange(21)
+        subreddit = next(
+            name
+            for name, number in self.subreddit_numbers.items()
+            if id.startswith(f"{number}x")
+        )
+        submission = FakeSubmission({"id": id})
+        submission.comments = FakeCommentForest(
+            [
+                FakeSubmission(comment)
+                for comment in iter_synthetic_comments(id, subreddit, count)
+            ]
+        )
+        return submission
+
+
+class LocalS3FileSystem(DirFileSystem):
+    # DirFileSystem only runs sizes() on async filesystems
+    def sizes(self, paths):
+        return [self.size(path) for path in paths]
+
+
+def connect_to_local_s3(root_dir):
+    # fsspec filesystem of the directory, used like s3fs: "bucket/key" paths
+    # are root_dir/bucket/key. Local files have no ETag, so upload_to_s3()
+    # uploads every file
+    return LocalS3FileSystem(path=root_dir, fs=LocalFileSystem(auto_mkdir=True))
+
+
+class LocalRedshiftConnection:
+    """
+    Stand-in for a redshift_connector connection to a SQLite database. The
+    statements of copy_to_redshift_db() that SQLite doesn't have are
+    translated: COPY reads the .CSV or Parquet files of the prefix or
+    manifest from the local S3 stand-in and inserts their rows, CREATE TABLE
+    ... (LIKE ...), DELETE ... USING and the catalog queries are rewritten,
+    and the encodings, dist styles, sort keys and VACUUM are left out. The
+    copy times are the ones of the pipeline and of SQLite, not of a Redshift
+    cluster
+    """
+
+    def __init__(self, database_path, s3):
+        self.connection = sqlite3.connect(database_path, isolation_level=None)
+        self.s3 = s3
+        self._autocommit = True
+
+    @property
+    def autocommit(self):
+        return self._autocommit
+
+    @autocommit.setter
+    def autocommit(self, autocommit):
+        if not autocommit and not self.connection.in_transaction:
+            self.connection.execute("begin")
+        self._autocommit = autocommit
+
+    def cursor(self):
+        return LocalRedshiftCursor(self)
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute("commit")
+        if not self._autocommit:
+            self.connection.execute("begin")
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.connection.execute("rollback")
+
+    def close(self):
+        self.rollback()
+        self.connection.close()
+
+
+class LocalRedshiftCursor:
+    def __init__(self, redshift_conn):
+        self.redshift_conn = redshift_conn
+        self.cursor = redshift_conn.connection.cursor()
+        self.rowcount = -1
+
+    def execute(self, query, args=None):
+        try:
+            copy_match = re.match(
+                r"copy (\w+) from 's3://([^']+)' credentials '[^']*' (.*)$",
+                query,
+                re.IGNORECASE | re.DOTALL,
+            )
+            if copy_match:
+                self.rowcount = self.copy(*copy_match.groups())
+                return
+
+            if "svv_table_info" in query:
+                # SQLite keeps no statistics, the table is never analyzed
+                query, args = f"select 'ALL', count(*), 0, 100 from {args[0]}", None
+            query = re.sub(
+                r"select 1 from information_schema\.tables where .* = %s",
+                "select 1 from sqlite_master where type = 'table' and name = ?",
+                query,
+            )
+            query = re.sub(
+                r"select column_name, data_type from information_schema\.columns "
+                r"where .* = %s",
+                "select name, lower(type) from pragma_table_info(?)",
+                query,
+            )
+            # Redshift's encodings, dist style and sort key, and the upkeep
+            # SQLite doesn't need
+            query = re.sub(
+                r" encode \w+| diststyle (all|key distkey\(\w+\))"
+                r"| compound sortkey\([^)]*\)",
+                "",
+                query,
+            )
+            query = re.sub(
+                r"^(alter table \w+ alter diststyle|vacuum) .*", "select 1", query
+            )
+            query = query.replace("%s", "?")
+            # SQLite casts a text to a timestamp as a number, the year
+            query = re.sub(r"cast\((\w+) as timestamp\)", r"datetime(\1)", query)
+            query = re.sub(
+                r"create temp table (\w+) \(like (\w+)\)",
+                r"create temp table \1 as select * from \2 where 0",
+                query,
+                flags=re.IGNORECASE,
+            )
+            query = re.sub(
+                r"delete from (\w+) using (\w+) where (.+)",
+                r"delete from \1 where exists (select 1 from \2 where \3)",
+                query,
+                flags=re.IGNORECASE,
+            )
+            self.cursor.execute(query, args or ())
+            self.rowcount = self.cursor.rowcount
+        except sqlite3.Error as e:
+            raise redshift_connector.Error(str(e)) from e
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def copy(self, table, s3_path, options):
+        # Inserts the rows of the files, in the order of the columns of the
+        # table like COPY. Returns the number of rows
+        options = options.lower().split()
+        s3 = self.redshift_conn.s3
+        if "manifest" in options:
+            manifest = json.loads(s3.cat(s3_path))
+            file_paths = [
+                entry["url"].removeprefix("s3://") for entry in manifest["entries"]
+            ]
+        else:
+            # Every object whose key starts with the prefix
+            parent_dir = s3_path.rsplit("/", 1)[0]
+            file_paths = sorted(
+                path for path in s3.find(parent_dir) if path.startswith(s3_path)
+            )
+        compression = next(
+            (option for option in options if option in COPY_COMPRESSIONS), None
+        )
+
+        row_count = 0
+        for file_path in file_paths:
+            with s3.open(file_path, "rb") as file:
+                if "parquet" in options:
+                    batches = pq.ParquetFile(file).iter_batches(COPY_BATCH_SIZE)
+                else:
+                    stream = file
+                    if compression is not None:
+                        stream = pa.CompressedInputStream(file, compression)
+                    batches = pa_csv.open_csv(stream)
+                for batch in batches:
+                    row_count += self.insert_batch(table, batch)
+
+        return row_count
+
+    def insert_batch(self, table, batch):
+        # Timestamps as text, SQLite has no datetime type
+        columns = [
+            column.cast(pa.string()) if pa.types.is_timestamp(column.type) else column
+            for column in batch.columns
+        ]
+        rows = list(zip(*[column.to_pylist() for column in columns]))
+        placeholders = ", ".join("?" * len(columns))
+        self.cursor.executemany(f"insert into {table} values ({placeholders})", rows)
+        return len(rows)
@@ -23,9 +23,23 @@ Comment has to go here or an "Module level import not at top of file" error is g
 """
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pipelines.copy_to_redshift_pipeline import copy_to_redshift_pipeline
-from pipelines.reddit_tcm_movies_pipeline import reddit_tcm_movies_pipeline
-from pipelines.upload_to_s3_pipeline import upload_to_s3_pipeline
+# Neither import reads config/config.conf nor imports the pipelines, which
+# are only imported by the tasks running them (benchmarks/bench_dag_parse.py)
+from utils.constants import REDDIT_REQUESTS_PER_MINUTE
+from utils.lazy_tasks import lazy_callable
+
+reddit_tcm_movies_pipeline = lazy_callable(
+    "pipelines.reddit_tcm_movies_pipeline", "reddit_tcm_movies_pipeline"
+)
+upload_to_s3_pipeline = lazy_callable(
+    "pipelines.upload_to_s3_pipeline", "upload_to_s3_pipeline"
+)
+copy_to_redshift_pipeline = lazy_callable(
+    "pipelines.copy_to_redshift_pipeline", "copy_to_redshift_pipeline"
+)
+fused_reddit_tcm_movies_pipeline = lazy_callable(
+    "pipelines.fused_reddit_tcm_movies_pipeline", "fused_reddit_tcm_movies_pipeline"
+)
 
 default_args = {"owner": "Bill Banks Jr", "start_date": datetime(2025, 10, 29)}
 
@@ -39,28 +53,120 @@ dag = DAG(
     tags=["reddit", "tcm_movies", "etl", "pipeline"],
 )
 
-# Extraction from the Reddit TurnerClassicMovies subreddit
-extract = PythonOperator(
-    task_id="reddit_tcm_movies_extraction",
-    python_callable=reddit_tcm_movies_pipeline,
-    op_kwargs={
-        "csv_file_name": f"reddit{file_date}",
-        "parquet_file_name": f"reddit{file_date}",
-        "subreddit": "TurnerClassicMovies",
-        "time_filter": "month",  # Changed from "day" to get more than one day's worth of data
-        "limit": 1000,  # Number of posts per day to import
-    },
-    dag=dag,
-)
+# Subreddits and listings ("top", "new" and/or "hot") extracted
+SUBREDDITS = ["TurnerClassicMovies"]
+LISTINGS = ["top"]
+# One mapped extraction task per subreddit instead of one task extracting them
+# all with a pool of threads. Each task gets its share of the Reddit requests
+# per minute and can be retried on its own
+MAP_SUBREDDITS = False
+# Compression of the .CSVs uploaded to S3 and copied to Redshift, "gzip" or
+# "zstd". None uploads them uncompressed like before
+CSV_COMPRESSION = None
+# One task streaming the posts to S3 and copying them to Redshift instead of
+# the extraction, upload and copy tasks
+FUSED = False
+# True analyzes, vacuums or redistributes the tables loaded when they need
+# it, after the copy (etls/redshift_schema_functions.py). Off like before,
+# Redshift's automatic maintenance is left alone
+MAINTAIN_TABLES = False
 
-# Upload .CSV to S3
-upload_to_s3 = PythonOperator(
-    task_id="upload_to_s3", python_callable=upload_to_s3_pipeline, dag=dag
-)
+extraction_kwargs = {
+    "csv_file_name": f"reddit{file_date}",
+    "parquet_file_name": f"reddit{file_date}",
+    "subreddits": SUBREDDITS,
+    "listings": LISTINGS,
+    # Changed from "day" to get more than one day's worth of data
+    "time_filter": "month",
+    "limit": 1000,  # Number of posts per day to import
+    # True only extracts the posts created since the last run, plus the last
+    # 48 hours before it to update their score and number of comments. Off
+    # like before, every run extracts the top posts of time_filter
+    "incremental": False,
+    "rescan_hours": 48,
+    # Posts extracted, transformed and written at a time
+    "batch_size": 1000,
+    # "parquet" loads Redshift from Parquet files, typed like the table, split
+    # in parquet_parts files per subreddit so every slice of the cluster loads
+    # one ("select count(*) from stv_slices"). "csv" copies the .CSVs like
+    # before
+    "load_format": "csv",
+    "parquet_parts": 4,
+    # True also loads the comments of the posts whose number of comments
+    # changed into forum_comments_data. 4 comment trees are requested at a
+    # time, each expanding up to 8 "load more comments" links (a request each)
+    "comments": False,
+    "replace_more_limit": 8,
+    "comment_workers": 4,
+}
 
-# Copy .CSV to Redshift
-copy_to_redshift_db = PythonOperator(
-    task_id="copy_to_redshift_db", python_callable=copy_to_redshift_pipeline, dag=dag
-)
+if FUSED:
+    # Extraction, upload to S3 and copy to Redshift in one task, streaming the
+    # posts to S3 without writing them to the local disk
+    reddit_tcm_movies_fused = PythonOperator(
+        task_id="reddit_tcm_movies_fused",
+        python_callable=fused_reddit_tcm_movies_pipeline,
+        op_kwargs={
+            **{
+                key: value
+                for key, value in extraction_kwargs.items()
+                if key not in ("csv_file_name", "parquet_file_name")
+            },
+            "s3_file_name": f"reddit{file_date}",
+            "compression": CSV_COMPRESSION,
+            "maintain_tables": MAINTAIN_TABLES,
+        },
+        dag=dag,
+    )
+else:
+    # Extraction from the Reddit subreddits
+    if MAP_SUBREDDITS:
+        extract = PythonOperator.partial(
+            task_id="reddit_tcm_movies_extraction",
+            python_callable=reddit_tcm_movies_pipeline,
+            dag=dag,
+        ).expand(
+            op_kwargs=[
+                {
+                    **extraction_kwargs,
+                    "subreddits": [subreddit],
+                    "requests_per_minute": REDDIT_REQUESTS_PER_MINUTE / len(SUBREDDITS),
+                }
+                for subreddit in SUBREDDITS
+            ]
+        )
+    else:
+        extract = PythonOperator(
+            task_id="reddit_tcm_movies_extraction",
+            python_callable=reddit_tcm_movies_pipeline,
+            op_kwargs=extraction_kwargs,
+            dag=dag,
+        )
+
+    # Upload .CSV to S3
+    upload_to_s3 = PythonOperator(
+        task_id="upload_to_s3",
+        python_callable=upload_to_s3_pipeline,
+        op_kwargs={
+            # Compression of the .CSVs, "gzip", "zstd" (needs zstandard) or None
+            "compression": CSV_COMPRESSION,
+            # Parts of 16 MB of the files over 32 MB, 8 parts and 8 files at a time
+            "part_size": 16 * 2**20,
+            "max_concurrency": 8,
+            "batch_size": 8,
+        },
+        dag=dag,
+    )
+
+    # Copy .CSV to Redshift
+    copy_to_redshift_db = PythonOperator(
+        task_id="copy_to_redshift_db",
+        python_callable=copy_to_redshift_pipeline,
+        op_kwargs={
+            "compression": CSV_COMPRESSION,
+            "maintain_tables": MAINTAIN_TABLES,
+        },
+        dag=dag,
+    )
 
-extract >> upload_to_s3 >> copy_to_redshift_db
+    extract >> upload_to_s3 >> copy_to_redshift_db
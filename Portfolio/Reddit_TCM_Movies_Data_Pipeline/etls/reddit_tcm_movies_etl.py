@@ -1,19 +1,105 @@
+import itertools
+import json
+import os
 import sys
+import threading
+import time
 
-import numpy as np
 import pandas as pd
 import praw
+import prawcore
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from praw import Reddit
 
-from utils.constants import POST_FIELDS
+from utils.constants import (
+    COMMENT_COUNTS_FILE,
+    COMMENT_FIELDS,
+    POST_FIELDS,
+    POST_METRIC_FIELDS,
+    POST_SCHEMA,
+    POST_SNAPSHOTS_FILE,
+    WATERMARK_FILE,
+)
 
 
-def connect_to_reddit(reddit_client_id, reddit_secret_key, user_agent) -> Reddit:
+# Listings of a subreddit that can be extracted
+LISTINGS = ("top", "new", "hot")
+# "load more comments" links of a post's comment tree expanded by default,
+# each one is a request to Reddit
+REPLACE_MORE_LIMIT = 8
+# Days the last snapshot of a post is kept, a post extracted again after its
+# snapshot was dropped is loaded as a new post (see get_post_changes())
+POST_SNAPSHOT_RETENTION_DAYS = 90
+
+
+class RateBudget:
+    """
+    Token bucket of the requests made to Reddit, shared by every thread using
+    the same client. Up to burst requests can be made at once, then one every
+    60 / requests_per_minute seconds. A request that has to wait reserves its
+    slot before sleeping so the threads are served in order
+    """
+
+    def __init__(self, requests_per_minute: float, burst=10):
+        self.interval = 60 / requests_per_minute
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_time = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.request_count = 0
+        self.wait_time = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated_time) / self.interval
+            )
+            self.updated_time = now
+            self.tokens -= 1
+            wait_time = -self.tokens * self.interval if self.tokens < 0 else 0.0
+
+            self.request_count += 1
+            self.wait_time += wait_time
+
+        if wait_time:
+            time.sleep(wait_time)
+
+    def describe(self):
+        return (
+            f"{self.request_count} requests to Reddit, {self.wait_time:.1f}s "
+            f"waited for the rate budget"
+        )
+
+
+class RateBudgetRequestor(prawcore.Requestor):
+    # praw's extension point for its HTTP requests: every request to Reddit,
+    # the access token ones included, takes a token from the rate budget
+
+    def __init__(self, *args, rate_budget=None, **kwargs):
+        self.rate_budget = rate_budget
+        super().__init__(*args, **kwargs)
+
+    def request(self, *args, **kwargs):
+        if self.rate_budget is not None:
+            self.rate_budget.acquire()
+        return super().request(*args, **kwargs)
+
+
+def connect_to_reddit(
+    reddit_client_id, reddit_secret_key, user_agent, rate_budget=None
+) -> Reddit:
     try:
         reddit = praw.Reddit(
             client_id=reddit_client_id,
             client_secret=reddit_secret_key,
             user_agent=user_agent,
+            requestor_class=RateBudgetRequestor,
+            requestor_kwargs={"rate_budget": rate_budget},
         )
         print("Connection to Reddit established.")
         return reddit
@@ -22,52 +108,506 @@ def connect_to_reddit(reddit_client_id, reddit_secret_key, user_agent) -> Reddit
         sys.exit(1)
 
 
+def get_post_fields(post) -> dict:
+    # Only the POST_FIELDS of a praw Submission. Read from its attributes
+    # directly as getattr() would request the post again for a missing one
+    post_dict = vars(post)
+    return {key: post_dict[key] for key in POST_FIELDS}
+
+
 def extract_posts(
-    reddit_instance: Reddit, subreddit: str, time_filter: str, limit=None
+    reddit_instance: Reddit,
+    subreddit: str,
+    time_filter: str,
+    limit=None,
+    listing="top",
 ):
+    # Generator, praw requests the listing 100 posts at a time as it is read.
+    # time_filter is only used by the "top" listing
+    if listing not in LISTINGS:
+        raise ValueError(f'Unknown listing "{listing}", expected one of {LISTINGS}.')
+
     subreddit = reddit_instance.subreddit(subreddit)
-    posts = subreddit.top(time_filter=time_filter, limit=limit)
+    if listing == "top":
+        posts = subreddit.top(time_filter=time_filter, limit=limit)
+    else:
+        posts = getattr(subreddit, listing)(limit=limit)
+
+    for post in posts:
+        yield get_post_fields(post)
+
 
-    post_lists = []
+def extract_listing_posts(
+    reddit_instance: Reddit,
+    subreddit: str,
+    listings: list,
+    time_filter: str,
+    limit=None,
+):
+    # The posts of every listing of the subreddit, one after the other. A post
+    # that is in several listings is only yielded the first time
+    seen_ids = set()
+
+    for listing in listings:
+        for post in extract_posts(
+            reddit_instance, subreddit, time_filter, limit, listing
+        ):
+            if post["id"] in seen_ids:
+                continue
+            seen_ids.add(post["id"])
+            yield post
+
+
+def extract_new_posts(
+    reddit_instance: Reddit, subreddit: str, since_utc: float, limit=None
+):
+    # /new is sorted newest first so the listing is only read until the first
+    # post created before since_utc
+    subreddit = reddit_instance.subreddit(subreddit)
+    posts = subreddit.new(limit=limit)
 
     for post in posts:
-        post_dict = vars(post)
-        post = {key: post_dict[key] for key in POST_FIELDS}
-        post_lists.append(post)
+        if post.created_utc < since_utc:
+            break
+        yield get_post_fields(post)
 
-    return post_lists
 
+def get_comment_fields(comment, post_id: str) -> dict:
+    # Only the COMMENT_FIELDS of a praw Comment, read from its attributes like
+    # get_post_fields()
+    comment_dict = vars(comment)
+    return {
+        key: post_id if key == "submission_id" else comment_dict.get(key)
+        for key in COMMENT_FIELDS
+    }
 
-# Clean data
-def transform_data(post_dataframe: pd.DataFrame):
-    post_dataframe["created_utc"] = pd.to_datetime(
-        post_dataframe["created_utc"], unit="s"
+
+def extract_comments(
+    reddit_instance: Reddit, post_id: str, replace_more_limit=REPLACE_MORE_LIMIT
+):
+    """
+    Every comment of the post, replies included, as a flat list. The comment
+    tree is requested with the post, then up to replace_more_limit of its
+    "load more comments" links are expanded, a request each (None expands
+    them all, which can take hundreds of requests for a large thread)
+    """
+    submission = reddit_instance.submission(id=post_id)
+    submission.comments.replace_more(limit=replace_more_limit)
+
+    return [
+        get_comment_fields(comment, post_id) for comment in submission.comments.list()
+    ]
+
+
+def iter_batches(posts, batch_size: int):
+    # Lists of batch_size posts taken from the posts generator, the last one
+    # can be shorter
+    posts = iter(posts)
+    while batch := list(itertools.islice(posts, batch_size)):
+        yield batch
+
+
+def load_watermark(subreddit: str):
+    """
+    Returns {"subreddit", "created_utc", "id"} of the newest post that was
+    loaded into Redshift for the subreddit, or None if it never was
+    """
+    try:
+        with open(WATERMARK_FILE) as file:
+            watermarks = json.load(file)
+    except FileNotFoundError:
+        return None
+
+    return watermarks.get(subreddit)
+
+
+def save_watermark(watermark: dict):
+    try:
+        with open(WATERMARK_FILE) as file:
+            watermarks = json.load(file)
+    except FileNotFoundError:
+        watermarks = {}
+
+    watermarks[watermark["subreddit"]] = watermark
+
+    # Written to a temporary file and renamed so a failed write can't lose the
+    # watermarks of the other subreddits
+    temp_file = WATERMARK_FILE + ".tmp"
+    with open(temp_file, "w") as file:
+        json.dump(watermarks, file, indent=2)
+    os.replace(temp_file, WATERMARK_FILE)
+    print(
+        f'Watermark of "{watermark["subreddit"]}" moved to post {watermark["id"]} '
+        f"created at {watermark['created_utc']}."
+    )
+
+
+def get_new_watermark(subreddit: str, posts: list, watermark=None):
+    # Newest of the extracted posts, or the current watermark if none is newer
+    newest_post = max(posts, key=lambda post: post["created_utc"], default=None)
+    if newest_post is None or (
+        watermark is not None and newest_post["created_utc"] <= watermark["created_utc"]
+    ):
+        return watermark
+
+    return {
+        "subreddit": subreddit,
+        "created_utc": newest_post["created_utc"],
+        "id": newest_post["id"],
+    }
+
+
+def load_comment_counts(subreddit: str):
+    """
+    Returns {post id: number of comments} of the posts of the subreddit whose
+    comments were loaded into Redshift, empty if there are none
+    """
+    try:
+        with open(COMMENT_COUNTS_FILE) as file:
+            comment_counts = json.load(file)
+    except FileNotFoundError:
+        return {}
+
+    return comment_counts.get(subreddit, {})
+
+
+def save_comment_counts(subreddit: str, post_comment_counts: dict):
+    # Adds the number of comments of the posts whose comments were loaded,
+    # written like the watermarks
+    try:
+        with open(COMMENT_COUNTS_FILE) as file:
+            comment_counts = json.load(file)
+    except FileNotFoundError:
+        comment_counts = {}
+
+    comment_counts.setdefault(subreddit, {}).update(post_comment_counts)
+
+    temp_file = COMMENT_COUNTS_FILE + ".tmp"
+    with open(temp_file, "w") as file:
+        json.dump(comment_counts, file)
+    os.replace(temp_file, COMMENT_COUNTS_FILE)
+    print(
+        f'Number of comments of {len(post_comment_counts)} posts of "{subreddit}" '
+        "saved."
     )
-    post_dataframe["over_18"] = np.where(
-        (post_dataframe["over_18"] == False), True, False
+
+
+def get_changed_comment_counts(posts: list, comment_counts: dict):
+    # {post id: number of comments} of the posts whose number of comments
+    # isn't the one of comment_counts, the posts whose comments changed since
+    # they were loaded. New posts without comments are left out
+    return {
+        post["id"]: post["num_comments"]
+        for post in posts
+        if post["num_comments"] != comment_counts.get(post["id"], 0)
+    }
+
+
+def load_post_snapshots(subreddit: str):
+    """
+    Returns {post id: [score, num_comments, upvote_ratio, snapshot_ts]}, the
+    last snapshot of the posts of the subreddit loaded into Redshift, empty if
+    there are none
+    """
+    try:
+        with open(POST_SNAPSHOTS_FILE) as file:
+            post_snapshots = json.load(file)
+    except FileNotFoundError:
+        return {}
+
+    return post_snapshots.get(subreddit, {})
+
+
+def save_post_snapshots(subreddit: str, new_post_snapshots: dict):
+    # Adds the last snapshots of the posts loaded, written like the
+    # watermarks. The snapshots older than POST_SNAPSHOT_RETENTION_DAYS are
+    # dropped so the file doesn't keep growing
+    try:
+        with open(POST_SNAPSHOTS_FILE) as file:
+            post_snapshots = json.load(file)
+    except FileNotFoundError:
+        post_snapshots = {}
+
+    subreddit_snapshots = post_snapshots.setdefault(subreddit, {})
+    subreddit_snapshots.update(new_post_snapshots)
+    oldest_utc = time.time() - POST_SNAPSHOT_RETENTION_DAYS * 24 * 60 * 60
+    post_snapshots[subreddit] = {
+        post_id: snapshot
+        for post_id, snapshot in subreddit_snapshots.items()
+        if snapshot[-1] >= oldest_utc
+    }
+
+    temp_file = POST_SNAPSHOTS_FILE + ".tmp"
+    with open(temp_file, "w") as file:
+        json.dump(post_snapshots, file)
+    os.replace(temp_file, POST_SNAPSHOTS_FILE)
+    print(f'Last snapshot of {len(new_post_snapshots)} posts of "{subreddit}" saved.')
+
+
+def get_post_changes(posts: list, post_snapshots: dict, snapshot_utc: float):
+    """
+    Compares the extracted posts to post_snapshots, the last snapshots of
+    load_post_snapshots(). Returns the posts that were never loaded, the
+    snapshot rows (POST_SNAPSHOT_SCHEMA) of the posts whose score, number of
+    comments or upvote ratio changed, new posts included, and their new last
+    snapshots
+
+    A post without a snapshot, because its snapshot was dropped after
+    POST_SNAPSHOT_RETENTION_DAYS or the file was lost, is returned as new
+    again. It isn't duplicated: copy_to_redshift_db() skips the posts already
+    in forum_posts_data, by id. Only a snapshot row of its current metrics is
+    added
+    """
+    new_posts = []
+    snapshot_rows = []
+    new_post_snapshots = {}
+
+    for post in posts:
+        metrics = [post[field] for field in POST_METRIC_FIELDS]
+        last_snapshot = post_snapshots.get(post["id"])
+        if last_snapshot is None:
+            new_posts.append(post)
+        elif last_snapshot[:-1] == metrics:
+            continue
+        snapshot_rows.append(
+            {"id": post["id"], "snapshot_ts": snapshot_utc}
+            | dict(zip(POST_METRIC_FIELDS, metrics))
+        )
+        new_post_snapshots[post["id"]] = metrics + [snapshot_utc]
+
+    return new_posts, snapshot_rows, new_post_snapshots
+
+
+# Clean data
+def transform_data(posts: list, schema=POST_SCHEMA) -> pd.DataFrame:
+    """
+    Builds the DataFrame of the extracted posts, or comments with
+    COMMENT_SCHEMA and snapshots with POST_SNAPSHOT_SCHEMA, with the dtypes
+    of the schema. Every column Arrow can convert by itself is read from the
+    posts in one pass, done in C++ by converting them to a struct array, and
+    the DataFrame is built on top of the arrays without copying them. Raises
+    ValueError if a column that isn't nullable has null values
+    """
+    arrow_types = {
+        column: pd.api.types.pandas_dtype(dtype).pyarrow_dtype
+        for column, dtype, _, _ in schema
+    }
+    # created_utc and snapshot_ts are seconds since the epoch as a float and
+    # edited is False or the time the post was edited. author and subreddit
+    # are praw objects (None if the account was deleted), converted to str
+    # in Python
+    struct_type = pa.struct(
+        [
+            (column, pa.float64())
+            if pa.types.is_timestamp(arrow_type) or column == "edited"
+            else (column, arrow_type)
+            for column, arrow_type in arrow_types.items()
+            if column not in ("author", "subreddit")
+        ]
     )
-    # Ruff said to do it this way but it doesn't work:
-    # post_dataframe["over_18"] = np.where(not post_dataframe["over_18"])
-    post_dataframe["author"] = post_dataframe["author"].astype(str)
-    edited_mode = post_dataframe["edited"].mode()
-    # If edited_mode is True/False convert to boolean
-    post_dataframe["edited"] = np.where(
-        post_dataframe["edited"].isin([True, False]),
-        post_dataframe["edited"],
-        edited_mode,
-    ).astype(bool)
-    post_dataframe["num_comments"] = post_dataframe["num_comments"].astype(int)
-    post_dataframe["score"] = post_dataframe["score"].astype(int)
-    post_dataframe["upvote_ratio"] = post_dataframe["upvote_ratio"].astype(int)
-    post_dataframe["selftext"] = post_dataframe["selftext"].astype(str)
-    post_dataframe["title"] = post_dataframe["title"].astype(str)
-
-    return post_dataframe
+    post_array = pa.array(posts, struct_type)
+    columns = {}
+
+    for column, _, nullable, _ in schema:
+        arrow_type = arrow_types[column]
+
+        if column in ("author", "subreddit"):
+            array = pa.array(
+                [
+                    str(post[column]) if post[column] is not None else None
+                    for post in posts
+                ],
+                arrow_type,
+            )
+        elif pa.types.is_timestamp(arrow_type):
+            array = (
+                post_array.field(column).cast(pa.int64(), safe=False).cast(arrow_type)
+            )
+        elif column == "edited":
+            array = pc.not_equal(post_array.field(column), 0)
+        else:
+            array = post_array.field(column)
+
+        if not nullable and array.null_count:
+            raise ValueError(f'"{column}" has {array.null_count} null values.')
+        columns[column] = pd.arrays.ArrowExtensionArray(array)
+
+    return pd.DataFrame(columns, copy=False)
 
 
 def load_data_to_csv(data: pd.DataFrame, path: str):
-    data.to_csv(path, index=False)
+    # Arrow's CSV writer formats the Arrow-backed columns in C++ instead of
+    # value by value like DataFrame.to_csv(). Strings are quoted, nulls are
+    # left empty and booleans are written as true/false
+    pa_csv.write_csv(pa.Table.from_pandas(data, preserve_index=False), path)
 
 
 def load_data_to_parquet(data: pd.DataFrame, path: str):
     data.to_parquet(path, engine="pyarrow", compression="snappy")
+
+
+class PostFileWriter:
+    """
+    Appends batches of posts to the .CSV and the Parquet file in one pass.
+    Each DataFrame is converted to an Arrow record batch once and written to
+    both files, which are opened with the schema of the first batch, so only
+    one batch is in memory at a time. Every batch is a row group of the
+    Parquet file
+
+    partition_columns are left out of the Parquet file when it is the file of
+    a partition directory (subreddit=<name>/) that already gives their value
+
+    csv_path can also be a file object, e.g. a stream to S3, or a function
+    that opens one, called on the first batch so no empty file is left when
+    there are no rows, and parquet_path None to only write the .CSV
+    """
+
+    def __init__(self, csv_path, parquet_path, partition_columns=()):
+        self.csv_path = csv_path
+        self.parquet_path = parquet_path
+        self.partition_columns = list(partition_columns)
+        self.csv_writer = None
+        self.parquet_writer = None
+        self.row_count = 0
+
+    def write(self, data: pd.DataFrame):
+        record_batch = pa.RecordBatch.from_pandas(data, preserve_index=False)
+        parquet_batch = record_batch
+        if self.partition_columns:
+            parquet_batch = record_batch.drop_columns(self.partition_columns)
+
+        if self.csv_writer is None:
+            csv_file = self.csv_path() if callable(self.csv_path) else self.csv_path
+            self.csv_writer = pa_csv.CSVWriter(csv_file, record_batch.schema)
+            if self.parquet_path is not None:
+                os.makedirs(os.path.dirname(self.parquet_path), exist_ok=True)
+                self.parquet_writer = pq.ParquetWriter(
+                    self.parquet_path, parquet_batch.schema, compression="snappy"
+                )
+
+        self.csv_writer.write_batch(record_batch)
+        if self.parquet_writer is not None:
+            self.parquet_writer.write_batch(parquet_batch)
+        self.row_count += record_batch.num_rows
+
+    def close(self):
+        if self.csv_writer is not None:
+            self.csv_writer.close()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+# Arrow types of the Parquet files loaded into Redshift, for the Redshift types
+# of POST_SCHEMA and COMMENT_SCHEMA. COPY ... FORMAT AS PARQUET doesn't convert
+# between types, an int64 can't be loaded into an integer column or a double
+# into a real one
+REDSHIFT_ARROW_TYPES = {
+    "integer": pa.int32(),
+    "real": pa.float32(),
+    "boolean": pa.bool_(),
+    "timestamp": pa.timestamp("ms"),
+}
+
+
+def get_redshift_arrow_schema(schema: tuple):
+    # Arrow schema of the Parquet files loaded into the table created from the
+    # schema, in the order of its columns
+    fields = []
+    for column, _, nullable, redshift_type in schema:
+        if redshift_type.startswith("varchar"):
+            arrow_type = pa.string()
+        else:
+            arrow_type = REDSHIFT_ARROW_TYPES[redshift_type]
+        fields.append(pa.field(column, arrow_type, nullable=nullable))
+
+    return pa.schema(fields)
+
+
+def truncate_to_bytes(array: pa.Array, max_bytes: int):
+    # Cuts the strings longer than max_bytes in UTF-8 at the last whole
+    # character. Returns the array and the number of strings cut
+    truncated_count = pc.sum(pc.greater(pc.binary_length(array), max_bytes)).as_py()
+    if not truncated_count:
+        return array, 0
+
+    values = array.to_pylist()
+    for index, value in enumerate(values):
+        if value is not None and len(value.encode("utf-8")) > max_bytes:
+            values[index] = value.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+    return pa.array(values, array.type), truncated_count
+
+
+class RedshiftPartWriter:
+    """
+    Writes the posts to part_count Parquet files, <path_prefix>_part<N>.parquet,
+    loaded into Redshift by one COPY ... FORMAT AS PARQUET of a manifest. Each
+    batch is split evenly across the parts so every slice of the cluster loads
+    a file of about the same size. part_count should be the number of slices
+    of the cluster, or a multiple of it
+
+    The columns are cast to the Redshift type of the schema. COPY of Parquet
+    can't truncate columns, so the strings longer than their VARCHAR are cut
+    here, and counted in truncated_count, instead of failing the load
+
+    With a filesystem, e.g. s3fs, the files are written to it instead of the
+    local disk, path_prefix being a path of the filesystem
+    """
+
+    def __init__(
+        self, path_prefix: str, part_count: int, schema=POST_SCHEMA, filesystem=None
+    ):
+        self.paths = [
+            f"{path_prefix}_part{index:02d}.parquet" for index in range(part_count)
+        ]
+        self.arrow_schema = get_redshift_arrow_schema(schema)
+        # Length in bytes of the VARCHAR columns
+        self.varchar_lengths = {
+            column: int(redshift_type[len("varchar(") : -1])
+            for column, _, _, redshift_type in schema
+            if redshift_type.startswith("varchar")
+        }
+        self.filesystem = filesystem
+        self.parquet_writers = [None] * part_count
+        self.row_count = 0
+        self.batch_count = 0
+        self.truncated_count = 0
+
+    def write(self, data: pd.DataFrame):
+        record_batch = pa.RecordBatch.from_pandas(data, preserve_index=False)
+        arrays = []
+        for field in self.arrow_schema:
+            array = record_batch.column(field.name).cast(field.type)
+            if field.name in self.varchar_lengths:
+                array, truncated_count = truncate_to_bytes(
+                    array, self.varchar_lengths[field.name]
+                )
+                self.truncated_count += truncated_count
+            arrays.append(array)
+        record_batch = pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema)
+
+        # Every batch starts at the next part, so the parts left without rows
+        # by a small batch get the first rows of the next one
+        part_size = -(-record_batch.num_rows // len(self.paths))
+        for slice_index in range(len(self.paths)):
+            part_batch = record_batch.slice(slice_index * part_size, part_size)
+            if not part_batch.num_rows:
+                break
+            index = (self.batch_count + slice_index) % len(self.paths)
+            if self.parquet_writers[index] is None:
+                if self.filesystem is None:
+                    os.makedirs(os.path.dirname(self.paths[index]), exist_ok=True)
+                self.parquet_writers[index] = pq.ParquetWriter(
+                    self.paths[index],
+                    self.arrow_schema,
+                    compression="snappy",
+                    filesystem=self.filesystem,
+                )
+            self.parquet_writers[index].write_batch(part_batch)
+
+        self.row_count += record_batch.num_rows
+        self.batch_count += 1
+
+    def close(self):
+        for parquet_writer in self.parquet_writers:
+            if parquet_writer is not None:
+                parquet_writer.close()
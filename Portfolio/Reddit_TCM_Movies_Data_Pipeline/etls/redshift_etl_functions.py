@@ -1,5 +1,8 @@
+import time
+
 import redshift_connector
 
+from etls.redshift_schema_functions import TABLES, ensure_table
 from utils.constants import (
     REDSHIFT_DB_NAME,
     REDSHIFT_HOSTNAME,
@@ -29,40 +32,115 @@ def copy_to_redshift_db(
     redshift_conn: redshift_connector.connect,
     bucket: str,
     s3_file_name: str,
+    load_format="csv",
+    compression=None,
+    metrics=None,
+    table_name="forum_posts_data",
 ):
+    """
+    Copies the posts of s3_file_name into forum_posts_data, or the rows of
+    another table of TABLES (forum_post_snapshots, forum_comments_data). With
+    the "csv" load_format it is a .CSV or a prefix of .CSVs, with "parquet"
+    the manifest of the Parquet files written by RedshiftPartWriter. Parquet is
+    loaded by every slice of the cluster in parallel, a file each, with the
+    types of the columns of the files instead of parsing text. compression
+    is the one the .CSVs were uploaded with, "gzip" or "zstd"
+
+    A .CSV s3_file_name ending in .manifest is a manifest of .CSVs. Returns
+    the number of rows inserted into the table
+
+    The table is created, or rebuilt if it was created by an older version
+    of its definition, by ensure_table()
+
+    The COPY and the merge into the table are timed in metrics (a
+    PipelineMetrics), if set, with the posts copied and the statements run
+    """
     # Enable autocommit to commit changes to database
     redshift_conn.autocommit = True
     # Create a Cursor object
     cursor = redshift_conn.cursor()
 
+    merge_key = TABLES[table_name]["merge_key"]
+    immutable = TABLES[table_name]["immutable"]
+    staging_table_name = table_name + "_staging"
     query = bucket + "/raw/" + s3_file_name
 
-    # Check if forum_posts_data table exists and if not create it
-    try:
-        cursor.execute("select * from forum_posts_data limit 1")
-        print('"forum_posts_data" table is already in Redshift database.')
-    except redshift_connector.Error as e:
-        print(e)
-        cursor.execute(
-            "create table forum_posts_data(id text not null, title text not null, selftext text, score integer, num_comments integer, author varchar(25) not null, created_utc text not null, url text not null, upvote_ratio integer, over_18 varchar(5), edited varchar(5),spoiler varchar(5), stickied varchar(5))"
-        )
-        print('"forum_posts_data" table has been created in Redshift database.')
+    # Check if the table exists and is up to date and if not create or
+    # rebuild it. Statements sent to Redshift, a round trip each
+    api_calls = ensure_table(redshift_conn, table_name)
 
-    # Copy the .CSV to the forum_posts_data table. TRUNCATECOLUMNS is used as
-    # Redshift doesn't have an unlimited text field so the selftext field can't
-    # be fully stored
+    # The .CSV is copied to a staging table and merged into the table by its
+    # merge key: rows that were extracted again (the comments of a post
+    # extracted again, or a post whose last snapshot was lost) replace their
+    # old rows, or are dropped for an immutable table, instead of adding
+    # duplicates. Done in one transaction so a failed copy leaves the table as
+    # it was
+    redshift_conn.autocommit = False
+    copy_start_time = time.perf_counter()
+    cursor.execute(f"create temp table {staging_table_name} (like {table_name})")
+    if load_format == "parquet":
+        # The strings too long for their column were already cut, and counted,
+        # when the files were written, COPY of Parquet can't truncate columns
+        copy_format = "format as parquet manifest"
+    else:
+        # TRUNCATECOLUMNS is used as Redshift doesn't have an unlimited text
+        # field so the selftext field can't be fully stored
+        copy_format = "csv ignoreheader 1 truncatecolumns"
+        if compression is not None:
+            copy_format += " " + compression
+        if s3_file_name.endswith(".manifest"):
+            copy_format += " manifest"
     cursor.execute(
-        "copy forum_posts_data from "
+        f"copy {staging_table_name} from "
         + "'s3://"
         + query
         + "' credentials "
         + "'aws_iam_role="
         + REDSHIFT_IAM_ROLE
-        + "' csv ignoreheader 1 truncatecolumns"
+        + "' "
+        + copy_format
+    )
+    merge_start_time = time.perf_counter()
+    # Rows deleted from the staging table for an immutable table, from the
+    # table otherwise
+    if immutable:
+        delete_table_name, using_table_name = staging_table_name, table_name
+    else:
+        delete_table_name, using_table_name = table_name, staging_table_name
+    merge_condition = " and ".join(
+        f"{delete_table_name}.{column} = {using_table_name}.{column}"
+        for column in merge_key
     )
-    print(".CSV file has been copied to Redshift database.")
+    cursor.execute(
+        f"delete from {delete_table_name} using {using_table_name} "
+        f"where {merge_condition}"
+    )
+    updated_count = cursor.rowcount
+    if immutable:
+        print(f"{updated_count} rows already in {table_name} skipped.")
+    else:
+        print(f"{updated_count} rows already in {table_name} replaced.")
+    cursor.execute(f"insert into {table_name} select * from {staging_table_name}")
+    copied_count = cursor.rowcount
+    cursor.execute(f"drop table {staging_table_name}")
+    redshift_conn.commit()
+    redshift_conn.autocommit = True
+    print(
+        f"{copied_count} rows of {s3_file_name} have been copied to "
+        f'"{table_name}" in Redshift database.'
+    )
+
+    if metrics is not None:
+        # create temp table, copy, delete, insert, drop and commit
+        api_calls += 6
+        metrics.add(
+            "copy",
+            merge_start_time - copy_start_time,
+            rows=copied_count,
+            api_calls=api_calls,
+        )
+        metrics.add(
+            "merge", time.perf_counter() - merge_start_time, updated=updated_count
+        )
 
-    # Query the forum_posts_data table and retrieve the result to print to logs
-    cursor.execute("select * from forum_posts_data limit 5")
-    result: tuple = cursor.fetchall()
-    print(result)
+    return copied_count
@@ -0,0 +1,318 @@
+from datetime import datetime, timezone
+
+import redshift_connector
+
+from utils.constants import COMMENT_SCHEMA, POST_SCHEMA, POST_SNAPSHOT_SCHEMA
+
+"""
+Definitions of the tables loaded by copy_to_redshift_db():
+
+- schema: the columns, their Redshift type and nullability
+- merge_key: the rows copied replace the rows of the table with the same
+  merge key columns: the comments of a post extracted again replace all its
+  comments, so the deleted ones are removed too
+- immutable: the rows are written once, the rows copied whose merge key is
+  already in the table are dropped instead. forum_posts_data is the post
+  dimension, the metrics that change are appended to forum_post_snapshots
+- sort_key: columns of the compound sort key, the time the queries filter on.
+  Redshift keeps the min and max of every block of the column, so a query
+  on a range of dates only reads the blocks of the range
+- dist_key: column the rows are distributed by once the table has more than
+  DIST_ALL_MAX_ROWS rows, before that the table is copied to every node
+  (DISTSTYLE ALL). The three tables are distributed by post id, so the posts
+  are joined to their snapshots and comments on each node
+- version: version of the definition, a table created by an older version is
+  rebuilt by migrate_table()
+"""
+TABLES = {
+    "forum_posts_data": {
+        "schema": POST_SCHEMA,
+        "merge_key": ("id",),
+        "immutable": True,
+        "sort_key": ("created_utc",),
+        "dist_key": "id",
+        # 1: created by the first version of the pipeline, 2: typed like
+        # POST_SCHEMA, 3: with sort key, dist style and encodings
+        "version": 3,
+    },
+    "forum_post_snapshots": {
+        "schema": POST_SNAPSHOT_SCHEMA,
+        "merge_key": ("id", "snapshot_ts"),
+        "immutable": True,
+        "sort_key": ("snapshot_ts",),
+        "dist_key": "id",
+        "version": 2,
+    },
+    "forum_comments_data": {
+        "schema": COMMENT_SCHEMA,
+        "merge_key": ("submission_id",),
+        "immutable": False,
+        "sort_key": ("created_utc",),
+        "dist_key": "submission_id",
+        "version": 2,
+    },
+}
+
+"""
+Column expressions of the tables rebuilt from an older version, by table and
+version, from the columns of the old table. The other columns are copied as
+they are, a column the old table doesn't have is null
+
+Version 1 of forum_posts_data has created_utc as text, the booleans as
+'True'/'False' strings with over_18 inverted, deleted authors as 'None' and
+no subreddit column until it was added by hand. Its posts were all extracted
+from r/TurnerClassicMovies
+"""
+MIGRATIONS = {
+    "forum_posts_data": {
+        1: {
+            "created_utc": "cast(created_utc as timestamp)",
+            "author": "nullif(author, 'None')",
+            "over_18": "over_18 = 'False'",
+            "edited": "edited = 'True'",
+            "spoiler": "spoiler = 'True'",
+            "stickied": "stickied = 'True'",
+            "subreddit": "coalesce(subreddit, 'TurnerClassicMovies')",
+        },
+    },
+}
+
+# Version of the definition of every table, recorded when it is created or
+# rebuilt
+SCHEMA_VERSIONS_TABLE = "schema_versions"
+# Tables up to this many rows are copied to every node, see TABLES
+DIST_ALL_MAX_ROWS = 1_000_000
+# Percent of the rows of a table that are unsorted, or by which its
+# statistics are out of date, before maintain_table() vacuums or analyzes it.
+# The thresholds of Redshift's own VACUUM (95 percent sorted) and ANALYZE
+VACUUM_UNSORTED_PERCENT = 5
+ANALYZE_STATS_OFF_PERCENT = 10
+# Compression of the columns by Redshift type, AZ64 for the numbers and
+# times it supports and ZSTD for the others. The first column of the sort key
+# is left uncompressed (RAW): compressed much more than the other columns,
+# each of its blocks would span many blocks of theirs and a query on a range
+# of dates would read more of them
+AZ64_TYPES = ("smallint", "integer", "bigint", "date", "timestamp")
+
+
+def get_column_encoding(redshift_type: str, sort_key=False):
+    if sort_key:
+        return "raw"
+    if redshift_type in AZ64_TYPES:
+        return "az64"
+    return "zstd"
+
+
+def get_create_table_query(table_name: str, row_count=0, new_table_name=None):
+    """
+    CREATE TABLE of the table's definition, named new_table_name if set:
+    the Redshift type, encoding and nullability of every column, the dist
+    style of a table of row_count rows and the sort key
+    """
+    definition = TABLES[table_name]
+    columns = ", ".join(
+        f"{column} {redshift_type} encode "
+        + get_column_encoding(redshift_type, column == definition["sort_key"][0])
+        + ("" if nullable else " not null")
+        for column, _, nullable, redshift_type in definition["schema"]
+    )
+    if row_count > DIST_ALL_MAX_ROWS:
+        dist_style = f"diststyle key distkey({definition['dist_key']})"
+    else:
+        dist_style = "diststyle all"
+
+    return (
+        f"create table {new_table_name or table_name}({columns}) {dist_style} "
+        f"compound sortkey({', '.join(definition['sort_key'])})"
+    )
+
+
+def table_exists(cursor, table_name: str):
+    # Looked up in the catalog instead of querying the table and catching the
+    # error, which would abort the transaction it runs in
+    cursor.execute(
+        "select 1 from information_schema.tables "
+        "where table_schema = current_schema() and table_name = %s",
+        (table_name,),
+    )
+    return cursor.fetchone() is not None
+
+
+def get_column_types(cursor, table_name: str):
+    # {column: type} of the table from the catalog
+    cursor.execute(
+        "select column_name, data_type from information_schema.columns "
+        "where table_schema = current_schema() and table_name = %s",
+        (table_name,),
+    )
+    return dict(cursor.fetchall())
+
+
+def get_table_version(cursor, table_name: str):
+    """
+    Version of the definition the table was created with. A table created
+    before the versions were recorded is at the version before the current
+    one, or at version 1 for a forum_posts_data whose created_utc isn't a
+    timestamp yet
+    """
+    cursor.execute(
+        f"select max(version) from {SCHEMA_VERSIONS_TABLE} where table_name = %s",
+        (table_name,),
+    )
+    version = cursor.fetchone()[0]
+    if version is not None:
+        return version
+
+    column_types = get_column_types(cursor, table_name)
+    if table_name == "forum_posts_data" and not column_types.get(
+        "created_utc", ""
+    ).startswith("timestamp"):
+        return 1
+    return TABLES[table_name]["version"] - 1
+
+
+def record_table_version(cursor, table_name: str):
+    cursor.execute(
+        f"insert into {SCHEMA_VERSIONS_TABLE} values (%s, %s, %s)",
+        (
+            table_name,
+            TABLES[table_name]["version"],
+            datetime.now(timezone.utc).replace(tzinfo=None),
+        ),
+    )
+
+
+def ensure_table(redshift_conn: redshift_connector.connect, table_name: str):
+    """
+    Creates the table from its definition if it isn't in the database, or
+    rebuilds it with migrate_table() if it was created by an older version
+    of the definition. Returns the number of statements sent to Redshift
+    """
+    cursor = redshift_conn.cursor()
+    redshift_conn.autocommit = True
+    cursor.execute(
+        f"create table if not exists {SCHEMA_VERSIONS_TABLE}("
+        "table_name varchar(127) not null, version integer not null, "
+        "migrated_at timestamp not null)"
+    )
+
+    if not table_exists(cursor, table_name):
+        cursor.execute(get_create_table_query(table_name))
+        record_table_version(cursor, table_name)
+        print(f'"{table_name}" table has been created in Redshift database.')
+        return 4
+
+    version = get_table_version(cursor, table_name)
+    if version < TABLES[table_name]["version"]:
+        return 3 + migrate_table(redshift_conn, table_name, version)
+
+    print(f'"{table_name}" table is already in Redshift database.')
+    return 3
+
+
+def migrate_table(redshift_conn: redshift_connector.connect, table_name, version):
+    """
+    Rebuilds the table created by the version of its definition: a new table
+    is created from the current definition, with the dist style of its number
+    of rows, filled with the MIGRATIONS expressions of the version and renamed
+    to the table. Done in one transaction, so a failed migration leaves the
+    table as it was. Returns the number of statements sent to Redshift
+
+    An immutable table keeps one row by merge key, the first by sort key: the
+    first version of the pipeline appended the posts it extracted again
+    """
+    definition = TABLES[table_name]
+    migration = MIGRATIONS.get(table_name, {}).get(version, {})
+    migrated_table_name = f"{table_name}_migrated"
+    cursor = redshift_conn.cursor()
+
+    column_types = get_column_types(cursor, table_name)
+    cursor.execute(f"select count(*) from {table_name}")
+    row_count = cursor.fetchone()[0]
+    # The columns the old table doesn't have, as nulls
+    missing_columns = "".join(
+        f", cast(null as {redshift_type}) as {column}"
+        for column, _, _, redshift_type in definition["schema"]
+        if column not in column_types
+    )
+    expressions = ", ".join(
+        f"{migration.get(column, column)} as {column}"
+        for column, _, _, _ in definition["schema"]
+    )
+    old_rows = f"(select *{missing_columns} from {table_name}) as old_rows"
+    if definition["immutable"]:
+        columns = ", ".join(column for column, _, _, _ in definition["schema"])
+        sort_key = ", ".join(
+            migration.get(column, column) for column in definition["sort_key"]
+        )
+        select_query = (
+            f"select {columns} from (select {expressions}, row_number() over "
+            f"(partition by {', '.join(definition['merge_key'])} "
+            f"order by {sort_key}) as merge_key_row from {old_rows}) "
+            "as migrated_rows where merge_key_row = 1"
+        )
+    else:
+        select_query = f"select {expressions} from {old_rows}"
+
+    redshift_conn.autocommit = False
+    cursor.execute(
+        get_create_table_query(
+            table_name, row_count, new_table_name=migrated_table_name
+        )
+    )
+    cursor.execute(f"insert into {migrated_table_name} {select_query}")
+    migrated_count = cursor.rowcount
+    cursor.execute(f"drop table {table_name}")
+    cursor.execute(f"alter table {migrated_table_name} rename to {table_name}")
+    record_table_version(cursor, table_name)
+    redshift_conn.commit()
+    redshift_conn.autocommit = True
+    print(
+        f'"{table_name}" table has been rebuilt from version {version} to '
+        f"{definition['version']} of its definition, {migrated_count} of its "
+        f"{row_count} rows kept."
+    )
+
+    # get_column_types, count, create, insert, drop, rename, insert, commit
+    return 8
+
+
+def maintain_table(redshift_conn: redshift_connector.connect, table_name: str):
+    """
+    Upkeep of the table after a load, from its row of svv_table_info: it is
+    distributed by its dist key once it has more than DIST_ALL_MAX_ROWS rows,
+    analyzed when its statistics are more than ANALYZE_STATS_OFF_PERCENT out
+    of date and vacuumed (deleted rows reclaimed and rows sorted) when more
+    than VACUUM_UNSORTED_PERCENT of its rows are unsorted. Redshift runs
+    them on its own too, but only when the cluster isn't busy. Returns the
+    number of statements sent to Redshift
+    """
+    # VACUUM can't run in a transaction
+    redshift_conn.autocommit = True
+    cursor = redshift_conn.cursor()
+    cursor.execute(
+        "select diststyle, tbl_rows, unsorted, stats_off from svv_table_info "
+        'where "table" = %s',
+        (table_name,),
+    )
+    table_info = cursor.fetchone()
+    # Empty tables aren't in svv_table_info
+    if table_info is None:
+        return 1
+    dist_style, row_count, unsorted, stats_off = table_info
+
+    statements = []
+    if dist_style == "ALL" and row_count > DIST_ALL_MAX_ROWS:
+        statements.append(
+            f"alter table {table_name} alter diststyle key "
+            f"distkey {TABLES[table_name]['dist_key']}"
+        )
+    if stats_off is None or stats_off > ANALYZE_STATS_OFF_PERCENT:
+        statements.append(f"analyze {table_name}")
+    if unsorted is not None and unsorted > VACUUM_UNSORTED_PERCENT:
+        statements.append(f"vacuum {table_name}")
+
+    for statement in statements:
+        cursor.execute(statement)
+        print(f"{statement}: done.")
+    return 1 + len(statements)
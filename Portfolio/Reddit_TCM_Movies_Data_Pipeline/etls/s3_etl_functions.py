@@ -1,7 +1,38 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import s3fs
 
 from utils.constants import AWS_ACCESS_KEY_ID, AWS_REGION, AWS_SECRET_ACCESS_KEY
 
+try:
+    import zstandard
+except ImportError:
+    # Only needed for the zstd compression
+    zstandard = None
+
+# Suffix of the compressed .CSVs, COPY reads both with its GZIP or ZSTD option
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# Level of the gzip compression. GzipFile's default of 9 takes about 7 times
+# longer than 6 for files about 7% smaller (benchmarks/bench_pipeline.py)
+GZIP_LEVEL = 6
+
+# Size of the parts of the multipart uploads, S3 needs at least 5 MB, parts
+# uploaded at a time for each file and files uploaded at a time
+S3_MIN_PART_SIZE = 5 * 2**20
+S3_PART_SIZE = 16 * 2**20
+S3_MAX_CONCURRENCY = 8
+S3_BATCH_SIZE = 8
+# Keys returned by a ListObjectsV2 request and removed by a DeleteObjects one
+S3_LIST_PAGE_SIZE = 1000
+S3_DELETE_BATCH_SIZE = 1000
+
 
 # Connect to S3
 def connect_to_s3():
@@ -29,11 +60,262 @@ def create_bucket_if_not_exist(s3: s3fs.S3FileSystem, bucket: str):
         print(e)
 
 
-# Try to upload the .CSV file
-def upload_to_s3(s3: s3fs.S3FileSystem, file_path: str, bucket: str, s3_file_name: str):
+# Try to upload the .CSV file, or the files of a directory
+def upload_to_s3(
+    s3: s3fs.S3FileSystem,
+    file_path: str,
+    bucket: str,
+    s3_file_name: str,
+    compression=None,
+    part_size=S3_PART_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    batch_size=S3_BATCH_SIZE,
+    metrics=None,
+):
+    """
+    Uploads the file as "bucket + '/raw/' + s3_file_name", or every file of
+    the directory under the "bucket + '/raw/' + s3_file_name + '/'" prefix
+
+    The .CSVs are compressed first with compression ("gzip" or "zstd", both
+    read by COPY) if set. batch_size files are uploaded at a time, and the
+    files of over 2 * part_size bytes in parts of part_size bytes,
+    max_concurrency parts at a time
+
+    The files whose ETag is already the one of an object of the prefix are
+    skipped, and the objects of the prefix that aren't one of the files (left
+    by an earlier run) are deleted, so a re-run only uploads what changed.
+    The listing of the prefix also tells if the bucket has to be created
+
+    The compress and upload stages are timed in metrics (a PipelineMetrics),
+    if set, with the bytes uploaded and the requests to S3
+    """
+    if compression is not None and compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f'Unknown compression "{compression}".')
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd compression needs zstandard: pip install zstandard.")
+    if part_size < S3_MIN_PART_SIZE:
+        raise ValueError(f"part_size must be at least {S3_MIN_PART_SIZE} bytes.")
+
+    if os.path.isdir(file_path):
+        prefix = f"{bucket}/raw/{s3_file_name}/"
+        local_paths = [
+            os.path.join(file_path, file_name)
+            for file_name in sorted(os.listdir(file_path))
+        ]
+    elif os.path.exists(file_path):
+        prefix = f"{bucket}/raw/{s3_file_name}"
+        local_paths = [file_path]
+    else:
+        print("The .CSV file was not found.")
+        return
+
+    start_time = time.perf_counter()
+    # Requests to S3, counted as the calls are made
+    api_calls = 0
     try:
-        # "bucket +'/raw/' + s3_file_name" is the destination file
-        s3.put(file_path, bucket + "/raw/" + s3_file_name)
-        print(".CSV file has been uploaded to S3.")
+        if prefix.endswith("/"):
+            uploaded_objects = s3.find(prefix, detail=True)
+        else:
+            uploaded_objects = {prefix: s3.info(prefix)}
     except FileNotFoundError:
-        print("The .CSV file was not found.")
+        # A new file, or there is no bucket yet
+        uploaded_objects = {}
+        # HeadBucket, and CreateBucket
+        api_calls += 1
+        if not s3.exists(bucket):
+            s3.mkdir(bucket, region_name=AWS_REGION)
+            api_calls += 1
+            print('Bucket "' + bucket + '" created.')
+    # ListObjectsV2 of the prefix, or HeadObject of the file
+    api_calls += get_list_calls(len(uploaded_objects))
+
+    with tempfile.TemporaryDirectory(prefix="s3_upload_") as temp_dir:
+        compress_start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=batch_size) as executor:
+            upload_paths = list(
+                executor.map(
+                    lambda local_path: compress_file(local_path, temp_dir, compression),
+                    local_paths,
+                )
+            )
+        compress_seconds = time.perf_counter() - compress_start_time
+        s3_paths = [
+            prefix + os.path.basename(upload_path) if prefix.endswith("/") else prefix
+            for upload_path in upload_paths
+        ]
+        with ThreadPoolExecutor(max_workers=batch_size) as executor:
+            etags = list(
+                executor.map(
+                    lambda upload_path: get_etag(upload_path, part_size), upload_paths
+                )
+            )
+
+        changed_paths = [
+            (upload_path, s3_path)
+            for upload_path, s3_path, etag in zip(upload_paths, s3_paths, etags)
+            if uploaded_objects.get(s3_path, {}).get("ETag", "").strip('"') != etag
+        ]
+        uploaded_bytes = 0
+        for upload_path, _ in changed_paths:
+            file_size = os.path.getsize(upload_path)
+            uploaded_bytes += file_size
+            # Create, parts and complete of a multipart upload, or one PUT
+            api_calls += (
+                -(-file_size // part_size) + 2 if file_size >= 2 * part_size else 1
+            )
+        if changed_paths:
+            s3.put(
+                [upload_path for upload_path, _ in changed_paths],
+                [s3_path for _, s3_path in changed_paths],
+                batch_size=batch_size,
+                chunksize=part_size,
+                max_concurrency=max_concurrency,
+            )
+
+    stale_paths = sorted(set(uploaded_objects) - set(s3_paths))
+    if stale_paths:
+        s3.rm(stale_paths)
+        api_calls += get_delete_calls(len(stale_paths))
+
+    if metrics is not None:
+        if compression is not None:
+            metrics.add("compress", compress_seconds, files=len(local_paths))
+        metrics.add(
+            "upload",
+            time.perf_counter() - start_time - compress_seconds,
+            files=len(changed_paths),
+            bytes=uploaded_bytes,
+            api_calls=api_calls,
+        )
+
+    print(
+        f"{len(changed_paths)} files have been uploaded to S3, "
+        f"{len(s3_paths) - len(changed_paths)} were unchanged and "
+        f"{len(stale_paths)} old files were deleted."
+    )
+
+
+def get_list_calls(object_count: int):
+    # ListObjectsV2 requests of a listing, it returns up to 1000 keys at a time
+    return max(-(-object_count // S3_LIST_PAGE_SIZE), 1)
+
+
+def get_delete_calls(object_count: int):
+    # DeleteObjects requests of s3.rm(), it removes up to 1000 keys at a time
+    return -(-object_count // S3_DELETE_BATCH_SIZE)
+
+
+def compress_file(path: str, temp_dir: str, compression):
+    """
+    Compressed copy of the .CSV in temp_dir, or the path itself if there is no
+    compression or it isn't a .CSV (Parquet files are already compressed).
+    The output only depends on the contents so the ETag of an unchanged file
+    stays the same: gzip is written without the name and time of the file
+    """
+    if compression is None or not path.endswith(".csv"):
+        return path
+
+    compressed_path = os.path.join(
+        temp_dir, os.path.basename(path) + COMPRESSION_SUFFIXES[compression]
+    )
+    with open(path, "rb") as file, open(compressed_path, "wb") as compressed_file:
+        if compression == "gzip":
+            with gzip.GzipFile(
+                filename="",
+                mode="wb",
+                compresslevel=GZIP_LEVEL,
+                fileobj=compressed_file,
+                mtime=0,
+            ) as gzip_file:
+                shutil.copyfileobj(file, gzip_file, 2**20)
+        else:
+            zstandard.ZstdCompressor().copy_stream(file, compressed_file)
+
+    return compressed_path
+
+
+def get_etag(path: str, part_size: int):
+    """
+    ETag S3 gives the file once uploaded by s3.put(): the MD5 of the file, or
+    for a multipart upload the MD5 of the MD5s of its parts and the number of
+    parts. Objects encrypted with SSE-KMS have other ETags, they are always
+    uploaded again
+    """
+    with open(path, "rb") as file:
+        if os.path.getsize(path) < 2 * part_size:
+            return hashlib.md5(file.read()).hexdigest()
+        part_digests = [
+            hashlib.md5(part).digest()
+            for part in iter(lambda: file.read(part_size), b"")
+        ]
+
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def upload_manifest(
+    s3: s3fs.S3FileSystem, dir_path: str, bucket: str, s3_file_name: str
+):
+    """
+    Uploads the COPY manifest of the files of the directory uploaded by
+    upload_to_s3() as "bucket + '/raw/' + s3_file_name + '.manifest'". COPY
+    only loads the files listed, not the ones left under the prefix by an
+    earlier run. The manifest of Parquet files needs the size of every file
+    """
+    file_names = sorted(os.listdir(dir_path))
+    put_manifest(
+        s3,
+        f"{bucket}/raw/{s3_file_name}.manifest",
+        {
+            f"{bucket}/raw/{s3_file_name}/{file_name}": os.path.getsize(
+                os.path.join(dir_path, file_name)
+            )
+            for file_name in file_names
+        },
+    )
+
+
+def put_manifest(s3: s3fs.S3FileSystem, manifest_path: str, file_sizes: dict):
+    # Writes the COPY manifest of the S3 paths (bucket/key) of file_sizes
+    manifest = {
+        "entries": [
+            {
+                "url": f"s3://{s3_path}",
+                "mandatory": True,
+                "meta": {"content_length": file_size},
+            }
+            for s3_path, file_size in sorted(file_sizes.items())
+        ]
+    }
+    s3.pipe(manifest_path, json.dumps(manifest).encode())
+    print(f"Manifest of {len(file_sizes)} files has been uploaded to S3.")
+
+
+def open_s3_stream(
+    exit_stack,
+    s3: s3fs.S3FileSystem,
+    s3_path: str,
+    compression=None,
+    part_size=S3_PART_SIZE,
+):
+    """
+    Opens s3_path for writing without a local file: what is written is
+    compressed with compression, if set, and sent to S3 in a multipart upload
+    of parts of part_size bytes while it is written. The files are closed, and
+    the upload completed, by exit_stack (a contextlib.ExitStack)
+    """
+    s3_file = exit_stack.enter_context(s3.open(s3_path, "wb", block_size=part_size))
+    if compression == "gzip":
+        return exit_stack.enter_context(
+            gzip.GzipFile(
+                filename="",
+                mode="wb",
+                compresslevel=GZIP_LEVEL,
+                fileobj=s3_file,
+                mtime=0,
+            )
+        )
+    if compression == "zstd":
+        return exit_stack.enter_context(
+            zstandard.ZstdCompressor().stream_writer(s3_file, closefd=False)
+        )
+    return s3_file
@@ -1,25 +1,77 @@
+from etls.reddit_tcm_movies_etl import (
+    save_comment_counts,
+    save_post_snapshots,
+    save_watermark,
+)
 from etls.redshift_etl_functions import (
     connect_to_redshift,
     copy_to_redshift_db,
 )
+from etls.redshift_schema_functions import maintain_table
+from pipelines.reddit_tcm_movies_pipeline import (
+    get_load_tables,
+    pull_extraction_results,
+)
 from utils.constants import AWS_BUCKET_NAME
+from utils.metrics import PipelineMetrics
 
 
-def copy_to_redshift_pipeline(task_instance):
-    # From Browse -> XComs in Airflow UI
-    file_path = task_instance.xcom_pull(
-        task_ids="reddit_tcm_movies_extraction", key="return_value"
-    )
+def copy_to_redshift_pipeline(task_instance, compression=None, maintain_tables=False):
+    results = pull_extraction_results(task_instance)
+    metrics = PipelineMetrics("copy_to_redshift_db")
 
     # Retrieve Redshift connection object
     redshift_conn = connect_to_redshift()
     """
-    file_path is a tuple that contains the path to the .CSV and Parquet files
-    so [0] is used to specify only the .CSV file and .split gets the last part
-    of the file name
-     
-    Not using [0] will cause the Parquet file to be uploaded too for some
-    reason, even though .split is used
+    Each result is a tuple that contains the directories of the .CSV and
+    Parquet files, the new watermarks and the directory of the Parquet files
+    loaded into Redshift, None when the .CSV files are loaded, then the
+    tables to load with the same directories. COPY loads every .CSV under
+    the S3 prefix of the .CSV directory, the .CSV of every subreddit, or the
+    Parquet files listed in the manifest of the directory, into
+    forum_posts_data, forum_post_snapshots or forum_comments_data
     """
-    # Copy .CSV to Redshift cluster
-    copy_to_redshift_db(redshift_conn, AWS_BUCKET_NAME, file_path[0].split("/")[-1])
+    # Copy the .CSVs or Parquet files to Redshift cluster
+    load_tables = get_load_tables(results)
+    for table_name, csv_dir, redshift_dir in load_tables:
+        if redshift_dir is None:
+            # compression is the one the .CSVs were uploaded with
+            copy_to_redshift_db(
+                redshift_conn,
+                AWS_BUCKET_NAME,
+                csv_dir.split("/")[-1] + "/",
+                compression=compression,
+                metrics=metrics,
+                table_name=table_name,
+            )
+        else:
+            copy_to_redshift_db(
+                redshift_conn,
+                AWS_BUCKET_NAME,
+                redshift_dir.split("/")[-1] + ".manifest",
+                load_format="parquet",
+                metrics=metrics,
+                table_name=table_name,
+            )
+
+    # The watermarks, numbers of comments and last snapshots are only saved
+    # once the posts, snapshots and comments are in Redshift so the ones of a
+    # failed run are extracted again by the next one
+    for result in results:
+        for watermark in result[2]:
+            save_watermark(watermark)
+        for subreddit, comment_counts in result[5].items():
+            save_comment_counts(subreddit, comment_counts)
+        for subreddit, post_snapshots in result[6].items():
+            save_post_snapshots(subreddit, post_snapshots)
+
+    # With maintain_tables, the tables loaded are analyzed, vacuumed or
+    # redistributed if they need it, once the run is saved
+    if maintain_tables:
+        for table_name in sorted({load_table[0] for load_table in load_tables}):
+            with metrics.time("maintain"):
+                api_calls = maintain_table(redshift_conn, table_name)
+            metrics.add("maintain", api_calls=api_calls)
+
+    # Seconds and posts of the copies, to XCom and METRICS_FILE
+    metrics.export(task_instance)
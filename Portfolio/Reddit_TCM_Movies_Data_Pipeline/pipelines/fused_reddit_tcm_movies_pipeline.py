@@ -0,0 +1,432 @@
+import contextlib
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from etls.reddit_tcm_movies_etl import (
+    REPLACE_MORE_LIMIT,
+    PostFileWriter,
+    RateBudget,
+    RedshiftPartWriter,
+    connect_to_reddit,
+    extract_comments,
+    get_changed_comment_counts,
+    get_new_watermark,
+    get_post_changes,
+    iter_batches,
+    load_comment_counts,
+    load_post_snapshots,
+    save_comment_counts,
+    save_post_snapshots,
+    save_watermark,
+    transform_data,
+)
+from etls.redshift_etl_functions import connect_to_redshift, copy_to_redshift_db
+from etls.redshift_schema_functions import maintain_table
+from etls.s3_etl_functions import (
+    COMPRESSION_SUFFIXES,
+    S3_PART_SIZE,
+    connect_to_s3,
+    create_bucket_if_not_exist,
+    open_s3_stream,
+    put_manifest,
+)
+from pipelines.reddit_tcm_movies_pipeline import extract_subreddit_posts
+from utils.constants import (
+    AWS_BUCKET_NAME,
+    COMMENT_SCHEMA,
+    POST_SCHEMA,
+    POST_SNAPSHOT_SCHEMA,
+    REDDIT_CLIENT_ID,
+    REDDIT_REQUESTS_PER_MINUTE,
+    REDDIT_SECRET_KEY,
+)
+from utils.metrics import PipelineMetrics
+
+
+def fused_reddit_tcm_movies_pipeline(
+    s3_file_name: str,
+    subreddits: list,
+    listings=("top",),
+    time_filter="month",
+    limit=None,
+    incremental=False,
+    rescan_hours=48,
+    batch_size=1000,
+    requests_per_minute=REDDIT_REQUESTS_PER_MINUTE,
+    max_workers=8,
+    load_format="csv",
+    parquet_parts=4,
+    comments=False,
+    replace_more_limit=REPLACE_MORE_LIMIT,
+    comment_workers=4,
+    compression=None,
+    part_size=S3_PART_SIZE,
+    maintain_tables=False,
+    task_instance=None,
+):
+    """
+    Extraction, upload to S3 and copy to Redshift in one task, instead of the
+    three tasks of the DAG passing files through XCom. The transformed
+    batches of every subreddit are written straight to S3 objects under
+    "bucket + '/raw/' + s3_file_name + '/'" as they are extracted, in
+    multipart uploads of parts of part_size bytes, then copied to Redshift
+    from a manifest of the objects and the watermarks are saved. Nothing is
+    written to the local disk and Reddit, S3 and Redshift are connected to
+    once. Like the three tasks, only the posts that were never loaded are
+    copied to forum_posts_data, and the snapshots of the posts whose metrics
+    changed, streamed under "bucket + '/raw/' + s3_file_name + '_snapshots/'",
+    are appended to forum_post_snapshots
+
+    load_format is "csv" (compressed with compression if set) or "parquet",
+    parquet_parts typed Parquet files per subreddit like the three tasks.
+    With comments, the comments of the posts whose comments changed are
+    extracted like the three tasks do, streamed under
+    "bucket + '/raw/' + s3_file_name + '_comments/'" and copied to
+    forum_comments_data
+
+    With maintain_tables, the tables loaded are analyzed, vacuumed or
+    redistributed once the run is saved if they need it, see maintain_table()
+
+    Returns the metrics of the run, also pushed to XCom and appended to
+    METRICS_FILE: the seconds and rows of every stage, extract, transform,
+    load (to S3), copy and merge. The seconds of extract, transform and load
+    are summed over the subreddits, which are extracted at the same time
+    """
+    if load_format not in ("csv", "parquet"):
+        raise ValueError(f'Unknown load format "{load_format}".')
+    if isinstance(subreddits, str):
+        subreddits = [subreddits]
+    metrics = PipelineMetrics("reddit_tcm_movies_fused")
+
+    # Connect to Reddit, S3 and Redshift once for the whole run
+    rate_budget = RateBudget(requests_per_minute)
+    instance = connect_to_reddit(
+        REDDIT_CLIENT_ID, REDDIT_SECRET_KEY, "Scrape Agent", rate_budget
+    )
+    s3 = connect_to_s3()
+    create_bucket_if_not_exist(s3, AWS_BUCKET_NAME)
+    s3_prefix = f"{AWS_BUCKET_NAME}/raw/{s3_file_name}"
+    # Time of the snapshots of the run
+    snapshot_utc = time.time()
+
+    # The comment pool only starts threads once comments are extracted
+    with (
+        ThreadPoolExecutor(
+            max_workers=comment_workers, thread_name_prefix="comments"
+        ) as comment_executor,
+        ThreadPoolExecutor(
+            max_workers=min(max_workers, len(subreddits)),
+            thread_name_prefix="fused",
+        ) as executor,
+    ):
+        futures = [
+            executor.submit(
+                stream_subreddit_to_s3,
+                s3,
+                instance,
+                subreddit,
+                listings,
+                time_filter,
+                limit,
+                incremental,
+                rescan_hours,
+                batch_size,
+                s3_prefix,
+                snapshot_utc,
+                load_format,
+                parquet_parts,
+                compression,
+                part_size,
+                metrics,
+                comment_executor if comments else None,
+                replace_more_limit,
+            )
+            for subreddit in subreddits
+        ]
+        results = [future.result() for future in futures]
+
+    watermarks = [result[1] for result in results if result[1] is not None]
+    metrics.add(
+        "extract",
+        api_calls=rate_budget.request_count,
+        rate_limit_seconds=rate_budget.wait_time,
+    )
+
+    # (table, S3 paths, name of the manifest) of the S3 objects written
+    load_tables = [
+        (
+            table_name,
+            [s3_path for result in results for s3_path in result[0][table_name]],
+            s3_file_name + suffix,
+        )
+        for table_name, suffix in (
+            ("forum_posts_data", ""),
+            ("forum_post_snapshots", "_snapshots"),
+            ("forum_comments_data", "_comments"),
+        )
+    ]
+    if any(s3_paths for _, s3_paths, _ in load_tables):
+        redshift_conn = connect_to_redshift()
+        for table_name, s3_paths, manifest_name in load_tables:
+            if s3_paths:
+                copy_s3_objects_to_redshift(
+                    s3,
+                    redshift_conn,
+                    s3_paths,
+                    manifest_name,
+                    load_format,
+                    compression,
+                    metrics,
+                    table_name,
+                )
+    else:
+        print("No new or changed posts since the last run.")
+
+    # The watermarks, numbers of comments and last snapshots are only saved
+    # once the posts, snapshots and comments are in Redshift
+    for watermark in watermarks:
+        save_watermark(watermark)
+    for subreddit, result in zip(subreddits, results):
+        if result[2]:
+            save_comment_counts(subreddit, result[2])
+        if result[3]:
+            save_post_snapshots(subreddit, result[3])
+
+    if maintain_tables:
+        for table_name, s3_paths, _ in load_tables:
+            if s3_paths:
+                with metrics.time("maintain"):
+                    api_calls = maintain_table(redshift_conn, table_name)
+                metrics.add("maintain", api_calls=api_calls)
+
+    print(f"{rate_budget.describe()}.")
+    return metrics.export(task_instance)
+
+
+def copy_s3_objects_to_redshift(
+    s3,
+    redshift_conn,
+    s3_paths: list,
+    s3_file_name: str,
+    load_format: str,
+    compression,
+    metrics: PipelineMetrics,
+    table_name: str,
+):
+    # Writes the manifest of the S3 objects as "s3_file_name + '.manifest'"
+    # and copies them to the table
+    s3_prefix = f"{AWS_BUCKET_NAME}/raw/{s3_file_name}"
+    with metrics.time("load", api_calls=1):
+        # Sizes of the objects written, needed by the manifest of Parquet files
+        file_sizes = dict(zip(s3_paths, s3.sizes(s3_paths)))
+        put_manifest(s3, f"{s3_prefix}.manifest", file_sizes)
+    metrics.add("load", bytes=sum(file_sizes.values()))
+
+    copy_to_redshift_db(
+        redshift_conn,
+        AWS_BUCKET_NAME,
+        f"{s3_file_name}.manifest",
+        load_format=load_format,
+        compression=compression,
+        metrics=metrics,
+        table_name=table_name,
+    )
+
+
+def stream_subreddit_to_s3(
+    s3,
+    instance,
+    subreddit: str,
+    listings: list,
+    time_filter: str,
+    limit,
+    incremental: bool,
+    rescan_hours: int,
+    batch_size: int,
+    s3_prefix: str,
+    snapshot_utc: float,
+    load_format: str,
+    parquet_parts: int,
+    compression,
+    part_size: int,
+    metrics: PipelineMetrics,
+    comment_executor=None,
+    replace_more_limit=REPLACE_MORE_LIMIT,
+):
+    # Streams the new posts of one subreddit to S3 objects under s3_prefix and
+    # the snapshots of the changed posts under s3_prefix + "_snapshots",
+    # timing the stages in metrics, then the comments of the posts whose
+    # comments changed under s3_prefix + "_comments" if comment_executor is
+    # set. Returns the S3 paths written by table, the subreddit's new
+    # watermark, the number of comments of the posts whose comments were
+    # written and the new last snapshots of the posts
+    posts, watermark = extract_subreddit_posts(
+        instance, subreddit, listings, time_filter, limit, incremental, rescan_hours
+    )
+    new_watermark = watermark
+    loaded_post_snapshots = load_post_snapshots(subreddit)
+    post_snapshots = {}
+    loaded_comment_counts = {}
+    if comment_executor is not None:
+        loaded_comment_counts = load_comment_counts(subreddit)
+    comment_counts = {}
+
+    with contextlib.ExitStack() as exit_stack:
+        post_writer, csv_s3_path = open_s3_writer(
+            exit_stack,
+            s3,
+            f"{s3_prefix}/{subreddit}",
+            load_format,
+            parquet_parts,
+            compression,
+            part_size,
+            POST_SCHEMA,
+        )
+        snapshot_writer, snapshot_csv_s3_path = open_s3_writer(
+            exit_stack,
+            s3,
+            f"{s3_prefix}_snapshots/{subreddit}",
+            load_format,
+            parquet_parts,
+            compression,
+            part_size,
+            POST_SNAPSHOT_SCHEMA,
+        )
+
+        # Extract:
+        for batch in metrics.iter_timed("extract", iter_batches(posts, batch_size)):
+            new_watermark = get_new_watermark(subreddit, batch, new_watermark)
+            if comment_executor is not None:
+                comment_counts.update(
+                    get_changed_comment_counts(batch, loaded_comment_counts)
+                )
+            new_posts, snapshot_rows, new_post_snapshots = get_post_changes(
+                batch, loaded_post_snapshots, snapshot_utc
+            )
+            post_snapshots.update(new_post_snapshots)
+            # Transform:
+            with metrics.time("transform", rows=len(batch)):
+                post_dataframe = transform_data(new_posts)
+                snapshot_dataframe = transform_data(snapshot_rows, POST_SNAPSHOT_SCHEMA)
+            # Load:
+            with metrics.time(
+                "load", rows=len(post_dataframe), snapshots=len(snapshot_dataframe)
+            ):
+                if len(post_dataframe):
+                    post_writer.write(post_dataframe)
+                if len(snapshot_dataframe):
+                    snapshot_writer.write(snapshot_dataframe)
+
+        # Completes the uploads
+        with metrics.time("load"):
+            exit_stack.close()
+
+    print(
+        f"{post_writer.row_count} new posts and {snapshot_writer.row_count} "
+        f'snapshots of "{subreddit}" streamed to S3.'
+    )
+    if load_format == "parquet" and post_writer.truncated_count:
+        print(
+            f'{post_writer.truncated_count} values of "{subreddit}" were cut '
+            "to the length of their Redshift column."
+        )
+    s3_paths = {
+        "forum_posts_data": get_written_s3_paths(post_writer, csv_s3_path),
+        "forum_post_snapshots": get_written_s3_paths(
+            snapshot_writer, snapshot_csv_s3_path
+        ),
+        "forum_comments_data": [],
+    }
+
+    if comment_counts:
+        with contextlib.ExitStack() as exit_stack:
+            comment_writer, csv_s3_path = open_s3_writer(
+                exit_stack,
+                s3,
+                f"{s3_prefix}_comments/{subreddit}",
+                load_format,
+                parquet_parts,
+                compression,
+                part_size,
+                COMMENT_SCHEMA,
+            )
+            # The comment trees are requested by the threads of
+            # comment_executor, in the order of the posts
+            comment_lists = comment_executor.map(
+                lambda post_id: extract_comments(instance, post_id, replace_more_limit),
+                comment_counts,
+            )
+            comments = itertools.chain.from_iterable(
+                metrics.iter_timed("extract_comments", comment_lists)
+            )
+            for batch in iter_batches(comments, batch_size):
+                with metrics.time("transform_comments", rows=len(batch)):
+                    comment_dataframe = transform_data(batch, COMMENT_SCHEMA)
+                with metrics.time("load", rows=len(comment_dataframe)):
+                    comment_writer.write(comment_dataframe)
+
+            with metrics.time("load"):
+                exit_stack.close()
+
+        print(
+            f"{comment_writer.row_count} comments of {len(comment_counts)} posts "
+            f'of "{subreddit}" streamed to S3.'
+        )
+        s3_paths["forum_comments_data"] = get_written_s3_paths(
+            comment_writer, csv_s3_path
+        )
+
+    return s3_paths, new_watermark, comment_counts, post_snapshots
+
+
+def open_s3_writer(
+    exit_stack,
+    s3,
+    s3_path_prefix: str,
+    load_format: str,
+    parquet_parts: int,
+    compression,
+    part_size: int,
+    schema: tuple,
+):
+    # Writer of the rows to parquet_parts Parquet files
+    # <s3_path_prefix>_partNN.parquet, or to the .CSV <s3_path_prefix>.csv
+    # (+ the compression suffix), closed by exit_stack. The files are only
+    # created on S3 once rows are written to them, so a subreddit without
+    # rows leaves no empty file under the prefix COPY loads. Returns the
+    # writer and the S3 path of the .CSV, None for Parquet
+    if load_format == "parquet":
+        file_writer = RedshiftPartWriter(
+            s3_path_prefix, parquet_parts, schema, filesystem=s3
+        )
+        exit_stack.callback(file_writer.close)
+        return file_writer, None
+
+    csv_s3_path = f"{s3_path_prefix}.csv"
+    if compression is not None:
+        csv_s3_path += COMPRESSION_SUFFIXES[compression]
+
+    def open_csv_stream():
+        s3_stream = open_s3_stream(exit_stack, s3, csv_s3_path, compression, part_size)
+        # Closed before the S3 stream, to write the end of the file
+        exit_stack.callback(file_writer.close)
+        return s3_stream
+
+    file_writer = PostFileWriter(open_csv_stream, None)
+
+    return file_writer, csv_s3_path
+
+
+def get_written_s3_paths(file_writer, csv_s3_path):
+    # S3 paths of the files the writer of open_s3_writer() wrote rows to
+    if csv_s3_path is None:
+        return [
+            path
+            for path, parquet_writer in zip(
+                file_writer.paths, file_writer.parquet_writers
+            )
+            if parquet_writer is not None
+        ]
+
+    return [csv_s3_path] if file_writer.row_count else []
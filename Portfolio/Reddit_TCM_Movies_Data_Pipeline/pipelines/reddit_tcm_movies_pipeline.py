@@ -1,35 +1,512 @@
-import pandas as pd
+import glob
+import itertools
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from airflow.exceptions import AirflowSkipException
 
 from etls.reddit_tcm_movies_etl import (
+    REPLACE_MORE_LIMIT,
+    PostFileWriter,
+    RateBudget,
+    RedshiftPartWriter,
     connect_to_reddit,
-    extract_posts,
-    load_data_to_csv,
-    load_data_to_parquet,
+    extract_comments,
+    extract_listing_posts,
+    extract_new_posts,
+    get_changed_comment_counts,
+    get_new_watermark,
+    get_post_changes,
+    iter_batches,
+    load_comment_counts,
+    load_post_snapshots,
+    load_watermark,
     transform_data,
 )
-from utils.constants import DATA_OUTPUT_PATH, REDDIT_CLIENT_ID, REDDIT_SECRET_KEY
+from utils.constants import (
+    COMMENT_SCHEMA,
+    DATA_OUTPUT_PATH,
+    POST_SCHEMA,
+    POST_SNAPSHOT_SCHEMA,
+    REDDIT_CLIENT_ID,
+    REDDIT_REQUESTS_PER_MINUTE,
+    REDDIT_SECRET_KEY,
+)
+from utils.metrics import PipelineMetrics
 
 
 def reddit_tcm_movies_pipeline(
     csv_file_name: str,
     parquet_file_name: str,
-    subreddit: str,
+    subreddits: list,
+    listings=("top",),
     time_filter="month",  # Changed from "day" to get more than one day's worth of data
     limit=None,
+    incremental=False,
+    rescan_hours=48,
+    batch_size=1000,
+    requests_per_minute=REDDIT_REQUESTS_PER_MINUTE,
+    max_workers=8,
+    load_format="csv",
+    parquet_parts=4,
+    comments=False,
+    replace_more_limit=REPLACE_MORE_LIMIT,
+    comment_workers=4,
+    task_instance=None,
 ):
-    # Connect to Reddit instance
-    instance = connect_to_reddit(REDDIT_CLIENT_ID, REDDIT_SECRET_KEY, "Scrape Agent")
-
-    # Extract: Extract posts from the TurnerClassicMovies subreddit
-    posts = extract_posts(instance, subreddit, time_filter, limit)
-    post_dataframe = pd.DataFrame(posts)
-    # Transform:
-    post_dataframe = transform_data(post_dataframe)
-
-    # Load:
-    csv_file_path = f"{DATA_OUTPUT_PATH}/{csv_file_name}.csv"
-    load_data_to_csv(post_dataframe, csv_file_path)
-    parquet_file_path = f"{DATA_OUTPUT_PATH}/{parquet_file_name}.parquet"
-    load_data_to_parquet(post_dataframe, parquet_file_path)
-
-    return csv_file_path, parquet_file_path
+    """
+    Extracts the posts of the listings (top, new and/or hot) of every
+    subreddit. The subreddits are extracted at the same time by a pool of
+    threads that share one Reddit client and a budget of requests_per_minute
+    requests, so a run takes about as long as its slowest subreddit
+
+    The posts of each subreddit that were never loaded go to
+    <csv_file_name>/<subreddit>.csv and to the Parquet dataset
+    <parquet_file_name>.parquet/subreddit=<subreddit>/, loaded once into
+    forum_posts_data. The snapshots (POST_SNAPSHOT_SCHEMA) of the posts whose
+    score, number of comments or upvote ratio changed since their last
+    snapshot, new posts included, go to <csv_file_name>_snapshots/ and
+    <parquet_file_name>_snapshots.parquet/ and are appended to
+    forum_post_snapshots. The last snapshots are kept in POST_SNAPSHOTS_FILE
+
+    With incremental, only the posts created since the newest post already
+    loaded (the watermark) are extracted, plus the posts of the last
+    rescan_hours before it so their score, comments, etc. are updated. The
+    first run of a subreddit, without a watermark, extracts its listings
+
+    The posts are streamed: they are extracted, transformed and written
+    batch_size posts at a time so the memory used doesn't grow with the
+    number of posts
+
+    load_format is how the posts are loaded into Redshift: "csv" copies the
+    .CSVs, "parquet" also writes every subreddit to parquet_parts Parquet
+    files, typed like the Redshift table, in <parquet_file_name>_redshift/
+    (<parquet_file_name>_snapshots_redshift/ for the snapshots)
+
+    With comments, the comments of the posts whose number of comments changed
+    since their comments were loaded are extracted too, by a pool of
+    comment_workers threads shared by the subreddits and using the same
+    rate budget. Each comment tree expands up to replace_more_limit "load
+    more comments" links. They are written like the posts, with
+    COMMENT_SCHEMA, to <csv_file_name>_comments/,
+    <parquet_file_name>_comments.parquet/ and, with "parquet",
+    <parquet_file_name>_comments_redshift/
+
+    Returns the .CSV and Parquet directories of the posts, the new
+    watermarks, the Redshift Parquet directory of the posts (None with
+    "csv"), the tables to load with their directories (see get_load_tables()),
+    and the new numbers of comments and last snapshots of the posts, saved by
+    the copy task once they are in Redshift
+
+    The seconds and rows of the extract, transform and write stages and the
+    requests to Reddit are pushed to XCom ("metrics" key, from the Airflow
+    task_instance) and appended to METRICS_FILE
+    """
+    if load_format not in ("csv", "parquet"):
+        raise ValueError(f'Unknown load format "{load_format}".')
+    if isinstance(subreddits, str):
+        subreddits = [subreddits]
+
+    # Connect to Reddit instance, shared by the extraction threads
+    rate_budget = RateBudget(requests_per_minute)
+    instance = connect_to_reddit(
+        REDDIT_CLIENT_ID, REDDIT_SECRET_KEY, "Scrape Agent", rate_budget
+    )
+
+    # .CSV, Parquet and Redshift Parquet directories of the posts, snapshots
+    # and comments
+    post_dirs = get_output_dirs(csv_file_name, parquet_file_name, load_format)
+    snapshot_dirs = get_output_dirs(
+        f"{csv_file_name}_snapshots", f"{parquet_file_name}_snapshots", load_format
+    )
+    comment_dirs = None
+    if comments:
+        comment_dirs = get_output_dirs(
+            f"{csv_file_name}_comments", f"{parquet_file_name}_comments", load_format
+        )
+
+    metrics = PipelineMetrics("reddit_tcm_movies_extraction")
+    # Time of the snapshots of the run
+    snapshot_utc = time.time()
+    # The comment pool only starts threads once comments are extracted
+    with (
+        ThreadPoolExecutor(
+            max_workers=comment_workers, thread_name_prefix="comments"
+        ) as comment_executor,
+        ThreadPoolExecutor(
+            max_workers=min(max_workers, len(subreddits)),
+            thread_name_prefix="extract",
+        ) as executor,
+    ):
+        futures = [
+            executor.submit(
+                extract_subreddit,
+                instance,
+                subreddit,
+                listings,
+                time_filter,
+                limit,
+                incremental,
+                rescan_hours,
+                batch_size,
+                post_dirs,
+                snapshot_dirs,
+                snapshot_utc,
+                parquet_parts,
+                metrics,
+                comment_dirs,
+                comment_executor,
+                replace_more_limit,
+            )
+            for subreddit in subreddits
+        ]
+        results = [future.result() for future in futures]
+
+    post_count = sum(result[0] for result in results)
+    new_post_count = sum(result[1] for result in results)
+    snapshot_count = sum(result[2] for result in results)
+    comment_count = sum(result[4] for result in results)
+    # The requests are made while the posts are extracted, the wait for the
+    # rate budget is part of the extract seconds
+    metrics.add(
+        "extract",
+        api_calls=rate_budget.request_count,
+        rate_limit_seconds=rate_budget.wait_time,
+    )
+    print(
+        f"{post_count} posts ({new_post_count} new, {snapshot_count} snapshots) "
+        f"and {comment_count} comments extracted from {len(subreddits)} "
+        f"subreddits, {rate_budget.describe()}."
+    )
+    metrics.export(task_instance)
+
+    load_tables = []
+    if new_post_count:
+        load_tables.append(("forum_posts_data", post_dirs[0], post_dirs[2]))
+    if snapshot_count:
+        load_tables.append(("forum_post_snapshots", snapshot_dirs[0], snapshot_dirs[2]))
+    if comment_count:
+        load_tables.append(("forum_comments_data", comment_dirs[0], comment_dirs[2]))
+    if not load_tables:
+        # Skips the upload and copy tasks too
+        raise AirflowSkipException("No new or changed posts since the last run.")
+
+    # Saved by the copy task once the posts and comments are in Redshift
+    watermarks = [result[3] for result in results if result[3] is not None]
+    comment_counts = {
+        subreddit: result[5]
+        for subreddit, result in zip(subreddits, results)
+        if result[5]
+    }
+    post_snapshots = {
+        subreddit: result[6]
+        for subreddit, result in zip(subreddits, results)
+        if result[6]
+    }
+
+    return (
+        post_dirs[0],
+        post_dirs[1],
+        watermarks,
+        post_dirs[2],
+        load_tables,
+        comment_counts,
+        post_snapshots,
+    )
+
+
+def get_output_dirs(csv_file_name: str, parquet_file_name: str, load_format: str):
+    # .CSV directory, Parquet dataset and directory of the Parquet files
+    # loaded into Redshift (None with the "csv" load format) of a run
+    csv_dir = f"{DATA_OUTPUT_PATH}/{csv_file_name}"
+    parquet_dir = f"{DATA_OUTPUT_PATH}/{parquet_file_name}.parquet"
+    redshift_dir = None
+    if load_format == "parquet":
+        redshift_dir = f"{DATA_OUTPUT_PATH}/{parquet_file_name}_redshift"
+    os.makedirs(csv_dir, exist_ok=True)
+
+    return csv_dir, parquet_dir, redshift_dir
+
+
+def extract_subreddit(
+    instance,
+    subreddit: str,
+    listings: list,
+    time_filter: str,
+    limit,
+    incremental: bool,
+    rescan_hours: int,
+    batch_size: int,
+    post_dirs: tuple,
+    snapshot_dirs: tuple,
+    snapshot_utc: float,
+    parquet_parts: int,
+    metrics: PipelineMetrics,
+    comment_dirs=None,
+    comment_executor=None,
+    replace_more_limit=REPLACE_MORE_LIMIT,
+):
+    # Streams the new posts of one subreddit to its .CSV and Parquet
+    # partition, and to its Parquet files loaded into Redshift if post_dirs
+    # has their directory, and the snapshots of the changed posts the same way
+    # to snapshot_dirs, timing the stages in metrics. Then the comments of the
+    # posts whose comments changed if comment_dirs is set. Returns the number
+    # of posts, new posts and snapshots, the subreddit's new watermark, the
+    # number of comments, the number of comments of the posts whose comments
+    # were extracted and the new last snapshots of the posts
+
+    # Extract: Generator of the posts of the subreddit
+    posts, watermark = extract_subreddit_posts(
+        instance, subreddit, listings, time_filter, limit, incremental, rescan_hours
+    )
+
+    post_writer, redshift_writer = open_subreddit_writers(
+        subreddit, *post_dirs, parquet_parts, POST_SCHEMA
+    )
+    snapshot_writer, snapshot_redshift_writer = open_subreddit_writers(
+        subreddit, *snapshot_dirs, parquet_parts, POST_SNAPSHOT_SCHEMA
+    )
+    new_watermark = watermark
+    loaded_post_snapshots = load_post_snapshots(subreddit)
+    post_snapshots = {}
+    loaded_comment_counts = {}
+    if comment_dirs is not None:
+        loaded_comment_counts = load_comment_counts(subreddit)
+    comment_counts = {}
+    post_count = 0
+
+    try:
+        for batch in metrics.iter_timed("extract", iter_batches(posts, batch_size)):
+            post_count += len(batch)
+            new_watermark = get_new_watermark(subreddit, batch, new_watermark)
+            if comment_dirs is not None:
+                comment_counts.update(
+                    get_changed_comment_counts(batch, loaded_comment_counts)
+                )
+            new_posts, snapshot_rows, new_post_snapshots = get_post_changes(
+                batch, loaded_post_snapshots, snapshot_utc
+            )
+            post_snapshots.update(new_post_snapshots)
+            # Transform:
+            with metrics.time("transform", rows=len(batch)):
+                post_dataframe = transform_data(new_posts)
+                snapshot_dataframe = transform_data(snapshot_rows, POST_SNAPSHOT_SCHEMA)
+            # Load:
+            with metrics.time(
+                "write", rows=len(post_dataframe), snapshots=len(snapshot_dataframe)
+            ):
+                for file_writer, dataframe in (
+                    (post_writer, post_dataframe),
+                    (redshift_writer, post_dataframe),
+                    (snapshot_writer, snapshot_dataframe),
+                    (snapshot_redshift_writer, snapshot_dataframe),
+                ):
+                    if file_writer is not None and len(dataframe):
+                        file_writer.write(dataframe)
+    finally:
+        close_subreddit_writers(post_writer, redshift_writer, metrics, "write")
+        close_subreddit_writers(
+            snapshot_writer, snapshot_redshift_writer, metrics, "write"
+        )
+
+    print(
+        f'{post_count} posts extracted from "{subreddit}", '
+        f"{post_writer.row_count} new, {snapshot_writer.row_count} snapshots."
+    )
+    if redshift_writer is not None and redshift_writer.truncated_count:
+        print(
+            f'{redshift_writer.truncated_count} values of "{subreddit}" were cut '
+            "to the length of their Redshift column."
+        )
+
+    comment_count = 0
+    if comment_dirs is not None:
+        comment_count = extract_subreddit_comments(
+            instance,
+            subreddit,
+            comment_counts,
+            comment_executor,
+            replace_more_limit,
+            batch_size,
+            comment_dirs,
+            parquet_parts,
+            metrics,
+        )
+
+    return (
+        post_count,
+        post_writer.row_count,
+        snapshot_writer.row_count,
+        new_watermark,
+        comment_count,
+        comment_counts,
+        post_snapshots,
+    )
+
+
+def extract_subreddit_comments(
+    instance,
+    subreddit: str,
+    comment_counts: dict,
+    comment_executor: ThreadPoolExecutor,
+    replace_more_limit,
+    batch_size: int,
+    comment_dirs: tuple,
+    parquet_parts: int,
+    metrics: PipelineMetrics,
+):
+    # Streams the comments of the posts of comment_counts to the subreddit's
+    # comment files, like the posts. The comment trees are requested by the
+    # threads of comment_executor, in the order of the posts. Returns the
+    # number of comments
+    comment_writer, redshift_writer = open_subreddit_writers(
+        subreddit, *comment_dirs, parquet_parts, COMMENT_SCHEMA
+    )
+    comment_lists = comment_executor.map(
+        lambda post_id: extract_comments(instance, post_id, replace_more_limit),
+        comment_counts,
+    )
+    comments = itertools.chain.from_iterable(
+        metrics.iter_timed("extract_comments", comment_lists)
+    )
+
+    try:
+        for batch in iter_batches(comments, batch_size):
+            with metrics.time("transform_comments", rows=len(batch)):
+                comment_dataframe = transform_data(batch, COMMENT_SCHEMA)
+            with metrics.time("write_comments", rows=len(comment_dataframe)):
+                comment_writer.write(comment_dataframe)
+                if redshift_writer is not None:
+                    redshift_writer.write(comment_dataframe)
+    finally:
+        close_subreddit_writers(
+            comment_writer, redshift_writer, metrics, "write_comments"
+        )
+
+    print(
+        f"{comment_writer.row_count} comments of {len(comment_counts)} posts "
+        f'extracted from "{subreddit}".'
+    )
+    if redshift_writer is not None and redshift_writer.truncated_count:
+        print(
+            f"{redshift_writer.truncated_count} comment values of "
+            f'"{subreddit}" were cut to the length of their Redshift column.'
+        )
+    return comment_writer.row_count
+
+
+def open_subreddit_writers(
+    subreddit: str,
+    csv_dir: str,
+    parquet_dir: str,
+    redshift_dir,
+    parquet_parts: int,
+    schema: tuple,
+):
+    # Writers of the subreddit's .CSV and Parquet partition, and of its
+    # Parquet files loaded into Redshift if redshift_dir is set (else None)
+    csv_file_path = f"{csv_dir}/{subreddit}.csv"
+    parquet_partition_dir = f"{parquet_dir}/subreddit={subreddit}"
+    # Output of an earlier run of the same day
+    if os.path.exists(csv_file_path):
+        os.remove(csv_file_path)
+    shutil.rmtree(parquet_partition_dir, ignore_errors=True)
+    if redshift_dir is not None:
+        for path in glob.glob(f"{redshift_dir}/{subreddit}_part[0-9][0-9].parquet"):
+            os.remove(path)
+
+    # The snapshots have no subreddit column, the partition directory has it
+    file_writer = PostFileWriter(
+        csv_file_path,
+        f"{parquet_partition_dir}/part-0.parquet",
+        partition_columns=[
+            column for column, _, _, _ in schema if column == "subreddit"
+        ],
+    )
+    redshift_writer = None
+    if redshift_dir is not None:
+        redshift_writer = RedshiftPartWriter(
+            f"{redshift_dir}/{subreddit}", parquet_parts, schema
+        )
+
+    return file_writer, redshift_writer
+
+
+def close_subreddit_writers(
+    file_writer: PostFileWriter, redshift_writer, metrics: PipelineMetrics, stage: str
+):
+    # Closes the writers, timed as the stage with the size of the files
+    with metrics.time(stage):
+        file_writer.close()
+        if redshift_writer is not None:
+            redshift_writer.close()
+
+    file_paths = [file_writer.csv_path, file_writer.parquet_path]
+    if redshift_writer is not None:
+        file_paths += redshift_writer.paths
+    metrics.add(
+        stage,
+        bytes=sum(os.path.getsize(path) for path in file_paths if os.path.exists(path)),
+    )
+
+
+def extract_subreddit_posts(
+    instance,
+    subreddit: str,
+    listings: list,
+    time_filter: str,
+    limit,
+    incremental: bool,
+    rescan_hours: int,
+):
+    # Generator of the posts of the subreddit to extract and its watermark,
+    # None if it isn't incremental or it is the first run of the subreddit
+    watermark = load_watermark(subreddit) if incremental else None
+    if watermark is None:
+        posts = extract_listing_posts(instance, subreddit, listings, time_filter, limit)
+    else:
+        since_utc = watermark["created_utc"] - rescan_hours * 3600
+        posts = extract_new_posts(instance, subreddit, since_utc, limit)
+        print(
+            f'Extracting the posts of "{subreddit}" created since {since_utc} '
+            f"(watermark {watermark['created_utc']} minus {rescan_hours} hours)."
+        )
+
+    return posts, watermark
+
+
+def pull_extraction_results(task_instance):
+    """
+    Return values of the extraction task: (.CSV directory, Parquet directory,
+    watermarks, directory of the Parquet files loaded into Redshift, tables
+    to load, new numbers of comments and new last snapshots of the posts).
+    There is one for every mapped task when the extraction is mapped over the
+    subreddits, none for the ones that were skipped
+    """
+    # From Browse -> XComs in Airflow UI
+    results = task_instance.xcom_pull(
+        task_ids="reddit_tcm_movies_extraction", key="return_value"
+    )
+    if results and isinstance(results[0], str):
+        # Return value of a single extraction task
+        results = [results]
+
+    return [result for result in results or [] if result is not None]
+
+
+def get_load_tables(results: list):
+    """
+    (Redshift table, .CSV directory, directory of the Parquet files loaded
+    into Redshift or None) of the extraction results: forum_posts_data when
+    there are new posts, forum_post_snapshots when posts changed and
+    forum_comments_data when comments were written. The mapped extraction
+    tasks all write to the same directories so each is only loaded once
+    """
+    load_tables = set()
+    for result in results:
+        # Lists once pulled from XCom
+        load_tables.update(tuple(load_table) for load_table in result[4])
+
+    return sorted(load_tables, key=lambda load_table: (load_table[1], load_table[0]))
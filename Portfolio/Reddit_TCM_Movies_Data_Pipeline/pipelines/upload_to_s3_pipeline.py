@@ -1,25 +1,71 @@
 from etls.s3_etl_functions import (
+    S3_BATCH_SIZE,
+    S3_MAX_CONCURRENCY,
+    S3_PART_SIZE,
     connect_to_s3,
-    create_bucket_if_not_exist,
+    upload_manifest,
     upload_to_s3,
 )
+from pipelines.reddit_tcm_movies_pipeline import (
+    get_load_tables,
+    pull_extraction_results,
+)
 from utils.constants import AWS_BUCKET_NAME
+from utils.metrics import PipelineMetrics
 
 
-def upload_to_s3_pipeline(task_instance):
-    # From Browse -> XComs in Airflow UI
-    file_path = task_instance.xcom_pull(
-        task_ids="reddit_tcm_movies_extraction", key="return_value"
-    )
+def upload_to_s3_pipeline(
+    task_instance,
+    compression=None,
+    part_size=S3_PART_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    batch_size=S3_BATCH_SIZE,
+):
+    results = pull_extraction_results(task_instance)
+    metrics = PipelineMetrics("upload_to_s3")
 
+    # The bucket is created by upload_to_s3() if it doesn't exist
     s3 = connect_to_s3()
-    create_bucket_if_not_exist(s3, AWS_BUCKET_NAME)
     """
-    file_path is a tuple that contains the path to the .CSV and Parquet files
-    so [0] is used to specify only the .CSV file and .split gets the last part
-    of the file name
-     
-    Not using [0] will cause the Parquet file to be uploaded too for some
-    reason, even though .split is used
+    Each result is a tuple that contains the directories of the .CSV and
+    Parquet files, the new watermarks and the directory of the Parquet files
+    loaded into Redshift, None when the .CSV files are loaded, then the
+    tables to load with the same directories. get_load_tables() only keeps
+    the files loaded, of the posts, snapshots and comments. .split gets the
+    name of the directory, used as the S3 prefix of the files
+
+    The mapped extraction tasks all write to the same directory so it is
+    only uploaded once
     """
-    upload_to_s3(s3, file_path[0], AWS_BUCKET_NAME, file_path[0].split("/")[-1])
+    for _, csv_dir, redshift_dir in get_load_tables(results):
+        if redshift_dir is None:
+            # The .CSVs are compressed with compression, if set
+            upload_to_s3(
+                s3,
+                csv_dir,
+                AWS_BUCKET_NAME,
+                csv_dir.split("/")[-1],
+                compression,
+                part_size,
+                max_concurrency,
+                batch_size,
+                metrics,
+            )
+        else:
+            # The Parquet files are copied from a manifest listing them
+            s3_file_name = redshift_dir.split("/")[-1]
+            upload_to_s3(
+                s3,
+                redshift_dir,
+                AWS_BUCKET_NAME,
+                s3_file_name,
+                part_size=part_size,
+                max_concurrency=max_concurrency,
+                batch_size=batch_size,
+                metrics=metrics,
+            )
+            with metrics.time("upload", files=1, api_calls=1):
+                upload_manifest(s3, redshift_dir, AWS_BUCKET_NAME, s3_file_name)
+
+    # Seconds, bytes and requests of the uploads, to XCom and METRICS_FILE
+    metrics.export(task_instance)
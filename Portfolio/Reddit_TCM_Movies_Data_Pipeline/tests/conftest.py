@@ -0,0 +1,26 @@
+import os
+import shutil
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..")
+# The packages are imported from the project directory like in the Airflow
+# image, and the stand-ins from benchmarks/
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, "benchmarks"))
+
+from bench_pipeline import write_config
+
+work_dir = None
+
+
+def pytest_configure(config):
+    # utils/constants.py reads the config written by the benchmarks, with the
+    # output files in a temporary directory
+    global work_dir
+    work_dir = tempfile.mkdtemp(prefix="reddit_tests_")
+    os.environ["REDDIT_PIPELINE_CONFIG"] = write_config(work_dir)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,77 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from utils.lazy_tasks import lazy_callable
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+@pytest.fixture
+def task_module(monkeypatch, tmp_path):
+    # A pipeline module that isn't imported yet
+    (tmp_path / "lazy_test_pipeline.py").write_text(
+        "def run(subreddits, task_instance=None):\n"
+        "    return subreddits, task_instance\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "lazy_test_pipeline"
+    sys.modules.pop("lazy_test_pipeline", None)
+
+
+def test_module_is_imported_when_the_task_runs(task_module):
+    run = lazy_callable(task_module, "run")
+
+    assert run.__name__ == "run"
+    assert task_module not in sys.modules
+    # Only the context values the function has a parameter for are passed on
+    assert run(subreddits=["tcm"], task_instance="ti", run_id="manual") == (
+        ["tcm"],
+        "ti",
+    )
+    assert task_module in sys.modules
+
+
+def test_config_is_read_when_a_setting_is_used(tmp_path):
+    code = (
+        "from utils import constants; "
+        "read_on_import = constants.load_config.cache_info().currsize; "
+        "print(read_on_import, constants.AWS_BUCKET_NAME, "
+        "constants.load_config.cache_info().currsize)"
+    )
+    config_file = tmp_path / "config.conf"
+    config_file.write_text("[aws]\naws_bucket_name = tcm-bucket\n")
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_DIR,
+        env=dict(os.environ, REDDIT_PIPELINE_CONFIG=str(config_file)),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    assert output.split() == ["0", "tcm-bucket", "1"]
+
+
+def test_dag_parse_doesnt_import_the_pipelines():
+    pytest.importorskip("airflow.providers.standard.operators.python")
+    # Parsed in a new process like the DAG processor does, without config.conf
+    output = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(PROJECT_DIR, "benchmarks", "bench_dag_parse.py"),
+            "--mode",
+            "lazy",
+        ],
+        env=dict(os.environ, REDDIT_PIPELINE_CONFIG=os.devnull),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    parse = json.loads(output.splitlines()[-1])
+
+    assert parse["heavy_modules"] == []
+    assert not parse["config_read"]
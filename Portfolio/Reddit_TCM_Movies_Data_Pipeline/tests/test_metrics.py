@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+from utils import constants
+from utils.metrics import PipelineMetrics
+
+PROJECT_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+def test_importing_the_metrics_doesnt_read_the_config():
+    # The DAG file's imports mustn't read config/config.conf
+    code = (
+        "import utils.metrics, utils.constants; "
+        "print(utils.constants.load_config.cache_info().currsize)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_DIR,
+        env=dict(os.environ, REDDIT_PIPELINE_CONFIG=os.devnull),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    assert output.strip() == "0"
+
+
+def test_export_appends_to_the_metrics_file(monkeypatch, tmp_path):
+    metrics_file = str(tmp_path / "metrics" / "reddit_metrics.jsonl")
+    monkeypatch.setattr(constants, "METRICS_FILE", metrics_file)
+    metrics = PipelineMetrics("extract")
+    metrics.add("extract", 2.0, rows=10)
+
+    for _ in range(2):
+        summary = metrics.export()
+
+    with open(metrics_file) as file:
+        lines = [json.loads(line) for line in file]
+    # One line per export, the last one is the summary returned
+    assert len(lines) == 2
+    assert lines[-1] == summary
+    assert summary["stages"]["extract"] == {
+        "seconds": 2.0,
+        "rows": 10,
+        "rows_per_second": 5,
+    }
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+from stand_ins import FakeReddit, LocalRedshiftConnection, connect_to_local_s3
+
+from etls import reddit_tcm_movies_etl
+from utils.constants import AWS_BUCKET_NAME, DATA_OUTPUT_PATH
+
+# The pipelines raise AirflowSkipException when there is nothing to load
+pytest.importorskip("airflow")
+
+from pipelines import fused_reddit_tcm_movies_pipeline as fused_pipeline
+
+SUBREDDITS = ["tcm", "movies"]
+
+
+@pytest.fixture(autouse=True)
+def output_files(monkeypatch, tmp_path):
+    # The watermarks, numbers of comments and snapshots of the tests' runs
+    for name in ("WATERMARK_FILE", "COMMENT_COUNTS_FILE", "POST_SNAPSHOTS_FILE"):
+        monkeypatch.setattr(
+            reddit_tcm_movies_etl, name, str(tmp_path / f"{name.lower()}.json")
+        )
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return connect_to_local_s3(str(tmp_path / "s3"))
+
+
+@pytest.fixture
+def stand_ins(monkeypatch, tmp_path, s3):
+    # Reddit, S3 and Redshift of the pipelines replaced by the stand-ins, with
+    # 15 posts in each subreddit
+    fake_reddit = FakeReddit(30, len(SUBREDDITS))
+    monkeypatch.setattr(fused_pipeline, "connect_to_reddit", lambda *args: fake_reddit)
+    monkeypatch.setattr(fused_pipeline, "connect_to_s3", lambda: s3)
+    monkeypatch.setattr(
+        fused_pipeline,
+        "connect_to_redshift",
+        lambda: LocalRedshiftConnection(str(tmp_path / "redshift.db"), s3),
+    )
+    return fake_reddit
+
+
+def query(tmp_path, s3, statement):
+    redshift_conn = LocalRedshiftConnection(str(tmp_path / "redshift.db"), s3)
+    cursor = redshift_conn.cursor()
+    cursor.execute(statement)
+    rows = cursor.fetchall()
+    redshift_conn.close()
+    return rows
+
+
+@pytest.mark.parametrize(
+    "load_format, compression", [("csv", None), ("csv", "gzip"), ("parquet", None)]
+)
+def test_fused_pipeline_loads_every_post_once(
+    stand_ins, tmp_path, s3, load_format, compression
+):
+    def run():
+        return fused_pipeline.fused_reddit_tcm_movies_pipeline(
+            "reddit",
+            SUBREDDITS,
+            batch_size=4,
+            load_format=load_format,
+            parquet_parts=2,
+            compression=compression,
+        )
+
+    metrics = run()
+    assert metrics["stages"]["extract"]["rows"] == 30
+    assert metrics["stages"]["copy"]["rows"] == 60
+    assert query(tmp_path, s3, "select count(distinct id) from forum_posts_data") == [
+        (30,)
+    ]
+    assert query(tmp_path, s3, "select count(*) from forum_post_snapshots") == [(30,)]
+    # The posts are streamed to S3 under the prefix of the run
+    assert s3.ls(f"{AWS_BUCKET_NAME}/raw/reddit", detail=False)
+
+    # Nothing changed since the first run, so nothing is copied
+    metrics = run()
+    assert "copy" not in metrics["stages"]
+    assert query(tmp_path, s3, "select count(*) from forum_posts_data") == [(30,)]
+    assert query(tmp_path, s3, "select count(*) from forum_post_snapshots") == [(30,)]
+
+
+def test_fused_pipeline_writes_no_local_files(stand_ins):
+    files_before = set(os.listdir(DATA_OUTPUT_PATH))
+
+    fused_pipeline.fused_reddit_tcm_movies_pipeline("reddit", SUBREDDITS)
+
+    # Only the metrics are appended to the output directory
+    assert set(os.listdir(DATA_OUTPUT_PATH)) <= files_before | {"reddit_metrics.jsonl"}
+
+
+def test_fused_pipeline_loads_the_comments_of_changed_posts(stand_ins, tmp_path, s3):
+    # The posts with comments, their comments are extracted on the first run
+    posts = [
+        post
+        for subreddit in SUBREDDITS
+        for post in stand_ins.subreddit(subreddit).top()
+        if post.num_comments
+    ]
+    comment_count = sum(
+        len(reddit_tcm_movies_etl.extract_comments(stand_ins, post.id))
+        for post in posts
+    )
+
+    metrics = fused_pipeline.fused_reddit_tcm_movies_pipeline(
+        "reddit", SUBREDDITS, batch_size=4, comments=True, comment_workers=2
+    )
+    assert metrics["stages"]["extract_comments"]["rows"] == comment_count
+    assert query(tmp_path, s3, "select count(*) from forum_comments_data") == [
+        (comment_count,)
+    ]
+
+    # The numbers of comments didn't change, so no comment is extracted again
+    metrics = fused_pipeline.fused_reddit_tcm_movies_pipeline(
+        "reddit", SUBREDDITS, comments=True
+    )
+    assert "extract_comments" not in metrics["stages"]
+    assert query(tmp_path, s3, "select count(*) from forum_comments_data") == [
+        (comment_count,)
+    ]
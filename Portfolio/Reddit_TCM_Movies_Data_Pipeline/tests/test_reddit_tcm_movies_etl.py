@@ -0,0 +1,418 @@
+import io
+import threading
+import time
+
+import pandas as pd
+import prawcore
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import pytest
+from stand_ins import (
+    FakeCommentForest,
+    FakeReddit,
+    Redditor,
+    iter_synthetic_comments,
+    iter_synthetic_posts,
+)
+
+from etls import reddit_tcm_movies_etl
+from etls.reddit_tcm_movies_etl import (
+    POST_SNAPSHOT_RETENTION_DAYS,
+    PostFileWriter,
+    RateBudget,
+    RateBudgetRequestor,
+    RedshiftPartWriter,
+    extract_comments,
+    extract_new_posts,
+    get_changed_comment_counts,
+    get_new_watermark,
+    get_post_changes,
+    iter_batches,
+    load_post_snapshots,
+    load_watermark,
+    save_post_snapshots,
+    save_watermark,
+    transform_data,
+    truncate_to_bytes,
+)
+from utils.constants import COMMENT_SCHEMA, POST_SCHEMA
+
+# Created time of the newest post of FakeReddit, the others are a minute apart
+NEWEST_UTC = 1_700_000_000.0
+
+
+@pytest.fixture(autouse=True)
+def watermark_file(monkeypatch, tmp_path):
+    watermark_file = str(tmp_path / "reddit_watermarks.json")
+    monkeypatch.setattr(reddit_tcm_movies_etl, "WATERMARK_FILE", watermark_file)
+    monkeypatch.setattr(
+        reddit_tcm_movies_etl,
+        "POST_SNAPSHOTS_FILE",
+        str(tmp_path / "reddit_post_snapshots.json"),
+    )
+    return watermark_file
+
+
+def make_post(post_id, created_utc):
+    return {"id": post_id, "created_utc": created_utc}
+
+
+def test_watermark_moves_to_the_newest_post():
+    posts = [make_post("a", 100.0), make_post("c", 300.0), make_post("b", 200.0)]
+
+    assert get_new_watermark("tcm", posts) == {
+        "subreddit": "tcm",
+        "created_utc": 300.0,
+        "id": "c",
+    }
+
+
+def test_watermark_stays_without_newer_posts():
+    watermark = {"subreddit": "tcm", "created_utc": 300.0, "id": "c"}
+
+    assert get_new_watermark("tcm", [make_post("a", 100.0)], watermark) is watermark
+    assert get_new_watermark("tcm", [make_post("c", 300.0)], watermark) is watermark
+    assert get_new_watermark("tcm", [], watermark) is watermark
+    assert get_new_watermark("tcm", []) is None
+
+
+def test_watermark_is_kept_by_subreddit():
+    assert load_watermark("tcm") is None
+
+    save_watermark({"subreddit": "tcm", "created_utc": 300.0, "id": "c"})
+    save_watermark({"subreddit": "movies", "created_utc": 100.0, "id": "a"})
+    save_watermark({"subreddit": "tcm", "created_utc": 400.0, "id": "d"})
+
+    assert load_watermark("tcm") == {
+        "subreddit": "tcm",
+        "created_utc": 400.0,
+        "id": "d",
+    }
+    assert load_watermark("movies")["id"] == "a"
+
+
+def test_posts_older_than_the_watermark_are_skipped():
+    reddit_instance = FakeReddit(100)
+    since_utc = NEWEST_UTC - 30 * 60
+
+    posts = list(extract_new_posts(reddit_instance, "tcm", since_utc))
+
+    # /new is read until the first post created before since_utc
+    assert len(posts) == 31
+    assert min(post["created_utc"] for post in posts) == since_utc
+
+
+def test_transform_data_has_the_dtypes_of_the_schema():
+    post_dataframe = transform_data(list(iter_synthetic_posts(10)))
+
+    assert list(post_dataframe.columns) == [column for column, _, _, _ in POST_SCHEMA]
+    for column, dtype, _, _ in POST_SCHEMA:
+        assert post_dataframe[column].dtype == pd.api.types.pandas_dtype(dtype)
+
+
+def test_transform_data_converts_the_praw_values():
+    post = next(iter_synthetic_posts(1))
+    posts = [
+        dict(post, author=Redditor("someone"), over_18=True, edited=False),
+        dict(
+            post,
+            author=None,
+            upvote_ratio=0.87,
+            over_18=False,
+            edited=post["created_utc"] + 600,
+        ),
+    ]
+
+    post_dataframe = transform_data(posts)
+
+    assert post_dataframe["author"][0] == "someone"
+    assert post_dataframe["author"].isna()[1]
+    # over_18 was inverted and upvote_ratio truncated to an int before
+    assert post_dataframe["over_18"].tolist() == [True, False]
+    assert post_dataframe["upvote_ratio"][1] == 0.87
+    assert post_dataframe["edited"].tolist() == [False, True]
+    assert post_dataframe["created_utc"][0] == pd.Timestamp(NEWEST_UTC, unit="s")
+
+
+def test_transform_data_rejects_nulls_in_columns_that_are_not_nullable():
+    post = next(iter_synthetic_posts(1))
+
+    assert transform_data([dict(post, selftext=None)])["selftext"].isna().all()
+    with pytest.raises(ValueError, match='"title" has 1 null values'):
+        transform_data([dict(post, title=None)])
+
+
+def test_transform_data_of_no_posts_is_empty():
+    post_dataframe = transform_data([])
+
+    assert post_dataframe.empty
+    assert len(post_dataframe.columns) == len(POST_SCHEMA)
+
+
+def make_metrics_post(post_id, score, num_comments=3, upvote_ratio=0.9):
+    return {
+        "id": post_id,
+        "score": score,
+        "num_comments": num_comments,
+        "upvote_ratio": upvote_ratio,
+    }
+
+
+def test_post_changes():
+    post_snapshots = {
+        "a": [10, 3, 0.9, NEWEST_UTC - 3600],
+        "b": [20, 3, 0.9, NEWEST_UTC - 3600],
+    }
+    posts = [
+        make_metrics_post("a", 10),
+        make_metrics_post("b", 21),
+        make_metrics_post("c", 1),
+    ]
+
+    new_posts, snapshot_rows, new_post_snapshots = get_post_changes(
+        posts, post_snapshots, NEWEST_UTC
+    )
+
+    # "a" didn't change, "b" did and "c" was never loaded
+    assert new_posts == [posts[2]]
+    assert snapshot_rows == [
+        {
+            "id": "b",
+            "snapshot_ts": NEWEST_UTC,
+            "score": 21,
+            "num_comments": 3,
+            "upvote_ratio": 0.9,
+        },
+        {
+            "id": "c",
+            "snapshot_ts": NEWEST_UTC,
+            "score": 1,
+            "num_comments": 3,
+            "upvote_ratio": 0.9,
+        },
+    ]
+    assert new_post_snapshots == {
+        "b": [21, 3, 0.9, NEWEST_UTC],
+        "c": [1, 3, 0.9, NEWEST_UTC],
+    }
+
+
+def test_old_post_snapshots_are_dropped(monkeypatch):
+    now = NEWEST_UTC + POST_SNAPSHOT_RETENTION_DAYS * 24 * 60 * 60
+    monkeypatch.setattr(reddit_tcm_movies_etl.time, "time", lambda: now)
+
+    save_post_snapshots(
+        "tcm", {"a": [10, 3, 0.9, NEWEST_UTC - 1], "b": [20, 3, 0.9, NEWEST_UTC]}
+    )
+    save_post_snapshots("movies", {"c": [1, 3, 0.9, NEWEST_UTC - 1]})
+
+    post_snapshots = load_post_snapshots("tcm")
+    assert post_snapshots == {"b": [20, 3, 0.9, NEWEST_UTC]}
+    # The post is loaded as new again, the copy skips it if already loaded
+    new_posts, _, _ = get_post_changes(
+        [make_metrics_post("a", 10)], post_snapshots, now
+    )
+    assert [post["id"] for post in new_posts] == ["a"]
+    assert load_post_snapshots("movies") == {}
+
+
+def test_posts_are_written_a_batch_at_a_time(tmp_path):
+    csv_path = str(tmp_path / "reddit.csv")
+    parquet_path = str(tmp_path / "reddit.parquet" / "subreddit=tcm" / "0.parquet")
+    post_writer = PostFileWriter(csv_path, parquet_path, ["subreddit"])
+
+    batches = list(
+        iter_batches(iter_synthetic_posts(10, subreddit="tcm", prefix="t3_"), 4)
+    )
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    for batch in batches:
+        post_writer.write(transform_data(batch))
+    post_writer.close()
+
+    assert post_writer.row_count == 10
+    parquet_file = pq.ParquetFile(parquet_path)
+    # A row group per batch, without the column of the partition directory
+    assert parquet_file.metadata.num_row_groups == 3
+    assert "subreddit" not in parquet_file.schema_arrow.names
+    csv_table = pa_csv.read_csv(csv_path)
+    assert csv_table.num_rows == 10
+    assert csv_table["subreddit"].to_pylist() == ["tcm"] * 10
+    assert csv_table["id"].to_pylist() == [f"t3_{index:x}" for index in range(10)]
+
+
+def test_csv_file_is_opened_on_the_first_batch():
+    csv_files = []
+
+    def open_csv_file():
+        csv_files.append(io.BytesIO())
+        return csv_files[-1]
+
+    post_writer = PostFileWriter(open_csv_file, None)
+    post_writer.close()
+    # No empty file without rows
+    assert csv_files == []
+
+    post_writer = PostFileWriter(open_csv_file, None)
+    for batch in iter_batches(iter_synthetic_posts(3), 2):
+        post_writer.write(transform_data(batch))
+    assert len(csv_files) == 1
+    assert csv_files[0].getvalue().count(b"\n") == 4
+
+
+class FakeClock:
+    # time.monotonic() and time.sleep() of the rate budget, sleeping only
+    # moves the clock forward
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_budget_waits_once_the_burst_is_used(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(reddit_tcm_movies_etl.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(reddit_tcm_movies_etl.time, "sleep", clock.sleep)
+    rate_budget = RateBudget(60, burst=2)
+
+    for _ in range(4):
+        rate_budget.acquire()
+
+    # 2 requests at once, then one a second
+    assert clock.sleeps == [1.0, 1.0]
+    clock.now += 10
+    rate_budget.acquire()
+    assert clock.sleeps == [1.0, 1.0]
+    assert rate_budget.request_count == 5
+    assert rate_budget.wait_time == 2.0
+
+
+def test_rate_budget_is_shared_by_the_threads():
+    # 6000 requests per minute, one every 10ms after the first
+    rate_budget = RateBudget(6000, burst=1)
+    start_time = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda: [rate_budget.acquire() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert rate_budget.request_count == 20
+    assert time.monotonic() - start_time >= 19 * 0.01 - 0.005
+
+
+def test_every_request_to_reddit_takes_from_the_budget(monkeypatch):
+    monkeypatch.setattr(
+        prawcore.Requestor, "request", lambda self, *args, **kwargs: "response"
+    )
+    rate_budget = RateBudget(6000)
+    requestor = RateBudgetRequestor("reddit_tcm_movies tests", rate_budget=rate_budget)
+
+    response = requestor.request("GET", "https://oauth.reddit.com/r/tcm/new")
+
+    assert response == "response"
+    assert rate_budget.request_count == 1
+
+
+def test_redshift_parts_have_the_types_of_the_table(tmp_path):
+    part_writer = RedshiftPartWriter(str(tmp_path / "reddit_redshift" / "tcm"), 4)
+    part_writer.write(transform_data(list(iter_synthetic_posts(10))))
+    part_writer.close()
+
+    tables = [pq.read_table(path) for path in part_writer.paths]
+    # The batch is split evenly across the parts
+    assert [table.num_rows for table in tables] == [3, 3, 3, 1]
+    schema = tables[0].schema
+    assert schema.field("score").type == pa.int32()
+    assert schema.field("upvote_ratio").type == pa.float32()
+    assert schema.field("created_utc").type == pa.timestamp("ms")
+    assert schema.field("title").type == pa.string()
+    assert not schema.field("id").nullable
+    assert schema.field("author").nullable
+
+
+def test_small_batches_go_to_the_next_part(tmp_path):
+    part_writer = RedshiftPartWriter(str(tmp_path / "tcm"), 4)
+    for batch in iter_batches(iter_synthetic_posts(3), 1):
+        part_writer.write(transform_data(batch))
+    part_writer.close()
+
+    assert part_writer.row_count == 3
+    assert [
+        pq.read_metadata(path).num_rows if writer is not None else 0
+        for path, writer in zip(part_writer.paths, part_writer.parquet_writers)
+    ] == [1, 1, 1, 0]
+
+
+def test_strings_are_cut_to_the_bytes_of_their_varchar(tmp_path):
+    post = next(iter_synthetic_posts(1))
+    # title is a varchar(1200), é is 2 bytes in UTF-8
+    title = "a" * 1199 + "é"
+    part_writer = RedshiftPartWriter(str(tmp_path / "tcm"), 1)
+    part_writer.write(transform_data([dict(post, title=title), post]))
+    part_writer.close()
+
+    assert part_writer.truncated_count == 1
+    titles = pq.read_table(part_writer.paths[0])["title"].to_pylist()
+    assert titles == ["a" * 1199, post["title"]]
+
+
+def test_truncate_to_bytes():
+    array, truncated_count = truncate_to_bytes(pa.array(["aé", "ab", None]), 2)
+
+    assert array.to_pylist() == ["a", "ab", None]
+    assert truncated_count == 1
+
+
+def test_comments_of_posts_whose_comments_changed():
+    posts = [
+        {"id": "a", "num_comments": 3},
+        {"id": "b", "num_comments": 5},
+        {"id": "c", "num_comments": 0},
+        {"id": "d", "num_comments": 2},
+    ]
+
+    # a is unchanged, b has new comments, c is new without comments, d is new
+    assert get_changed_comment_counts(posts, {"a": 3, "b": 4}) == {"b": 5, "d": 2}
+
+
+def test_comment_trees_are_extracted_as_flat_lists(monkeypatch):
+    fake_reddit = FakeReddit(10)
+    post_ids = [post.id for post in fake_reddit.subreddit("tcm").top()]
+    replace_more_limits = []
+
+    def replace_more(self, limit=32):
+        replace_more_limits.append(limit)
+        return []
+
+    monkeypatch.setattr(FakeCommentForest, "replace_more", replace_more)
+    comment_lists = [
+        extract_comments(fake_reddit, post_id, replace_more_limit=4)
+        for post_id in post_ids
+    ]
+
+    assert replace_more_limits == [4] * len(post_ids)
+    for post_id, comments in zip(post_ids, comment_lists):
+        assert [comment["id"] for comment in comments] == [
+            comment["id"]
+            for comment in iter_synthetic_comments(post_id, "tcm", len(comments))
+        ]
+        assert all(comment["submission_id"] == post_id for comment in comments)
+    comments = [comment for comments in comment_lists for comment in comments]
+    # The replies keep the comment they reply to
+    assert any(comment["parent_id"].startswith("t1_") for comment in comments)
+
+    comment_dataframe = transform_data(comments, COMMENT_SCHEMA)
+    assert len(comment_dataframe) == len(comments)
+    assert comment_dataframe["author"].tolist() == [
+        str(comment["author"]) for comment in comments
+    ]
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+from stand_ins import (
+    LocalRedshiftConnection,
+    connect_to_local_s3,
+    iter_synthetic_comments,
+    iter_synthetic_posts,
+)
+
+from etls.reddit_tcm_movies_etl import load_data_to_csv, transform_data
+from etls.redshift_etl_functions import copy_to_redshift_db
+from utils.constants import COMMENT_SCHEMA, POST_SCHEMA
+
+BUCKET = "reddit-bucket"
+
+
+@pytest.fixture
+def s3_dir(tmp_path):
+    return tmp_path / "s3"
+
+
+@pytest.fixture
+def redshift_conn(tmp_path, s3_dir):
+    redshift_conn = LocalRedshiftConnection(
+        str(tmp_path / "redshift.db"), connect_to_local_s3(str(s3_dir))
+    )
+    yield redshift_conn
+    redshift_conn.close()
+
+
+def upload_posts(s3_dir, s3_file_name, posts, schema=POST_SCHEMA):
+    # The .CSV of the posts as upload_to_s3() leaves it in the bucket
+    csv_path = s3_dir / BUCKET / "raw" / s3_file_name
+    os.makedirs(csv_path.parent, exist_ok=True)
+    load_data_to_csv(transform_data(posts, schema), str(csv_path))
+
+
+def query(redshift_conn, statement):
+    cursor = redshift_conn.cursor()
+    cursor.execute(statement)
+    return cursor.fetchall()
+
+
+def test_posts_copied_again_arent_duplicated(redshift_conn, s3_dir):
+    posts = list(iter_synthetic_posts(10))
+    upload_posts(s3_dir, "reddit1.csv", posts[:6])
+    assert copy_to_redshift_db(redshift_conn, BUCKET, "reddit1.csv") == 6
+
+    # The next run extracts 2 of the posts again, with a new score
+    rescanned_posts = [dict(post, score=post["score"] + 1) for post in posts[4:]]
+    upload_posts(s3_dir, "reddit2.csv", rescanned_posts)
+    assert copy_to_redshift_db(redshift_conn, BUCKET, "reddit2.csv") == 4
+
+    rows = query(redshift_conn, "select id, score from forum_posts_data order by id")
+    assert len(rows) == 10
+    # forum_posts_data is immutable, the first row of a post is kept
+    assert dict(rows)[posts[4]["id"]] == posts[4]["score"]
+
+
+def test_staging_table_is_dropped(redshift_conn, s3_dir):
+    upload_posts(s3_dir, "reddit1.csv", list(iter_synthetic_posts(3)))
+    copy_to_redshift_db(redshift_conn, BUCKET, "reddit1.csv")
+
+    assert query(redshift_conn, "select count(*) from forum_posts_data") == [(3,)]
+    assert query(redshift_conn, "select name from sqlite_temp_master") == []
+
+
+def get_comments(post_id, count):
+    # Comments of a post with the submission_id extract_comments() gives them
+    return [
+        dict(comment, submission_id=post_id)
+        for comment in iter_synthetic_comments(post_id, "tcm", count)
+    ]
+
+
+def test_comments_copied_again_replace_the_comments_of_their_post(
+    redshift_conn, s3_dir
+):
+    comments = get_comments("a", 4) + get_comments("b", 3)
+    upload_posts(s3_dir, "comments1.csv", comments, COMMENT_SCHEMA)
+    copy_to_redshift_db(
+        redshift_conn, BUCKET, "comments1.csv", table_name="forum_comments_data"
+    )
+
+    # The comments of "a" are extracted again: one was deleted, one scored
+    rescanned_comments = get_comments("a", 3)
+    rescanned_comments[0]["score"] += 1
+    upload_posts(s3_dir, "comments2.csv", rescanned_comments, COMMENT_SCHEMA)
+    copy_to_redshift_db(
+        redshift_conn, BUCKET, "comments2.csv", table_name="forum_comments_data"
+    )
+
+    rows = query(
+        redshift_conn,
+        "select submission_id, id, score from forum_comments_data order by id",
+    )
+    assert [(row[0], row[1]) for row in rows] == [
+        (comment["submission_id"], comment["id"])
+        for comment in rescanned_comments + comments[4:]
+    ]
+    assert rows[0][2] == rescanned_comments[0]["score"]
@@ -0,0 +1,202 @@
+import pytest
+from stand_ins import LocalRedshiftConnection, connect_to_local_s3
+
+from etls.redshift_schema_functions import (
+    DIST_ALL_MAX_ROWS,
+    SCHEMA_VERSIONS_TABLE,
+    TABLES,
+    ensure_table,
+    get_create_table_query,
+    get_table_version,
+    maintain_table,
+)
+
+# forum_posts_data as created by the first version of the pipeline
+LEGACY_POSTS_TABLE = (
+    "create table forum_posts_data(id text not null, title text not null, "
+    "selftext text, score integer, num_comments integer, "
+    "author varchar(25) not null, created_utc text not null, url text not null, "
+    "upvote_ratio integer, over_18 varchar(5), edited varchar(5), "
+    "spoiler varchar(5), stickied varchar(5))"
+)
+
+
+@pytest.fixture
+def redshift_conn(tmp_path):
+    redshift_conn = LocalRedshiftConnection(
+        str(tmp_path / "redshift.db"), connect_to_local_s3(str(tmp_path / "s3"))
+    )
+    yield redshift_conn
+    redshift_conn.close()
+
+
+def query(redshift_conn, statement):
+    cursor = redshift_conn.cursor()
+    cursor.execute(statement)
+    return cursor.fetchall()
+
+
+def test_create_table_query():
+    create_query = get_create_table_query("forum_posts_data")
+
+    # The first column of the sort key is left uncompressed
+    assert "created_utc timestamp encode raw not null" in create_query
+    assert "score integer encode az64 not null" in create_query
+    assert "title varchar(1200) encode zstd not null" in create_query
+    assert "author varchar(25) encode zstd," in create_query
+    assert create_query.endswith("diststyle all compound sortkey(created_utc)")
+
+    create_query = get_create_table_query(
+        "forum_posts_data", DIST_ALL_MAX_ROWS + 1, "forum_posts_data_migrated"
+    )
+    assert create_query.startswith("create table forum_posts_data_migrated(")
+    assert "diststyle key distkey(id)" in create_query
+
+
+def test_new_table_is_created_at_the_current_version(redshift_conn):
+    assert ensure_table(redshift_conn, "forum_posts_data") == 4
+    assert ensure_table(redshift_conn, "forum_posts_data") == 3
+
+    cursor = redshift_conn.cursor()
+    assert get_table_version(cursor, "forum_posts_data") == 3
+    assert query(redshift_conn, f"select table_name from {SCHEMA_VERSIONS_TABLE}") == [
+        ("forum_posts_data",)
+    ]
+
+
+def test_version_of_a_table_without_a_recorded_version(redshift_conn):
+    cursor = redshift_conn.cursor()
+    cursor.execute(
+        f"create table {SCHEMA_VERSIONS_TABLE}(table_name varchar(127), "
+        "version integer, migrated_at timestamp)"
+    )
+
+    # created_utc isn't a timestamp yet
+    cursor.execute(LEGACY_POSTS_TABLE)
+    assert get_table_version(cursor, "forum_posts_data") == 1
+
+    # Otherwise the version before the current one
+    cursor.execute("drop table forum_posts_data")
+    cursor.execute(
+        "create table forum_posts_data(id varchar(16), created_utc timestamp)"
+    )
+    assert get_table_version(cursor, "forum_posts_data") == 2
+    cursor.execute(
+        "create table forum_post_snapshots(id varchar(16), snapshot_ts timestamp)"
+    )
+    assert get_table_version(cursor, "forum_post_snapshots") == 1
+
+
+def test_first_version_of_the_posts_is_migrated(redshift_conn):
+    cursor = redshift_conn.cursor()
+    cursor.execute(LEGACY_POSTS_TABLE)
+    cursor.execute(
+        "insert into forum_posts_data values "
+        "('a1', 't', 's', 5, 2, 'None', '2023-11-14 22:13:20', 'u', 1, "
+        "'False', 'True', 'False', 'False'), "
+        "('b2', 't', 's', 1, 1, 'x', '2023-11-15 08:00:00', 'u', 1, "
+        "'True', 'False', 'True', 'False')"
+    )
+
+    assert ensure_table(redshift_conn, "forum_posts_data") == 3 + 8
+
+    assert query(
+        redshift_conn,
+        "select id, author, created_utc, over_18, edited, spoiler, stickied, "
+        "subreddit from forum_posts_data order by id",
+    ) == [
+        # over_18 was inverted
+        ("a1", None, "2023-11-14 22:13:20", 1, 1, 0, 0, "TurnerClassicMovies"),
+        ("b2", "x", "2023-11-15 08:00:00", 0, 0, 1, 0, "TurnerClassicMovies"),
+    ]
+    assert get_table_version(redshift_conn.cursor(), "forum_posts_data") == 3
+
+
+def test_migration_drops_the_duplicate_posts(redshift_conn):
+    cursor = redshift_conn.cursor()
+    cursor.execute(LEGACY_POSTS_TABLE)
+    # The first version appended the posts every time they were extracted
+    for score, created_utc in ((9, "22:13:21"), (7, "22:13:19"), (5, "22:13:20")):
+        cursor.execute(
+            "insert into forum_posts_data values "
+            f"('a1', 't', 's', {score}, 2, 'x', '2023-11-14 {created_utc}', 'u', "
+            "1, 'False', 'False', 'False', 'False')"
+        )
+
+    ensure_table(redshift_conn, "forum_posts_data")
+
+    # The row with the first created_utc is kept
+    assert query(redshift_conn, "select id, score from forum_posts_data") == [("a1", 7)]
+
+
+def test_mutable_table_keeps_every_row(redshift_conn):
+    cursor = redshift_conn.cursor()
+    cursor.execute(
+        "create table forum_comments_data(id varchar(16), submission_id "
+        "varchar(16), parent_id varchar(16), author varchar(25), body "
+        "varchar(40000), score integer, created_utc timestamp, edited boolean, "
+        "depth integer, subreddit varchar(21))"
+    )
+    cursor.execute(
+        "insert into forum_comments_data values "
+        "('c1', 'a1', 't3_a1', null, 'b', 1, '2023-11-14 22:13:20', 0, 0, 'x'), "
+        "('c2', 'a1', 't3_a1', null, 'b', 1, '2023-11-14 22:13:21', 0, 0, 'x')"
+    )
+
+    assert ensure_table(redshift_conn, "forum_comments_data") == 3 + 8
+    assert query(redshift_conn, "select count(*) from forum_comments_data") == [(2,)]
+
+
+class FakeCursor:
+    # Returns table_info for the svv_table_info query and records the
+    # statements
+    def __init__(self, table_info):
+        self.table_info = table_info
+        self.statements = []
+
+    def execute(self, statement, args=None):
+        self.statements.append(statement)
+
+    def fetchone(self):
+        return self.table_info
+
+
+class FakeConnection:
+    def __init__(self, table_info):
+        self.autocommit = False
+        self.cursor_ = FakeCursor(table_info)
+
+    def cursor(self):
+        return self.cursor_
+
+
+@pytest.mark.parametrize(
+    "table_info, statements",
+    [
+        (None, []),
+        (("ALL", 1000, 0.0, 0.0), []),
+        (("ALL", 1000, 0.0, None), ["analyze forum_posts_data"]),
+        (("ALL", 1000, 0.0, 50.0), ["analyze forum_posts_data"]),
+        (("ALL", 1000, 20.0, 0.0), ["vacuum forum_posts_data"]),
+        (
+            ("ALL", DIST_ALL_MAX_ROWS + 1, 0.0, 0.0),
+            ["alter table forum_posts_data alter diststyle key distkey id"],
+        ),
+        (("KEY(id)", DIST_ALL_MAX_ROWS + 1, 0.0, 0.0), []),
+    ],
+)
+def test_maintain_table(table_info, statements):
+    redshift_conn = FakeConnection(table_info)
+
+    assert maintain_table(redshift_conn, "forum_posts_data") == 1 + len(statements)
+    assert redshift_conn.cursor_.statements[1:] == statements
+    # VACUUM can't run in a transaction
+    assert redshift_conn.autocommit
+
+
+def test_every_table_has_a_sort_and_dist_key():
+    for table_name, definition in TABLES.items():
+        columns = [column for column, _, _, _ in definition["schema"]]
+        assert set(definition["sort_key"]) <= set(columns), table_name
+        assert definition["dist_key"] in columns, table_name
+        assert set(definition["merge_key"]) <= set(columns), table_name
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+
+import pytest
+import zstandard
+from fsspec.implementations.local import LocalFileSystem
+from stand_ins import LocalS3FileSystem
+
+from etls.s3_etl_functions import get_etag, upload_to_s3
+from utils.metrics import PipelineMetrics
+
+BUCKET = "reddit-bucket"
+
+
+class ETagS3FileSystem(LocalS3FileSystem):
+    # The local S3 stand-in with the ETags S3 gives the objects uploaded in
+    # one PUT, and the paths put
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_paths = []
+
+    def find(self, path, detail=False, **kwargs):
+        objects = super().find(path, detail=detail, **kwargs)
+        if detail:
+            for s3_path, info in objects.items():
+                info["ETag"] = f'"{self.get_md5(s3_path)}"'
+        return objects
+
+    def put(self, local_paths, s3_paths, **kwargs):
+        self.put_paths.extend(s3_paths)
+        return super().put(local_paths, s3_paths)
+
+    def get_md5(self, s3_path):
+        return hashlib.md5(self.cat_file(s3_path)).hexdigest()
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return ETagS3FileSystem(
+        path=str(tmp_path / "s3"), fs=LocalFileSystem(auto_mkdir=True)
+    )
+
+
+def write_csvs(csv_dir, contents):
+    csv_dir.mkdir(exist_ok=True)
+    for path in csv_dir.iterdir():
+        path.unlink()
+    for file_name, text in contents.items():
+        (csv_dir / file_name).write_text(text)
+
+
+def upload(s3, csv_dir, compression=None):
+    metrics = PipelineMetrics("upload_to_s3")
+    upload_to_s3(s3, str(csv_dir), BUCKET, "reddit", compression, metrics=metrics)
+    return metrics.stages["upload"]
+
+
+def test_unchanged_files_are_skipped_and_old_ones_deleted(s3, tmp_path):
+    csv_dir = tmp_path / "reddit"
+    write_csvs(csv_dir, {"a.csv": "id\na\n", "b.csv": "id\nb\n", "c.csv": "id\nc\n"})
+
+    # The listing and 3 PUTs
+    assert upload(s3, csv_dir)["api_calls"] == 4
+
+    s3.put_paths.clear()
+    write_csvs(csv_dir, {"a.csv": "id\na\n", "b.csv": "id\nb2\n"})
+    stage = upload(s3, csv_dir)
+
+    assert s3.put_paths == [f"{BUCKET}/raw/reddit/b.csv"]
+    assert sorted(s3.ls(f"{BUCKET}/raw/reddit", detail=False)) == [
+        f"{BUCKET}/raw/reddit/a.csv",
+        f"{BUCKET}/raw/reddit/b.csv",
+    ]
+    # The listing, the PUT of b.csv and the DeleteObjects of c.csv
+    assert stage["api_calls"] == 3
+    assert stage["files"] == 1
+
+
+@pytest.mark.parametrize(
+    "compression, suffix, decompress",
+    [
+        ("gzip", ".gz", gzip.decompress),
+        (
+            "zstd",
+            ".zst",
+            lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+        ),
+    ],
+)
+def test_compressed_csvs_are_uploaded_once(
+    s3, tmp_path, compression, suffix, decompress
+):
+    csv_dir = tmp_path / "reddit"
+    text = "id,title\n" + "".join(f"{index},Title {index}\n" for index in range(1000))
+    write_csvs(csv_dir, {"a.csv": text})
+
+    upload(s3, csv_dir, compression)
+    s3_path = f"{BUCKET}/raw/reddit/a.csv{suffix}"
+    assert decompress(s3.cat_file(s3_path)).decode() == text
+
+    # The compressed file is the same every time, so its ETag doesn't change
+    s3.put_paths.clear()
+    assert upload(s3, csv_dir, compression)["files"] == 0
+    assert s3.put_paths == []
+
+
+def test_etag_of_a_multipart_upload(tmp_path):
+    path = tmp_path / "a.parquet"
+    parts = [b"a" * 100, b"b" * 100, b"c" * 50]
+    path.write_bytes(b"".join(parts))
+    part_digests = b"".join(hashlib.md5(part).digest() for part in parts)
+
+    assert get_etag(str(path), 100) == f"{hashlib.md5(part_digests).hexdigest()}-3"
+    assert get_etag(str(path), 1000) == hashlib.md5(path.read_bytes()).hexdigest()
@@ -1,51 +1,155 @@
 import configparser
+import functools
 import os
 
-parser = configparser.RawConfigParser()
+
+@functools.cache
+def load_config():
+    """
+    ".." reads one directory up from the "utils" directory so goes to
+    /config and then read config.conf in /config. The REDDIT_PIPELINE_CONFIG
+    environment variable can point to another config file, e.g. the one the
+    benchmarks write to run offline
+
+    The file is read once, the first time one of its settings is used, not
+    when the module is imported: the Airflow scheduler imports this module
+    every time it parses the DAG file
+    """
+    parser = configparser.RawConfigParser()
+    parser.read(
+        os.environ.get(
+            "REDDIT_PIPELINE_CONFIG",
+            os.path.join(os.path.dirname(__file__), "../config/config.conf"),
+        )
+    )
+    return parser
+
+
+# Settings of config.conf: (section, option). They are read by __getattr__
+# on their first import, e.g. "from utils.constants import AWS_BUCKET_NAME",
+# and then kept as attributes of the module
+CONFIG_OPTIONS = {
+    "REDDIT_SECRET_KEY": ("api_keys", "reddit_secret_key"),
+    "REDDIT_CLIENT_ID": ("api_keys", "reddit_client_id"),
+    "DATABASE_HOST": ("database", "database_host"),
+    "DATABASE_NAME": ("database", "database_name"),
+    "DATABASE_PORT": ("database", "database_port"),
+    "DATABASE_USER": ("database", "database_username"),
+    "DATABASE_PASSWORD": ("database", "database_password"),
+    "AWS_ACCESS_KEY_ID": ("aws", "aws_access_key_id"),
+    "AWS_SECRET_ACCESS_KEY": ("aws", "aws_secret_access_key"),
+    "AWS_REGION": ("aws", "aws_region"),
+    "AWS_BUCKET_NAME": ("aws", "aws_bucket_name"),
+    # For saving output from DAG input from AWS
+    "DATA_INPUT_PATH": ("file_paths", "input_path"),
+    "DATA_OUTPUT_PATH": ("file_paths", "output_path"),
+    # Redshift cluster config
+    "REDSHIFT_HOSTNAME": ("aws", "redshift_hostname"),
+    "REDSHIFT_DB_NAME": ("aws", "redshift_db_name"),
+    "REDSHIFT_PORT": ("aws", "redshift_port"),
+    "REDSHIFT_USERNAME": ("aws", "redshift_username"),
+    "REDSHIFT_PASSWORD": ("aws", "redshift_password"),
+    "REDSHIFT_IAM_ROLE": ("aws", "redshift_iam_role"),
+}
+
+# Files in DATA_OUTPUT_PATH, also read by __getattr__
+OUTPUT_FILES = {
+    # Newest post loaded into Redshift for every subreddit, for the
+    # incremental extraction
+    "WATERMARK_FILE": "reddit_watermarks.json",
+    # Number of comments of the posts whose comments were loaded into
+    # Redshift, by subreddit, so only the posts with new comments are fetched
+    "COMMENT_COUNTS_FILE": "reddit_comment_counts.json",
+    # Last snapshot of the score, number of comments and upvote ratio of the
+    # posts loaded into Redshift, by subreddit
+    "POST_SNAPSHOTS_FILE": "reddit_post_snapshots.json",
+    # Timings and counts of every run of the tasks, one JSON line per task,
+    # see utils/metrics.py
+    "METRICS_FILE": "reddit_metrics.jsonl",
+}
+
+
+def __getattr__(name: str):
+    # Called for the attributes not set yet: the settings of config.conf
+    if name in CONFIG_OPTIONS:
+        value = load_config().get(*CONFIG_OPTIONS[name])
+    elif name in OUTPUT_FILES:
+        value = os.path.join(__getattr__("DATA_OUTPUT_PATH"), OUTPUT_FILES[name])
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    globals()[name] = value
+    return value
+
+
+# Requests per minute made to the Reddit API by a run. Reddit allows 100 per
+# minute per OAuth client, some are kept for the access token requests and for
+# other scripts using the same client
+REDDIT_REQUESTS_PER_MINUTE = 90
+
+"""
+Columns of the posts: (name, pandas dtype, nullable, Redshift type). The
+dtypes are Arrow-backed (pandas ArrowDtype) so strings aren't stored as
+Python objects and transform_data() builds every column with one
+conversion. VARCHAR lengths are in bytes, titles are up to 300 characters of
+up to 4 bytes in UTF-8
+"""
+POST_SCHEMA = (
+    ("id", "large_string[pyarrow]", False, "varchar(16)"),
+    ("title", "large_string[pyarrow]", False, "varchar(1200)"),
+    ("selftext", "large_string[pyarrow]", True, "varchar(65535)"),
+    ("score", "int64[pyarrow]", False, "integer"),
+    ("num_comments", "int64[pyarrow]", False, "integer"),
+    # None for deleted accounts
+    ("author", "large_string[pyarrow]", True, "varchar(25)"),
+    ("created_utc", "timestamp[s][pyarrow]", False, "timestamp"),
+    ("url", "large_string[pyarrow]", False, "varchar(2048)"),
+    ("upvote_ratio", "double[pyarrow]", False, "real"),
+    ("over_18", "bool[pyarrow]", False, "boolean"),
+    ("edited", "bool[pyarrow]", False, "boolean"),
+    ("spoiler", "bool[pyarrow]", False, "boolean"),
+    ("stickied", "bool[pyarrow]", False, "boolean"),
+    # Last so it can be added to an existing table with ALTER TABLE ADD COLUMN
+    ("subreddit", "large_string[pyarrow]", False, "varchar(21)"),
+)
+
+POST_FIELDS = tuple(column for column, _, _, _ in POST_SCHEMA)
+
+"""
+Columns of the snapshots of the post metrics that change after the post is
+created, like POST_SCHEMA. A post gets a row when it is first loaded and
+then in every run where one of the metrics changed, snapshot_ts being the
+time of the run
+"""
+POST_SNAPSHOT_SCHEMA = (
+    ("id", "large_string[pyarrow]", False, "varchar(16)"),
+    ("snapshot_ts", "timestamp[s][pyarrow]", False, "timestamp"),
+    ("score", "int64[pyarrow]", False, "integer"),
+    ("num_comments", "int64[pyarrow]", False, "integer"),
+    ("upvote_ratio", "double[pyarrow]", False, "real"),
+)
+
+# The metrics of POST_SNAPSHOT_SCHEMA
+POST_METRIC_FIELDS = ("score", "num_comments", "upvote_ratio")
+
 """
-".." reads one directory up from the "utils" directory so goes to
-/config and then read config.conf in /config
+Columns of the comments, like POST_SCHEMA. Comments are up to 10000
+characters. parent_id is "t3_" and the post id for a top-level comment, "t1_"
+and the comment id for a reply. depth is None for the comments of a
+"continue this thread" link, which praw loads without it
 """
-parser.read(os.path.join(os.path.dirname(__file__), "../config/config.conf"))
-
-REDDIT_SECRET_KEY = parser.get("api_keys", "reddit_secret_key")
-REDDIT_CLIENT_ID = parser.get("api_keys", "reddit_client_id")
-
-DATABASE_HOST = parser.get("database", "database_host")
-DATABASE_NAME = parser.get("database", "database_name")
-DATABASE_PORT = parser.get("database", "database_port")
-DATABASE_USER = parser.get("database", "database_username")
-DATABASE_PASSWORD = parser.get("database", "database_password")
-
-AWS_ACCESS_KEY_ID = parser.get("aws", "aws_access_key_id")
-AWS_SECRET_ACCESS_KEY = parser.get("aws", "aws_secret_access_key")
-AWS_REGION = parser.get("aws", "aws_region")
-AWS_BUCKET_NAME = parser.get("aws", "aws_bucket_name")
-
-# For saving output from DAG input from AWS
-DATA_INPUT_PATH = parser.get("file_paths", "input_path")
-DATA_OUTPUT_PATH = parser.get("file_paths", "output_path")
-
-POST_FIELDS = (
-    "id",
-    "title",
-    "selftext",
-    "score",
-    "num_comments",
-    "author",
-    "created_utc",
-    "url",
-    "upvote_ratio",
-    "over_18",
-    "edited",
-    "spoiler",
-    "stickied",
+COMMENT_SCHEMA = (
+    ("id", "large_string[pyarrow]", False, "varchar(16)"),
+    ("submission_id", "large_string[pyarrow]", False, "varchar(16)"),
+    ("parent_id", "large_string[pyarrow]", False, "varchar(16)"),
+    # None for deleted accounts
+    ("author", "large_string[pyarrow]", True, "varchar(25)"),
+    ("body", "large_string[pyarrow]", False, "varchar(40000)"),
+    ("score", "int64[pyarrow]", False, "integer"),
+    ("created_utc", "timestamp[s][pyarrow]", False, "timestamp"),
+    ("edited", "bool[pyarrow]", False, "boolean"),
+    ("depth", "int64[pyarrow]", True, "integer"),
+    ("subreddit", "large_string[pyarrow]", False, "varchar(21)"),
 )
 
-# Redshift cluster config
-REDSHIFT_HOSTNAME = parser.get("aws", "redshift_hostname")
-REDSHIFT_DB_NAME = parser.get("aws", "redshift_db_name")
-REDSHIFT_PORT = parser.get("aws", "redshift_port")
-REDSHIFT_USERNAME = parser.get("aws", "redshift_username")
-REDSHIFT_PASSWORD = parser.get("aws", "redshift_password")
-REDSHIFT_IAM_ROLE = parser.get("aws", "redshift_iam_role")
+COMMENT_FIELDS = tuple(column for column, _, _, _ in COMMENT_SCHEMA)
@@ -0,0 +1,25 @@
+import importlib
+import inspect
+
+
+def lazy_callable(module_name: str, function_name: str):
+    """
+    python_callable of a PythonOperator running module_name.function_name,
+    imported when the task runs instead of when the DAG file is parsed. The
+    pipeline modules import pandas, pyarrow, praw, s3fs and redshift_connector,
+    which the scheduler would otherwise import on every parse of the DAG
+
+    Airflow passes the whole context to a callable taking **kwargs, only the
+    op_kwargs and context values (e.g. task_instance) the function has a
+    parameter for are passed on
+    """
+
+    def run_task(**context):
+        function = getattr(importlib.import_module(module_name), function_name)
+        parameters = inspect.signature(function).parameters
+        return function(
+            **{name: value for name, value in context.items() if name in parameters}
+        )
+
+    run_task.__name__ = run_task.__qualname__ = function_name
+    return run_task
@@ -0,0 +1,111 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils import constants
+
+
+class PipelineMetrics:
+    """
+    Seconds, rows, bytes and API calls of the stages of one run of a task,
+    e.g. "extract", "transform", "write", "upload" and "copy". The stages can
+    be timed and counted by several threads at once, their seconds are then
+    summed over the threads
+
+    export() pushes the summary to XCom and appends it as one JSON line to
+    METRICS_FILE, so the throughput of the daily runs can be compared
+    """
+
+    def __init__(self, task: str):
+        self.task = task
+        self.started_at = datetime.now(timezone.utc)
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds=0.0, **counts):
+        # Adds seconds and counts (rows, bytes, api_calls, ...) to the stage
+        with self.lock:
+            stage_metrics = self.stages.setdefault(stage, {"seconds": 0.0})
+            stage_metrics["seconds"] += seconds
+            for name, count in counts.items():
+                stage_metrics[name] = stage_metrics.get(name, 0) + count
+
+    @contextlib.contextmanager
+    def time(self, stage: str, **counts):
+        # Times the block as the stage, counts are added once it is done
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time, **counts)
+
+    def iter_timed(self, stage: str, batches):
+        # Yields the batches, timing how long each one takes to get as the
+        # stage and counting its rows, e.g. the requests of the extraction
+        batches = iter(batches)
+        while True:
+            start_time = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                self.add(stage, time.perf_counter() - start_time)
+                return
+            self.add(stage, time.perf_counter() - start_time, rows=len(batch))
+            yield batch
+
+    def summary(self):
+        # Compact JSON summary of the run, with the rows per second of the
+        # stages that have rows
+        with self.lock:
+            stages = {}
+            for stage, stage_metrics in self.stages.items():
+                stages[stage] = {
+                    name: round(value, 3) if isinstance(value, float) else value
+                    for name, value in stage_metrics.items()
+                }
+                if stage_metrics.get("rows") and stage_metrics["seconds"]:
+                    stages[stage]["rows_per_second"] = round(
+                        stage_metrics["rows"] / stage_metrics["seconds"]
+                    )
+
+        return {
+            "task": self.task,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self.start_time, 3),
+            "stages": stages,
+        }
+
+    def describe(self):
+        return ", ".join(
+            f"{stage} {stage_metrics['seconds']:.1f}s"
+            + (f" ({stage_metrics['rows']} rows)" if "rows" in stage_metrics else "")
+            for stage, stage_metrics in self.stages.items()
+        )
+
+    def export(self, task_instance=None, metrics_file=None):
+        """
+        Pushes the summary to XCom with the "metrics" key, if there is a
+        task_instance, and appends it to metrics_file (default: METRICS_FILE)
+        with the run id and map index of the task. Returns the summary
+        """
+        if metrics_file is None:
+            # Read here, not when the module is imported by the DAG file
+            metrics_file = constants.METRICS_FILE
+
+        summary = self.summary()
+        if task_instance is not None:
+            summary["run_id"] = getattr(task_instance, "run_id", None)
+            summary["map_index"] = getattr(task_instance, "map_index", -1)
+            task_instance.xcom_push(key="metrics", value=summary)
+
+        os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+        # One write of a line opened for appending, the lines of mapped tasks
+        # finishing at the same time aren't mixed
+        with open(metrics_file, "a") as file:
+            file.write(json.dumps(summary, separators=(",", ":")) + "\n")
+
+        print(f"{self.task} metrics: {self.describe()}.")
+        return summary